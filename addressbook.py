@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import ios_db
+import phone_numbers
+
+UNKNOWN = "(Unknown)"  # contact_name of numbers not in the address book
+CACHE_VERSION = 2  # Bumped when the keys change
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ios_to_android")
+
+# ABMultiValue property 3 holds phone numbers, 4 email addresses (iMessage handles).
+CONTACT_QUERY = """
+SELECT ABPerson.First, ABPerson.Last, ABPerson.Organization, ABMultiValue.value
+FROM ABMultiValue
+JOIN ABPerson ON ABPerson.ROWID = ABMultiValue.record_id
+WHERE ABMultiValue.property IN (3, 4) AND ABMultiValue.value IS NOT NULL
+ORDER BY ABPerson.ROWID, ABMultiValue.UID
+"""
+
+
+def display_name(first, last, organization):
+    """Returns "First Last", or the organization for company cards, or None."""
+    name = " ".join(part.strip() for part in (first, last) if part and part.strip())
+    return name or (organization or "").strip() or None
+
+
+class ContactIndex:
+    """
+    Normalized phone number / email -> contact name, built from an iOS AddressBook.sqlitedb.
+
+    Numbers are keyed by phone_numbers.match_key(), their full international
+    form, so "+91 98000-00001", "919800000001" and "09800000001" all find
+    the same card while another country's number with the same digits does
+    not. A lookup is one normalization and one dict access.
+
+    Args:
+        names (dict): Normalized address -> display name.
+    """
+
+    def __init__(self, names):
+        self.names = names
+
+    def __len__(self):
+        return len(self.names)
+
+    def name(self, address):
+        """Returns the contact name for a phone number or handle, or "(Unknown)"."""
+        if not address:
+            return UNKNOWN
+        return self.names.get(phone_numbers.match_key(address), UNKNOWN)
+
+    def names_of(self, addresses):
+        """Returns the contact names of several addresses, joined by ", " (as for a group MMS)."""
+        return ", ".join(self.name(address) for address in addresses) or UNKNOWN
+
+    @classmethod
+    def from_database(cls, db_file):
+        """Reads every phone number and email of the address book. The first card with a number wins."""
+        conn = ios_db.connect(db_file)
+        try:
+            names = {}
+            for first, last, organization, value in conn.execute(CONTACT_QUERY):
+                name = display_name(first, last, organization)
+                if name:
+                    names.setdefault(phone_numbers.match_key(str(value)), name)
+        finally:
+            conn.close()
+        return cls(names)
+
+    @classmethod
+    def load(cls, db_file, cache_dir=DEFAULT_CACHE_DIR):
+        """
+        Returns the index of an address book, from the on-disk cache when it is current.
+
+        The cache holds one JSON file per address book, tagged with the
+        database's size and modification time; any change to the database
+        rebuilds it. Each --country-code gets its own file, since the keys
+        depend on it. A cache that cannot be read or written is skipped.
+
+        Args:
+            db_file (str): Path to AddressBook.sqlitedb.
+            cache_dir (str): Where cached indexes are kept (None disables the cache).
+
+        Raises:
+            sqlite3.Error: If the address book cannot be read.
+        """
+        if cache_dir is None:
+            return cls.from_database(db_file)
+        db_file = os.path.abspath(db_file)
+        stat = os.stat(db_file)
+        normalizer = phone_numbers.normalize  # The keys depend on the country rule
+        source = {"path": db_file, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "version": CACHE_VERSION,
+                  "country": [normalizer.country_code, normalizer.national_length]}
+        tag = json.dumps([db_file, source["country"]])  # One file per country rule, for batches that mix them
+        cache_file = os.path.join(cache_dir, "addressbook-" + hashlib.sha1(tag.encode("utf-8")).hexdigest()[:16] + ".json")
+
+        try:
+            with open(cache_file, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            if cached.get("source") == source:
+                return cls(cached["names"])
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass  # Missing or unreadable: rebuild
+
+        index = cls.from_database(db_file)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            temporary = f"{cache_file}.{os.getpid()}.tmp"  # Batch workers may build the same index at once
+            with open(temporary, "w", encoding="utf-8") as f:
+                json.dump({"source": source, "names": index.names}, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(temporary, cache_file)
+        except OSError as e:
+            print(f"Warning: could not cache the address book index in '{cache_dir}': {e}")
+        return index
+
+
+def load_contacts(db_file):
+    """
+    Returns the ContactIndex of an address book given on the command line, or None without one.
+
+    Errors are reported and leave every contact_name at "(Unknown)".
+    """
+    if not db_file:
+        return None
+    if not os.path.exists(db_file):
+        print(f"Error: Address book '{db_file}' not found. Contact names will not be filled in.")
+        return None
+    try:
+        contacts = ContactIndex.load(db_file)
+    except Exception as e:
+        print(f"Error reading address book '{db_file}': {e}. Contact names will not be filled in.")
+        return None
+    print(f"Address book: {len(contacts)} numbers and addresses.")
+    return contacts
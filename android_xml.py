@@ -0,0 +1,333 @@
+import re
+import xml.parsers.expat
+import compressed
+from collections import namedtuple
+from instrumentation import metrics
+
+READ_CHUNK_SIZE = 1 << 20  # Bytes fed to the XML parser at a time
+
+ParseError = xml.parsers.expat.ExpatError
+
+SmsScan = namedtuple("SmsScan", ["latest_timestamp", "latest_by_address", "count"])
+
+
+def _read_chunks(xml_file):
+    # Yields the file READ_CHUNK_SIZE bytes at a time, then b"". A damaged
+    # compressed backup is reported like damaged XML, as a ParseError.
+    try:
+        with compressed.open_file(xml_file, "rb") as f:
+            while True:
+                chunk = f.read(READ_CHUNK_SIZE)
+                yield chunk
+                if not chunk:
+                    break
+    except compressed.DecompressionError as e:
+        raise ParseError(str(e)) from e
+
+
+def iter_elements(xml_file, tags):
+    """
+    Yields (tag, attributes) for every element of an SMS Backup & Restore XML
+    file whose tag is in tags, without building a tree.
+
+    The file is fed to expat in fixed-size chunks, so memory use does not
+    depend on the file size. Other elements (MMS parts with base64 payloads,
+    address lists) are parsed and immediately dropped.
+
+    Raises:
+        ParseError: If the file is not well-formed XML, or is a damaged compressed file.
+    """
+    tags = frozenset(tags)
+    found = []
+
+    def start_element(name, attributes):
+        if name in tags:
+            found.append((name, attributes))
+
+    parser = xml.parsers.expat.ParserCreate()
+    parser.StartElementHandler = start_element
+    for chunk in _read_chunks(xml_file):
+        parser.Parse(chunk, not chunk)
+        yield from found
+        found.clear()
+
+
+def iter_raw_elements(xml_file):
+    """
+    Yields (tag, attributes, raw) for every element directly under the root
+    of an SMS Backup & Restore XML file, raw being its exact bytes (an <mms>
+    with all its parts), so it can be copied to another file unchanged.
+
+    Only the element being read is kept in memory, so huge files stream
+    through. An element ends where the next one (or the root's end tag)
+    starts, minus the whitespace in between.
+
+    Raises:
+        ParseError: If the file is not well-formed XML, or is a damaged compressed file.
+    """
+    parser = xml.parsers.expat.ParserCreate()
+    buffer = bytearray()
+    buffer_start = 0  # File offset of buffer[0]
+    depth = 0
+    current = None  # (tag, attributes, start offset) of the open top-level element
+    finished = []
+    last_end = 0  # File offset where the last finished element ended
+
+    def boundary(offset):
+        nonlocal current
+        if current is not None:
+            finished.append((*current, offset))
+            current = None
+
+    def start_element(name, attributes):
+        nonlocal depth, current
+        if depth == 1:
+            boundary(parser.CurrentByteIndex)
+            current = (name, attributes, parser.CurrentByteIndex)
+        depth += 1
+
+    def end_element(name):
+        nonlocal depth
+        depth -= 1
+        if depth == 0:
+            boundary(parser.CurrentByteIndex)
+
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    for chunk in _read_chunks(xml_file):
+        buffer += chunk
+        parser.Parse(chunk, not chunk)
+        for tag, attributes, start, end in finished:
+            yield tag, attributes, bytes(buffer[start - buffer_start:end - buffer_start]).rstrip()
+            last_end = end
+        finished.clear()
+        # Drop what has been yielded; expat may not have reported the start of the next element yet.
+        keep_from = current[2] if current is not None else last_end
+        del buffer[:keep_from - buffer_start]
+        buffer_start = keep_from
+
+
+def scan_sms_dates(xml_file):
+    """
+    Streams an SMS Backup & Restore XML file and collects the dates of its 'sms' elements.
+
+    Returns:
+        SmsScan: The latest 'date' overall (-1 if there is none), the latest
+                 'date' per 'address', and the number of 'sms' elements seen.
+
+    Raises:
+        ParseError: If the file is not well-formed XML, or is a damaged compressed file.
+    """
+    latest_timestamp = -1
+    latest_by_address = {}
+    count = 0
+    for _, attributes in iter_elements(xml_file, ("sms",)):
+        count += 1
+        date_str = attributes.get("date")
+        if not date_str:
+            continue
+        try:
+            date_timestamp = int(date_str)
+        except ValueError:
+            metrics.error("invalid date in the Android backup", date_str)
+            continue  # Continue processing other elements even if one is invalid
+        latest_timestamp = max(latest_timestamp, date_timestamp)
+        address = attributes.get("address", "")
+        if date_timestamp > latest_by_address.get(address, -1):
+            latest_by_address[address] = date_timestamp
+    return SmsScan(latest_timestamp, latest_by_address, count)
+
+
+WRITE_BUFFER_SIZE = 1 << 20  # Bytes buffered before each write to the output file
+COUNT_PLACEHOLDER_WIDTH = 20  # Characters reserved for count="..." when the count is not known up front
+
+
+_NEEDS_ESCAPE = re.compile(r'[&<>"\r\n\t]')
+_SEPARATOR = "\x1f"  # Joins the values of one element so they are escaped together
+
+
+def escape_attribute(text):
+    """Escapes an attribute value exactly like xml.etree.ElementTree does."""
+    if _NEEDS_ESCAPE.search(text) is None:  # Most values (numbers, dates) need nothing
+        return text
+    return (text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace("\"", "&quot;")
+            .replace("\r", "&#13;").replace("\n", "&#10;").replace("\t", "&#09;"))
+
+
+# escape_attribute() as pyarrow.compute replacements, in the same order.
+_ESCAPES = (("&", "&amp;"), ("<", "&lt;"), (">", "&gt;"), ("\"", "&quot;"), ("\r", "&#13;"), ("\n", "&#10;"),
+            ("\t", "&#09;"))
+
+
+def _escape_column(column):
+    import pyarrow.compute as pc
+    for character, replacement in _ESCAPES:
+        column = pc.replace_substring(column, character, replacement)
+    return column
+
+
+class ElementFormat:
+    """
+    Pre-rendered layout of one kind of element, e.g. <sms> or <call>.
+
+    Attributes with a fixed value are escaped once, when the format is built;
+    render() only escapes and fills in the variable ones.
+
+    Args:
+        tag (str): Element name.
+        attributes (sequence): (name, value) pairs in output order; a value of
+            None marks a variable attribute supplied to render().
+        level (int): Nesting depth: 1 for the elements under the root, 2 for
+            <parts>/<addrs> inside an <mms>, and so on.
+        end (str): What follows the attributes: " />" for an empty element,
+            ">" for one with children, or the start of a further attribute
+            (e.g. ' data="') whose value is streamed with write_bytes().
+    """
+
+    def __init__(self, tag, attributes, level=1, end=" />"):
+        self.tag = tag
+        self.level = level
+        self.names = tuple(name for name, value in attributes if value is None)
+        parts = []
+        literals = ["\n" + "  " * level + f"<{tag}"]  # The text around the variable values, for render_columns()
+        for name, value in attributes:
+            if value is None:
+                parts.append(f' {name}="%s"')
+                literals[-1] += f' {name}="'
+                literals.append('"')
+            else:
+                parts.append(f' {name}="{escape_attribute(value).replace("%", "%%")}"')
+                literals[-1] += f' {name}="{escape_attribute(value)}"'
+        literals[-1] += end
+        self._literals = tuple(literals)
+        self._template = "\n" + "  " * level + f"<{tag}" + "".join(parts) + end.replace("%", "%%")
+
+    def render(self, values):
+        """Serializes one element (with its leading newline and indentation) from the variable values, in order."""
+        # Check and escape all values in one go: most rows need no escaping at all.
+        joined = _SEPARATOR.join(values)
+        if _NEEDS_ESCAPE.search(joined) is None:
+            return self._template % tuple(values)
+        if joined.count(_SEPARATOR) == len(values) - 1:
+            return self._template % tuple(escape_attribute(joined).split(_SEPARATOR))
+        return self._template % tuple(map(escape_attribute, values))
+
+    def render_columns(self, columns):
+        """
+        Serializes a batch of elements at once, like render() on each row.
+
+        Escaping and joining run in pyarrow, column by column, with no
+        Python code per row.
+
+        Args:
+            columns (sequence): pyarrow string arrays of the variable values, in order, without nulls.
+
+        Returns:
+            pyarrow.StringArray: One element per row, for BackupWriter.write_elements().
+        """
+        import pyarrow.compute as pc
+        pieces = [self._literals[0]]
+        for column, literal in zip(columns, self._literals[1:]):
+            pieces += [_escape_column(column), literal]
+        return pc.binary_join_element_wise(*pieces, "")
+
+
+class BackupWriter:
+    """
+    Writes an SMS Backup & Restore XML file one element at a time.
+
+    Elements are serialized straight to a buffered file, so memory use does
+    not grow with the number of rows. The layout matches what ElementTree
+    produced after indent(): one element per line, two-space indentation.
+
+    If count is not given, the root tag is written with a fixed-width
+    placeholder that close() overwrites with the real count (padded with
+    whitespace inside the tag, which XML allows), so rows can be written in
+    a single pass.
+
+    Args:
+        xml_file (str): Output path.
+        root_tag (str): 'smses' or 'calls'.
+        count (int): Number of elements that will be written, if known.
+    """
+
+    def __init__(self, xml_file, root_tag, count=None):
+        self.root_tag = root_tag
+        self.count = 0
+        self._declared_count = count
+        self._file = open(xml_file, "wb", buffering=WRITE_BUFFER_SIZE)
+        self._file.write(b"<?xml version='1.0' encoding='utf-8'?>\n")
+        self._count_offset = self._file.tell()
+        self._file.write(self._root_start(count).encode("utf-8"))
+
+    def _root_start(self, count):
+        if count is not None and self._declared_count is not None:
+            return f'<{self.root_tag} count="{count}">'
+        count_attribute = f'count="{count or 0}"'
+        return f'<{self.root_tag} {count_attribute.ljust(COUNT_PLACEHOLDER_WIDTH)}>'
+
+    def write(self, element_format, values):
+        """
+        Writes one element of the given ElementFormat from its variable attribute values.
+
+        Only elements directly under the root (level 1) are counted.
+        """
+        self._file.write(element_format.render(values).encode("utf-8"))
+        if element_format.level == 1:
+            self.count += 1
+
+    def write_rendered(self, data):
+        """Writes one top-level element already rendered with ElementFormat.render() and encoded to UTF-8."""
+        self._file.write(data)
+        self.count += 1
+
+    def write_elements(self, elements):
+        """Writes top-level elements rendered by ElementFormat.render_columns() straight from their buffer."""
+        if len(elements):
+            _, offsets, data = elements.buffers()
+            offsets = memoryview(offsets).cast("i")  # int32 string offsets
+            self._file.write(memoryview(data)[offsets[elements.offset]:offsets[elements.offset + len(elements)]])
+        self.count += len(elements)
+
+    def write_raw(self, raw):
+        """Writes one complete top-level element given as bytes, e.g. from iter_raw_elements()."""
+        self._file.write(b"\n  " + raw)
+        self.count += 1
+
+    def write_end(self, tag, level=1):
+        """Closes an element written with end=">"."""
+        self._file.write(("\n" + "  " * level + f"</{tag}>").encode("utf-8"))
+
+    def write_bytes(self, data):
+        """Writes raw, already escaped output, e.g. a chunk of a streamed base64 attribute value."""
+        self._file.write(data)
+
+    def _end(self):
+        return f"\n</{self.root_tag}>\n".encode("utf-8")
+
+    @property
+    def size(self):
+        """Size in bytes the file would have if it were closed now."""
+        return self._file.tell() + len(self._end())
+
+    def close(self):
+        """Finishes the document and fixes up the root count. Returns the number of elements written."""
+        if self._file.closed:
+            return self.count
+        self._file.write(self._end())
+        if self._declared_count is None:
+            self._file.seek(self._count_offset)
+            self._file.write(self._root_start(self.count).encode("utf-8"))
+        elif self._declared_count != self.count:
+            print(f"Warning: wrote {self.count} elements but the root count says {self._declared_count}.")
+        self._file.close()
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
@@ -0,0 +1,209 @@
+import datetime
+import time
+from instrumentation import metrics
+
+# numpy is imported inside the vectorized functions below, so scripts that only
+# format single dates (or exit early) do not pay for importing it.
+
+# iOS stores dates relative to the Core Data / Cocoa epoch, 2001-01-01 00:00:00 UTC:
+# sms.db in nanoseconds (integers), CallHistory in seconds (floats).
+APPLE_EPOCH = 978307200  # 2001-01-01 00:00:00 UTC as a Unix timestamp
+NANOSECONDS = 1000000000
+
+READABLE_FORMAT = "%d %b %Y %l:%M:%S%p"  # e.g. "05 Mar 2023  1:02:03 pm" once AM/PM is lowered
+INVALID_DATE = "Invalid Date"
+
+# datetime supports years 1-9999; keep a day of margin for the local UTC offset.
+MIN_SECONDS = -62135596800 + 86400
+MAX_SECONDS = 253402300800 - 86400
+
+
+def _lower_ampm(text):
+    return text.replace("AM", "am").replace("PM", "pm").replace("am", " am").replace("pm", " pm")
+
+
+def format_readable(unix_seconds):
+    """Formats a Unix timestamp in local time the way SMS Backup & Restore shows readable_date."""
+    return _lower_ampm(datetime.datetime.fromtimestamp(unix_seconds).strftime(READABLE_FORMAT))
+
+
+def message_date(date, rowid=None):
+    """
+    Converts an sms.db date (nanoseconds since 2001) to (Java ms timestamp, readable date).
+
+    Returns (0, "Invalid Date") if the value cannot be converted.
+    """
+    try:
+        unix_seconds = int((date + APPLE_EPOCH * NANOSECONDS) / NANOSECONDS)
+        date_obj = datetime.datetime.fromtimestamp(unix_seconds)
+        return int(date_obj.timestamp() * 1000), _lower_ampm(date_obj.strftime(READABLE_FORMAT))
+    except Exception as e:
+        metrics.error("invalid date", f"ROWID {rowid}: {e}")
+        return 0, INVALID_DATE
+
+
+def call_date(date, rowid=None):
+    """
+    Converts a CallHistory ZDATE (seconds since 2001) to (Java ms timestamp, readable date).
+
+    Returns (0, "Invalid Date") if the value cannot be converted.
+    """
+    try:
+        date_obj = datetime.datetime.fromtimestamp(date + float(APPLE_EPOCH))
+        return int(date_obj.timestamp()) * 1000, _lower_ampm(date_obj.strftime(READABLE_FORMAT))
+    except Exception as e:
+        metrics.error("invalid date", f"ROWID {rowid}: {e}")
+        return 0, INVALID_DATE
+
+
+def _distinct(values):
+    """
+    Returns (distinct values, index of each value in them) for an int64 array.
+
+    Timestamps from one phone cover a narrow range, so values are bucketed by
+    offset from the minimum instead of sorted; wide ranges fall back to np.unique.
+    """
+    import numpy as np
+    low = int(values.min())
+    span = int(values.max()) - low + 1
+    if span > 4 * len(values) + 100000:
+        return np.unique(values, return_inverse=True)
+    present = np.zeros(span, dtype=bool)
+    present[values - low] = True
+    distinct = np.flatnonzero(present)
+    position = np.cumsum(present) - 1
+    return distinct + low, position[values - low]
+
+
+def _utc_offsets(unix_seconds):
+    """
+    Returns the local UTC offset (seconds) of each timestamp.
+
+    time.localtime() is only called twice per distinct hour: offsets change at
+    most once in an hour, so an hour whose first and last second agree has a
+    single offset. The few hours containing a DST switch are resolved per row.
+    """
+    import numpy as np
+    hours, inverse = _distinct(unix_seconds // 3600)
+    first = np.empty(len(hours), dtype=np.int64)
+    last = np.empty(len(hours), dtype=np.int64)
+    for i, hour in enumerate(hours.tolist()):
+        first[i] = time.localtime(hour * 3600).tm_gmtoff
+        last[i] = time.localtime(hour * 3600 + 3599).tm_gmtoff
+    offsets = first[inverse]
+    for i in np.flatnonzero(offsets != last[inverse]).tolist():
+        offsets[i] = time.localtime(int(unix_seconds[i])).tm_gmtoff
+    return offsets
+
+
+_time_of_day_labels = None
+
+
+def _time_labels():
+    """
+    Returns the formatted time of day (" 1:02:03 pm") for each second of the day.
+
+    The hour and AM/PM parts come from strftime so locale settings are honoured;
+    minutes and seconds are plain digits. Built once per process.
+    """
+    global _time_of_day_labels
+    import numpy as np
+    if _time_of_day_labels is None:
+        labels = []
+        for hour in range(24):
+            hour_label, ampm = datetime.time(hour).strftime("%l|%p").split("|")
+            for minute in range(60):
+                for second in range(60):
+                    labels.append(f"{hour_label}:{minute:02d}:{second:02d}{ampm}")
+        _time_of_day_labels = np.array([_lower_ampm(label) for label in labels], dtype=object)
+    return _time_of_day_labels
+
+
+def _readable_dates(unix_seconds):
+    """
+    Formats whole-second Unix timestamps like format_readable(), vectorized.
+
+    Each distinct local day is formatted once with strftime and each second of
+    the day comes from a fixed table; the per-row strings are then assembled by
+    lookup.
+    """
+    import numpy as np
+    local = unix_seconds + _utc_offsets(unix_seconds)
+    days, day_index = _distinct(local // 86400)
+    epoch = datetime.date(1970, 1, 1)
+    day_labels = np.array([_lower_ampm((epoch + datetime.timedelta(days=day)).strftime("%d %b %Y "))
+                           for day in days.tolist()], dtype=object)
+    return day_labels[day_index] + _time_labels()[local % 86400]
+
+
+def _finish(unix_seconds, valid, rowids):
+    """Builds (Java ms array, readable array) and reports rows that could not be converted."""
+    import numpy as np
+    valid = valid & (unix_seconds >= MIN_SECONDS) & (unix_seconds <= MAX_SECONDS)
+    if valid.all():
+        seconds = unix_seconds.astype(np.int64)
+        if not len(seconds):
+            return seconds, np.empty(0, dtype=object)
+        return seconds * 1000, _readable_dates(seconds)
+    java = np.zeros(len(valid), dtype=np.int64)
+    readable = np.full(len(valid), INVALID_DATE, dtype=object)
+    seconds = unix_seconds[valid].astype(np.int64)
+    java[valid] = seconds * 1000
+    if len(seconds):
+        readable[valid] = _readable_dates(seconds)
+    for i in np.flatnonzero(~valid).tolist():
+        rowid = rowids[i] if rowids is not None else None
+        metrics.error("invalid date", f"ROWID {rowid}")
+    return java, readable
+
+
+def message_dates(dates, rowids=None):
+    """
+    Vectorized message_date(): converts a column of sms.db dates in one pass.
+
+    Args:
+        dates (sequence): Nanoseconds since 2001 (None for missing values).
+        rowids (sequence): Optional ROWIDs used when reporting invalid dates.
+
+    Returns:
+        tuple: (numpy int64 array of Java ms timestamps, numpy object array of readable dates)
+    """
+    import numpy as np
+    try:
+        values = np.array(dates, dtype=np.int64)
+        valid = np.ones(len(values), dtype=bool)
+    except TypeError:  # Missing (None) dates
+        valid = np.array([date is not None for date in dates], dtype=bool)
+        values = np.array([0 if date is None else date for date in dates], dtype=np.int64)
+    # Matches int((date + epoch_ns) / 1e9): the float sum of the whole and fractional
+    # seconds rounds exactly like Python's correctly rounded int division.
+    shifted = values + APPLE_EPOCH * NANOSECONDS
+    unix_seconds = np.trunc((shifted // NANOSECONDS).astype(np.float64) + (shifted % NANOSECONDS) / NANOSECONDS)
+    return _finish(unix_seconds, valid, rowids)
+
+
+def call_dates(dates, rowids=None):
+    """
+    Vectorized call_date(): converts a column of CallHistory ZDATE values in one pass.
+
+    Args:
+        dates (sequence): Seconds since 2001 (None for missing values).
+        rowids (sequence): Optional Z_PKs used when reporting invalid dates.
+
+    Returns:
+        tuple: (numpy int64 array of Java ms timestamps, numpy object array of readable dates)
+    """
+    import numpy as np
+    try:
+        values = np.array(dates, dtype=np.float64) + float(APPLE_EPOCH)
+    except TypeError:  # Missing (None) dates
+        values = np.array([np.nan if date is None else date for date in dates], dtype=np.float64) + float(APPLE_EPOCH)
+    valid = np.isfinite(values)
+    values = np.where(valid, values, 0.0)
+    # datetime.fromtimestamp() rounds to whole microseconds (half to even) before
+    # the seconds are truncated, so a value within half a microsecond of the next
+    # second lands on it.
+    whole = np.trunc(values)
+    micros = np.round((values - whole) * 1e6)
+    whole = whole + (micros >= 1e6) - (micros < 0)
+    return _finish(whole, valid, rowids)
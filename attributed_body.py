@@ -0,0 +1,141 @@
+import argparse
+import sys
+import ios_db
+
+# Nearly every attributedBody blob written by Messages is an NSAttributedString
+# whose first archived object is a plain NSString. In that layout the text sits
+# right after a fixed run of class/type headers, so it can be sliced out of the
+# bytes directly instead of unarchiving the whole object graph.
+STRING_PREFIX = (
+    b"\x04\x0bstreamtyped\x81\xe8\x03"                       # stream header, system version 1000
+    b"\x84\x01@"                                             # root object type "@"
+    b"\x84\x84\x84\x12NSAttributedString\x00"                # class NSAttributedString, version 0
+    b"\x84\x84\x08NSObject\x00\x85"                          # superclass NSObject, end of class chain
+    b"\x92"                                                  # content type "@" (back-reference)
+    b"\x84\x84\x84\x08NSString\x01\x94"                      # first content: NSString, version 1
+    b"\x84\x01+"                                             # value type "+" (length-prefixed bytes)
+)
+END_OF_OBJECT = 0x86
+
+INT16_TAG = 0x81  # Length stored in the next 2 bytes, little-endian
+INT32_TAG = 0x82  # Length stored in the next 4 bytes, little-endian
+
+
+class DecoderStats:
+    """Counts how many blobs were decoded by the fast path and by typedstream."""
+
+    def __init__(self, fast_path=0, fallback=0):
+        self.fast_path = fast_path
+        self.fallback = fallback
+
+    def merge(self, other):
+        self.fast_path += other.fast_path
+        self.fallback += other.fallback
+
+    def __str__(self):
+        total = self.fast_path + self.fallback
+        rate = 100 * self.fast_path / total if total else 0.0
+        return f"{self.fast_path} fast path, {self.fallback} typedstream fallback ({rate:.1f}% hit rate)"
+
+
+stats = DecoderStats()  # Totals for the current process
+
+
+def decode_fast(blob):
+    """
+    Extracts the text of an attributedBody blob without building the object graph.
+
+    Returns:
+        str: The message text, or None if the blob does not use the common layout.
+    """
+    if not blob.startswith(STRING_PREFIX):
+        return None
+    view = memoryview(blob)
+    pos = len(STRING_PREFIX)
+    try:
+        tag = view[pos]  # Byte length of the UTF-8 text
+        if tag == INT16_TAG:
+            length = int.from_bytes(view[pos + 1:pos + 3], "little", signed=True)
+            pos += 3
+        elif tag == INT32_TAG:
+            length = int.from_bytes(view[pos + 1:pos + 5], "little", signed=True)
+            pos += 5
+        elif tag < 0x80:
+            length = tag
+            pos += 1
+        else:
+            return None
+        end = pos + length
+        if length < 0 or view[end] != END_OF_OBJECT:
+            return None
+        return str(view[pos:end], "utf-8")
+    except (IndexError, UnicodeDecodeError):
+        return None
+
+
+def decode_typedstream(blob):
+    """Extracts the text of an attributedBody blob by fully unarchiving it."""
+    import typedstream  # Only needed for blobs the fast path does not recognize
+    return typedstream.unarchive_from_data(blob).contents[0].value.value
+
+
+def decode(blob, counts=stats):
+    """
+    Returns the message text stored in an attributedBody blob.
+
+    The fast path handles the common layout; anything else goes through
+    typedstream, whose exceptions propagate to the caller.
+
+    Args:
+        blob (bytes): The attributedBody value.
+        counts (DecoderStats): Where to record which path was used.
+    """
+    body = decode_fast(blob)
+    if body is not None:
+        counts.fast_path += 1
+        return body
+    counts.fallback += 1
+    return decode_typedstream(blob)
+
+
+def compare_paths(db_file, limit=None):
+    """
+    Runs both decoders over every attributedBody in an sms.db and reports mismatches.
+
+    Returns:
+        int: Number of blobs where the fast path disagreed with typedstream.
+    """
+    conn = ios_db.connect(db_file)
+    query = "SELECT ROWID, attributedBody FROM message WHERE attributedBody IS NOT NULL"
+    if limit:
+        query += f" LIMIT {int(limit)}"
+    checked = recognized = mismatches = 0
+    for rowid, blob in conn.execute(query):
+        checked += 1
+        fast = decode_fast(blob)
+        if fast is None:
+            continue
+        recognized += 1
+        try:
+            expected = decode_typedstream(blob)
+        except Exception as e:
+            expected = f"<typedstream error: {e}>"
+        if fast != expected:
+            mismatches += 1
+            print(f"Mismatch for ROWID {rowid}: fast path {fast!r}, typedstream {expected!r}")
+    conn.close()
+    print(f"Checked {checked} blobs: {recognized} recognized by the fast path, {mismatches} mismatches.")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the fast attributedBody decoder against typedstream on an sms.db.")
+    parser.add_argument("db_file", help="Path to the iOS sms.db file")
+    parser.add_argument("-n", "--limit", type=int, default=None, help="Only check the first N blobs")
+
+    args = parser.parse_args()
+    sys.exit(1 if compare_paths(args.db_file, args.limit) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import heapq
+import os
+import struct
+from operator import itemgetter
+import android_xml
+from instrumentation import metrics
+
+# Backup elements are sorted in memory this many raw bytes at a time; larger
+# backups are split into sorted runs on disk that heapq.merge() reads back
+# one element at a time, so memory use does not grow with the backup.
+RUN_BYTES = 64 << 20
+RUN_BUFFER_SIZE = 1 << 16  # Read buffer per run file
+_RECORD_HEADER = struct.Struct("<qQ")  # date, length of the raw element
+
+
+def element_date(attributes):
+    """Returns the 'date' attribute of a backup element as an int (0 if missing or invalid)."""
+    try:
+        return int(attributes.get("date", 0))
+    except ValueError:
+        metrics.error("invalid date in the Android backup", attributes.get("date"))
+        return 0
+
+
+def _spill(run, path):
+    # Writes a sorted run to disk and returns a generator reading it back.
+    with open(path, "wb") as f:
+        for date, raw in run:
+            f.write(_RECORD_HEADER.pack(date, len(raw)))
+            f.write(raw)
+    return _read_run(path)
+
+
+def _read_run(path):
+    with open(path, "rb", buffering=RUN_BUFFER_SIZE) as f:
+        while True:
+            header = f.read(_RECORD_HEADER.size)
+            if not header:
+                break
+            date, length = _RECORD_HEADER.unpack(header)
+            yield date, f.read(length)
+
+
+def backup_runs(xml_file, directory, run_bytes=RUN_BYTES):
+    """
+    Splits the elements of an Android backup into date-sorted runs.
+
+    Elements keep their exact bytes (see android_xml.iter_raw_elements()).
+    Every full run is sorted and written to a file in directory; the last
+    one stays in memory, so a backup smaller than run_bytes is never copied.
+    Sorting is stable: elements with the same date keep their order.
+
+    Returns:
+        list: The runs, each an iterable of (date, raw element) in date order.
+
+    Raises:
+        android_xml.ParseError: If the backup is not well-formed XML.
+    """
+    runs = []
+    run = []
+    size = 0
+    for _, attributes, raw in android_xml.iter_raw_elements(xml_file):
+        run.append((element_date(attributes), raw))
+        size += len(raw)
+        if size >= run_bytes:
+            run.sort(key=itemgetter(0))
+            runs.append(_spill(run, os.path.join(directory, f"run{len(runs)}.bin")))
+            run = []
+            size = 0
+    run.sort(key=itemgetter(0))
+    runs.append(run)
+    return runs
+
+
+def merge(runs, items, date):
+    """
+    Merges backup runs and new items into one date-ordered stream.
+
+    Both must already be in date order. Backup elements come first when
+    dates are equal, so the phone's own copy stays ahead of a converted one.
+
+    Args:
+        runs (list): From backup_runs().
+        items (iterable): New rows, in date order.
+        date (callable): Returns the Java timestamp of an item.
+
+    Yields:
+        Raw backup elements (bytes) and items, in date order.
+    """
+    dated_items = ((date(item), item) for item in items)
+    for _, payload in heapq.merge(*runs, dated_items, key=itemgetter(0)):
+        yield payload
@@ -0,0 +1,186 @@
+import argparse
+import contextlib
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import addressbook
+import ios_to_android
+import phone_numbers
+from instrumentation import metrics
+
+MANIFEST_FIELDS = ["name", "sms_db", "call_db", "android_xml", "self_number", "output_dir", "dedup", "checkpoint", "addressbook",
+                   "country_code"]
+DEDUP_MODES = ("cutoff", "content")  # As for ios_to_android.py sms -d
+LOG_FILE = "convert.log"  # Written to each job's output_dir
+
+
+def read_manifest(manifest_file):
+    """
+    Reads the list of backups to convert.
+
+    A .json manifest holds a list of objects (or {"jobs": [...]}); anything
+    else is read as CSV with a header row. Each job has an output_dir and at
+    least one of sms_db and call_db; android_xml, self_number, dedup
+    ('cutoff' or 'content'), checkpoint, addressbook, country_code (see
+    phone_numbers.country_rule()) and name are optional. Empty values
+    count as missing.
+
+    Returns:
+        list: One dictionary per job, with every field in MANIFEST_FIELDS present.
+
+    Raises:
+        ValueError: If a job is missing a required field or has an invalid value.
+    """
+    if manifest_file.lower().endswith(".json"):
+        with open(manifest_file, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        if isinstance(entries, dict):
+            entries = entries.get("jobs", [])
+    else:
+        with open(manifest_file, "r", newline="", encoding="utf-8") as f:
+            entries = list(csv.DictReader(f))
+
+    jobs = []
+    for number, entry in enumerate(entries, start=1):
+        job = {field: (str(entry[field]).strip() if entry.get(field) not in (None, "") else None)
+               for field in MANIFEST_FIELDS}
+        if not job["output_dir"]:
+            raise ValueError(f"Job {number} in '{manifest_file}' has no output_dir.")
+        if not job["sms_db"] and not job["call_db"]:
+            raise ValueError(f"Job {number} in '{manifest_file}' has neither sms_db nor call_db.")
+        if job["dedup"] and job["dedup"] not in DEDUP_MODES:
+            raise ValueError(f"Job {number} in '{manifest_file}' has an invalid dedup '{job['dedup']}' "
+                             f"(expected {' or '.join(DEDUP_MODES)}).")
+        if job["dedup"] == "content" and not job["android_xml"]:
+            raise ValueError(f"Job {number} in '{manifest_file}' has dedup 'content' but no android_xml to match against.")
+        if job["country_code"]:
+            try:
+                phone_numbers.country_rule(job["country_code"])
+            except argparse.ArgumentTypeError as e:
+                raise ValueError(f"Job {number} in '{manifest_file}' has an invalid country_code: {e}")
+        job["name"] = job["name"] or os.path.basename(os.path.normpath(job["output_dir"]))
+        jobs.append(job)
+    return jobs
+
+
+def run_job(job):
+    """
+    Converts the SMS and call history of one backup. Runs in a worker process.
+
+    The pipelines' progress messages go to convert.log in the job's output
+    directory. Nothing is asked interactively.
+
+    Returns:
+        dict: The job summary: name, status ('ok' or 'failed'), error, duration
+              and the row counts of each pipeline that ran.
+    """
+    start = time.perf_counter()
+    summary = {"name": job["name"], "status": "ok", "error": None}
+    errors = []
+    metrics.reset()  # Worker processes are reused across jobs
+    if job["country_code"]:
+        phone_numbers.set_country(*phone_numbers.country_rule(job["country_code"]))
+    else:
+        phone_numbers.set_country()
+    try:
+        os.makedirs(job["output_dir"], exist_ok=True)
+        with open(os.path.join(job["output_dir"], LOG_FILE), "w", encoding="utf-8") as log, \
+                contextlib.redirect_stdout(log):
+            # The address book index is cached on disk, so jobs sharing one only build it once.
+            contacts = addressbook.load_contacts(job["addressbook"])
+            # The two pipelines are independent: a broken sms.db still gets its calls converted.
+            if job["sms_db"]:
+                try:
+                    summary["sms"] = ios_to_android.convert_sms(
+                        job["sms_db"], os.path.join(job["output_dir"], "sms.xml"),
+                        backup_file=job["android_xml"], dedup_mode=job["dedup"] or "cutoff",
+                        checkpoint_file=job["checkpoint"], contacts=contacts)
+                    if not summary["sms"]:
+                        errors.append(f"SMS conversion failed, see {LOG_FILE}")
+                except Exception as e:
+                    errors.append(f"SMS conversion failed: {type(e).__name__}: {e}")
+            if job["call_db"]:
+                try:
+                    summary["calls"] = ios_to_android.convert_calls(
+                        job["call_db"], os.path.join(job["output_dir"], "call_logs.xml"),
+                        self_number=job["self_number"] or "", checkpoint_file=job["checkpoint"], contacts=contacts)
+                    if not summary["calls"]:
+                        errors.append(f"call log conversion failed, see {LOG_FILE}")
+                except Exception as e:
+                    errors.append(f"call log conversion failed: {type(e).__name__}: {e}")
+            metrics.report_errors()
+            metrics.report()
+    except OSError as e:
+        errors.append(f"{type(e).__name__}: {e}")
+    if errors:
+        summary["status"] = "failed"
+        summary["error"] = "; ".join(errors)
+    summary["duration"] = round(time.perf_counter() - start, 3)
+    return summary
+
+
+def run_batch(jobs, max_workers=None):
+    """
+    Runs every job in a process pool of at most max_workers processes.
+
+    A job that fails (or crashes its worker) is reported in its summary and
+    does not stop the others.
+
+    Returns:
+        list: Job summaries, in manifest order.
+    """
+    summaries = [None] * len(jobs)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(run_job, job): index for index, job in enumerate(jobs)}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                summary = future.result()
+            except Exception as e:
+                summary = {"name": jobs[index]["name"], "status": "failed", "error": f"{type(e).__name__}: {e}", "duration": None}
+            summaries[index] = summary
+            print(f"[{sum(s is not None for s in summaries)}/{len(jobs)}] {summary['name']}: {summary['status']}"
+                  + (f" ({summary['error']})" if summary["error"] else ""))
+    return summaries
+
+
+def print_summary(summaries):
+    """Prints one line per job and pipeline: rows read, written and skipped, and the job duration."""
+    print(f"{'job':<24} {'kind':<6} {'read':>9} {'written':>9} {'skipped':>9} {'seconds':>8}  status")
+    for summary in summaries:
+        duration = "" if summary["duration"] is None else f"{summary['duration']:.2f}"
+        kinds = [kind for kind in ("sms", "calls") if kind in summary] or ["-"]
+        for kind in kinds:
+            stats = summary.get(kind) or {}
+            skipped = stats.get("rows_skipped", 0) + stats.get("duplicates", 0) if stats else ""
+            print(f"{summary['name']:<24} {kind:<6} {stats.get('rows_read', ''):>9} {stats.get('rows_written', ''):>9} "
+                  f"{skipped:>9} {duration:>8}  {summary['status']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert many iOS backups to SMS Backup & Restore XML files in parallel.")
+    parser.add_argument("manifest", help="CSV or JSON manifest with one job per backup "
+                                         "(fields: sms_db, call_db, android_xml, self_number, output_dir, and optionally name, dedup, checkpoint, addressbook, country_code)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Backups converted at the same time (default: number of CPUs)")
+    parser.add_argument("-s", "--summary", default="batch_summary.json", help="Where to write the per-job summary (default: batch_summary.json)")
+
+    args = parser.parse_args()
+    try:
+        jobs = read_manifest(args.manifest)
+    except (OSError, ValueError) as e:
+        parser.error(f"Could not read manifest: {e}")
+
+    summaries = run_batch(jobs, args.jobs)
+    print_summary(summaries)
+    with open(args.summary, "w", encoding="utf-8") as f:
+        json.dump(summaries, f, indent=2)
+    failed = sum(summary["status"] != "ok" for summary in summaries)
+    print(f"{len(summaries) - failed} of {len(summaries)} jobs succeeded. Summary written to {args.summary}")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
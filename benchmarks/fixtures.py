@@ -0,0 +1,296 @@
+"""
+Synthetic iOS and Android backups for benchmarking.
+
+Real sms.db / CallHistory files cannot be shared, so these generators build
+databases with the same tables and columns the converters read, filled with
+seeded random data shaped like a real phone: a few hundred contacts, a mix
+of plain text and attributedBody messages, iMessage/SMS duplicates, group
+chats, and calls of every type. The same size and seed always give the same
+files.
+
+    python -m benchmarks.fixtures out_dir --size 100000
+"""
+import argparse
+import base64
+import csv
+import os
+import random
+import sqlite3
+from xml.sax.saxutils import escape
+import attributed_body
+
+APPLE_EPOCH_MS = 978307200000
+START_DATE = 600000000  # Seconds since 2001 of the first generated message or call (Jan 2020)
+
+WORDS = ("ok see you soon running late call me when you are free thanks lunch tomorrow at the usual place "
+         "did you get my email happy birthday on my way home can't talk now sounds good love it").split()
+EMOJI = ["", "", "", " 😀", " 👍", " ❤️"]
+SERVICE_PROVIDERS = ["com.apple.Telephony", "com.apple.Telephony", "com.apple.Telephony",
+                     "com.apple.FaceTime", "net.whatsapp.WhatsApp"]
+
+# Attribute run that follows the text in a typical attributedBody: one run
+# covering the whole string, tagged with __kIMMessagePartAttributeName = 0.
+_ATTRIBUTES_HEAD = b"\x84\x02iI\x01"
+_ATTRIBUTES_TAIL = (b"\x92\x84\x84\x84\x0cNSDictionary\x00\x94\x84\x01i\x01\x92\x84\x96\x96"
+                    b"\x1d__kIMMessagePartAttributeName\x86\x92\x84\x84\x84\x08NSNumber\x00"
+                    b"\x84\x84\x07NSValue\x00\x94\x84\x01*\x84\x99\x99\x00\x86\x86\x86")
+
+
+def _typedstream_int(value):
+    if value < 0x80:
+        return bytes([value])
+    if value < 0x8000:
+        return bytes([attributed_body.INT16_TAG]) + value.to_bytes(2, "little")
+    return bytes([attributed_body.INT32_TAG]) + value.to_bytes(4, "little")
+
+
+def attributed_body_blob(text):
+    """Returns an NSAttributedString archive of text, laid out the way Messages stores it."""
+    data = text.encode("utf-8")
+    length = _typedstream_int(len(data))
+    return (attributed_body.STRING_PREFIX + length + data + bytes([attributed_body.END_OF_OBJECT])
+            + _ATTRIBUTES_HEAD + _typedstream_int(len(text)) + _ATTRIBUTES_TAIL)
+
+
+def random_text(rng):
+    words = rng.choices(WORDS, k=rng.choice((1, 2, 3, 5, 8, 13, 21)))
+    return " ".join(words).capitalize() + rng.choice(EMOJI)
+
+
+def _phone_numbers(rng, count):
+    numbers = []
+    for i in range(count):
+        if i % 10 == 0:
+            numbers.append(f"user{i}@icloud.com")
+        elif i % 4 == 0:
+            numbers.append(f"+91{rng.randrange(7000000000, 9999999999)}")
+        else:
+            numbers.append(f"+1{rng.randrange(2000000000, 9999999999)}")
+    return numbers
+
+
+def make_sms_db(path, size, seed=0, contacts=300):
+    """
+    Writes an iOS sms.db with size rows in message.
+
+    About 70% of the messages only have an attributedBody, 5% are the SMS
+    copy of an iMessage with the same date and text, 2% belong to group
+    chats and 1% have neither text nor body.
+    """
+    rng = random.Random(seed)
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        PRAGMA journal_mode = OFF;
+        PRAGMA synchronous = OFF;
+        CREATE TABLE handle (ROWID INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT NOT NULL, service TEXT);
+        CREATE TABLE chat (ROWID INTEGER PRIMARY KEY AUTOINCREMENT, chat_identifier TEXT, display_name TEXT);
+        CREATE TABLE chat_handle_join (chat_id INTEGER, handle_id INTEGER, UNIQUE (chat_id, handle_id));
+        CREATE TABLE message (ROWID INTEGER PRIMARY KEY AUTOINCREMENT, guid TEXT, text TEXT, handle_id INTEGER DEFAULT 0,
+                              service TEXT, date INTEGER, is_from_me INTEGER DEFAULT 0, cache_roomnames TEXT,
+                              attributedBody BLOB, cache_has_attachments INTEGER DEFAULT 0);
+        CREATE TABLE chat_message_join (chat_id INTEGER, message_id INTEGER, message_date INTEGER DEFAULT 0,
+                                        PRIMARY KEY (chat_id, message_id));
+        CREATE TABLE attachment (ROWID INTEGER PRIMARY KEY AUTOINCREMENT, guid TEXT, filename TEXT, mime_type TEXT,
+                                 transfer_name TEXT, total_bytes INTEGER DEFAULT 0);
+        CREATE TABLE message_attachment_join (message_id INTEGER, attachment_id INTEGER, UNIQUE (message_id, attachment_id));
+    """)
+    numbers = _phone_numbers(rng, contacts)
+    conn.executemany("INSERT INTO handle (ROWID, id, service) VALUES (?, ?, ?)",
+                     ((i + 1, number, "iMessage" if "@" in number else "SMS") for i, number in enumerate(numbers)))
+    # One chat per contact, plus a few group chats.
+    conn.executemany("INSERT INTO chat (ROWID, chat_identifier) VALUES (?, ?)",
+                     ((i + 1, number) for i, number in enumerate(numbers)))
+    conn.executemany("INSERT INTO chat_handle_join VALUES (?, ?)", ((i + 1, i + 1) for i in range(contacts)))
+    groups = max(1, contacts // 30)
+    group_members = {}
+    for g in range(groups):
+        chat_id = contacts + g + 1
+        conn.execute("INSERT INTO chat (ROWID, chat_identifier, display_name) VALUES (?, ?, ?)",
+                     (chat_id, f"chat{rng.randrange(10 ** 17, 10 ** 18)}", f"Group {g + 1}"))
+        group_members[chat_id] = rng.sample(range(1, contacts + 1), 4)
+        conn.executemany("INSERT INTO chat_handle_join VALUES (?, ?)", ((chat_id, h) for h in group_members[chat_id]))
+    chat_identifiers = dict(conn.execute("SELECT ROWID, chat_identifier FROM chat"))
+
+    def rows():
+        date = START_DATE * 10 ** 9
+        rowid = 0
+        while rowid < size:
+            rowid += 1
+            date += rng.randrange(1, 600) * 10 ** 9 + rng.randrange(10 ** 9)
+            is_from_me = rng.random() < 0.45
+            if rng.random() < 0.02:
+                chat_id = rng.choice(list(group_members))
+                handle_id = 0 if is_from_me else rng.choice(group_members[chat_id])
+                room = chat_identifiers[chat_id]
+            else:
+                handle_id = rng.randrange(1, contacts + 1)
+                chat_id = handle_id
+                room = None
+            text = random_text(rng)
+            service = "iMessage" if rng.random() < 0.7 else "SMS"
+            roll = rng.random()
+            if roll < 0.01:
+                message_text, blob = None, None
+            elif roll < 0.71:
+                message_text, blob = None, attributed_body_blob(text)
+            else:
+                message_text, blob = text, attributed_body_blob(text)
+            yield (rowid, f"guid-{rowid}", message_text, handle_id, service, date, int(is_from_me), room, blob, chat_id)
+            if rowid < size and room is None and rng.random() < 0.05:
+                rowid += 1  # SMS copy of the same message
+                yield (rowid, f"guid-{rowid}", message_text, handle_id, "SMS", date, int(is_from_me), None, blob, chat_id)
+
+    batch = []
+    for row in rows():
+        batch.append(row)
+        if len(batch) >= 10000:
+            _insert_messages(conn, batch)
+            batch = []
+    _insert_messages(conn, batch)
+    conn.commit()
+    conn.close()
+
+
+def _insert_messages(conn, rows):
+    conn.executemany("INSERT INTO message (ROWID, guid, text, handle_id, service, date, is_from_me, cache_roomnames, attributedBody) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (row[:9] for row in rows))
+    conn.executemany("INSERT INTO chat_message_join (chat_id, message_id, message_date) VALUES (?, ?, ?)",
+                     ((row[9], row[0], row[5]) for row in rows))
+
+
+def make_call_db(path, size, seed=0, contacts=300):
+    """Writes an iOS CallHistory database with size rows in ZCALLRECORD."""
+    rng = random.Random(seed)
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        PRAGMA journal_mode = OFF;
+        PRAGMA synchronous = OFF;
+        CREATE TABLE ZCALLRECORD (Z_PK INTEGER PRIMARY KEY, Z_ENT INTEGER, Z_OPT INTEGER, ZANSWERED INTEGER,
+                                  ZCALLTYPE INTEGER, ZDISCONNECTED_CAUSE INTEGER, ZORIGINATED INTEGER,
+                                  ZDATE TIMESTAMP, ZDURATION FLOAT, ZADDRESS VARCHAR, ZSERVICE_PROVIDER VARCHAR);
+    """)
+    numbers = [number for number in _phone_numbers(rng, contacts) if "@" not in number]
+
+    def rows():
+        date = float(START_DATE)
+        for pk in range(1, size + 1):
+            date += rng.uniform(60, 20000)
+            originated = int(rng.random() < 0.5)
+            answered = 1 if originated else int(rng.random() < 0.75)
+            duration = rng.uniform(1, 1800) if answered else 0.0
+            cause = 6 if not originated and not answered and rng.random() < 0.2 else 0
+            yield (pk, 2, 1, answered, 1, cause, originated, date, duration, rng.choice(numbers),
+                   rng.choice(SERVICE_PROVIDERS))
+
+    conn.executemany("INSERT INTO ZCALLRECORD VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows())
+    conn.commit()
+    conn.close()
+
+
+def make_android_xml(path, size, seed=0, contacts=300, mms_rate=0.02, mms_bytes=20000):
+    """
+    Writes an SMS Backup & Restore file with size 'sms' elements.
+
+    About mms_rate of the elements are additionally preceded by an 'mms'
+    element carrying a base64 image part of mms_bytes bytes, which the
+    converters must skip over.
+    """
+    rng = random.Random(seed)
+    numbers = _phone_numbers(rng, contacts)
+    payload = base64.b64encode(rng.randbytes(mms_bytes)).decode("ascii")
+    date = (START_DATE - 86400 * 365) * 1000 + APPLE_EPOCH_MS
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("<?xml version='1.0' encoding='UTF-8' standalone='yes' ?>\n")
+        f.write(f'<smses count="{size}" backup_set="bench" backup_date="{date}" type="full">\n')
+        for _ in range(size):
+            date += rng.randrange(1000, 600000)
+            address = rng.choice(numbers)
+            if rng.random() < mms_rate:
+                f.write(f'  <mms date="{date}" msg_box="1" address="{address}" m_type="132">\n'
+                        f'    <parts>\n      <part seq="0" ct="image/jpeg" name="IMG.jpg" data="{payload}" />\n    </parts>\n'
+                        f'    <addrs>\n      <addr address="{address}" type="137" charset="106" />\n    </addrs>\n  </mms>\n')
+            kind = rng.choice((1, 2))
+            body = escape(random_text(rng), {'"': "&quot;", "\n": "&#10;"})
+            f.write(f'  <sms protocol="0" address="{address}" date="{date}" type="{kind}" subject="null" body="{body}" '
+                    f'toa="null" sc_toa="null" service_center="null" read="1" status="-1" locked="0" date_sent="0" '
+                    f'sub_id="-1" readable_date="" contact_name="(Unknown)" />\n')
+        f.write("</smses>\n")
+
+
+def make_messages_csv(path, size, seed=0, contacts=300):
+    """Writes a CSV in the format of sms_convert_to_csv.write_to_csv with size rows."""
+    rng = random.Random(seed)
+    numbers = _phone_numbers(rng, contacts)
+    date = (START_DATE * 1000) + APPLE_EPOCH_MS
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(['rowid', 'date', 'readable_date', 'body', 'phone_number', 'is_from_me', 'cache_roomname', 'service'])
+        for rowid in range(1, size + 1):
+            date += rng.randrange(1, 600) * 1000
+            writer.writerow([rowid, date, "05 Mar 2023  1:02:03 pm", random_text(rng), rng.choice(numbers),
+                             int(rng.random() < 0.45), "", rng.choice(("iMessage", "SMS"))])
+
+
+def make_calls_csv(path, size, seed=0, contacts=300):
+    """Writes a CSV in the format of call_convert_to_csv.write_to_csv with size rows."""
+    rng = random.Random(seed)
+    numbers = [number for number in _phone_numbers(rng, contacts) if "@" not in number]
+    date = (START_DATE * 1000) + APPLE_EPOCH_MS
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+        writer.writerow(['rowid', 'phone_number', 'duration', 'date', 'type', 'type_of_call', 'presentation', 'subscription_id',
+                         'post_dial_digits', 'subscription_component_name', 'readable_date', 'contact_name', 'service_provider'])
+        for rowid in range(1, size + 1):
+            date += rng.randrange(60, 20000) * 1000
+            writer.writerow([rowid, rng.choice(numbers), rng.randrange(0, 1800), date, rng.choice((1, 2, 3, 5)), "Incoming", 1, "1", "",
+                             "com.android.phone/com.android.services.telephony.TelephonyConnectionService",
+                             "05 Mar 2023  1:02:03 pm", "(Unknown)", "com.apple.Telephony"])
+
+
+FIXTURES = {
+    "sms_db": ("sms_{size}_s{seed}.db", make_sms_db),
+    "call_db": ("calls_{size}_s{seed}.db", make_call_db),
+    "android_xml": ("android_{size}_s{seed}.xml", make_android_xml),
+    "messages_csv": ("messages_{size}_s{seed}.csv", make_messages_csv),
+    "calls_csv": ("calls_{size}_s{seed}.csv", make_calls_csv),
+}
+
+
+def ensure_fixtures(directory, size, seed=0, names=None):
+    """
+    Generates the fixtures of one size in directory, reusing files that already exist.
+
+    Returns:
+        dict: Fixture name -> path.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for name, (pattern, make) in FIXTURES.items():
+        if names is not None and name not in names:
+            continue
+        path = os.path.join(directory, pattern.format(size=size, seed=seed))
+        if not os.path.exists(path):
+            temporary = path + ".tmp"
+            make(temporary, size, seed)
+            os.replace(temporary, path)
+        paths[name] = path
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic iOS databases and Android backups for benchmarks.")
+    parser.add_argument("directory", help="Where to write the files")
+    parser.add_argument("--size", type=int, action="append", help="Rows per file (repeatable; default: 10000)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    args = parser.parse_args()
+    for size in args.size or [10000]:
+        for name, path in ensure_fixtures(args.directory, size, args.seed).items():
+            print(f"{name:<13} {path} ({os.path.getsize(path) / (1 << 20):.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
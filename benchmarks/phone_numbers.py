@@ -0,0 +1,75 @@
+"""
+Measures the per-row cost of phone number normalization.
+
+A message database has many rows but few distinct handles, so the cached
+phone_numbers.normalize() is compared with the same rules run on every row
+and with the regex + "+91" check read_messages used to run per message.
+
+Run from the repository root:
+
+    python -m benchmarks.phone_numbers              # 400k rows over 300 handles
+    python -m benchmarks.phone_numbers -n 1000000 --handles 2000
+"""
+import argparse
+import random
+import re
+import time
+import phone_numbers
+
+
+def make_handles(rows, distinct, seed=0):
+    """Returns rows raw handles drawn from distinct ones, formatted the ways iOS stores them."""
+    rng = random.Random(seed)
+    pool = []
+    for i in range(distinct):
+        kind = i % 5
+        if kind == 0:
+            pool.append(f"+9198{rng.randrange(10 ** 8):08d}")
+        elif kind == 1:
+            pool.append(f"+1555{rng.randrange(10 ** 7):07d}")
+        elif kind == 2:
+            pool.append(f"+1 ({rng.randrange(200, 999)}) {rng.randrange(100, 999)}-{rng.randrange(10 ** 4):04d}")
+        elif kind == 3:
+            pool.append(f"user{i}@icloud.com")
+        else:
+            pool.append(f"+91{rng.randrange(100, 99999)}(smsft)")
+    return [rng.choice(pool) for _ in range(rows)]
+
+
+def legacy(handle):
+    # What message_from_row did for every row before phone_numbers existed.
+    handle = re.sub(r'\(.*?\)', '', handle).strip()
+    if handle.startswith("+91") and len(handle) < 13:
+        handle = handle[3:]
+    return handle
+
+
+def time_per_row(function, handles):
+    """Returns the time per call of function over handles, in nanoseconds."""
+    start = time.perf_counter()
+    for handle in handles:
+        function(handle)
+    return (time.perf_counter() - start) / len(handles) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the per-row cost of phone number normalization.")
+    parser.add_argument("-n", "--rows", type=int, default=400000, help="Handles normalized (default: 400000)")
+    parser.add_argument("--handles", type=int, default=300, help="Distinct handles among them (default: 300)")
+    args = parser.parse_args()
+
+    handles = make_handles(args.rows, args.handles)
+    normalizer = phone_numbers.PhoneNormalizer()
+    results = [
+        ("legacy regex per row", time_per_row(legacy, handles)),
+        ("rules per row (uncached)", time_per_row(normalizer.normalize_uncached, handles)),
+        ("phone_numbers.normalize", time_per_row(normalizer, handles)),
+        ("match_key (dedup, contacts)", time_per_row(phone_numbers.match_key, handles)),
+    ]
+    print(f"{args.rows} rows, {args.handles} distinct handles:")
+    for name, nanoseconds in results:
+        print(f"  {name:<28} {nanoseconds:8.0f} ns/row")
+
+
+if __name__ == "__main__":
+    main()
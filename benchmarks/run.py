@@ -0,0 +1,240 @@
+"""
+Times each processing stage on synthetic fixtures and reports the results as JSON.
+
+Every stage runs in a fresh process, so its peak RSS is not inflated by
+earlier stages. Fixtures are generated on first use and kept in the work
+directory, so later runs (e.g. on another checkout) measure the same data.
+
+Run from the repository root:
+
+    python -m benchmarks.run --size 10000 --size 100000 -o results.json
+    python -m benchmarks.run --size 1000000 --stage read_messages --stage csv_to_xml
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from benchmarks import fixtures
+
+DEFAULT_SIZES = [10000, 100000, 1000000]
+DEFAULT_WORKDIR = os.path.join(tempfile.gettempdir(), "ios-to-android-bench")
+
+
+class Timer:
+    """Context manager accumulating the time spent inside it."""
+
+    def __init__(self):
+        self.seconds = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds += time.perf_counter() - self._start
+
+
+# Each stage gets the fixture paths, a scratch directory and a Timer. Setup
+# (e.g. reading the messages that write_to_csv needs) happens outside the
+# timer; the stage returns the number of rows it processed.
+
+def stage_read_messages(paths, scratch, timer):
+    import sms_convert_to_csv
+    with timer:
+        return len(sms_convert_to_csv.read_messages(paths["sms_db"]))
+
+
+def stage_convert_datetime(paths, scratch, timer):
+    # The per-row convert_datetime() of the original scripts is now the
+    # vectorized apple_time.message_dates(); time it on the raw date column.
+    import sqlite3
+    import apple_time
+    conn = sqlite3.connect(paths["sms_db"])
+    rowids, dates = zip(*conn.execute("SELECT ROWID, date FROM message"))
+    conn.close()
+    with timer:
+        java, readable = apple_time.message_dates(dates, rowids)
+    return len(java)
+
+
+def stage_write_to_csv(paths, scratch, timer):
+    import sms_convert_to_csv
+    messages = sms_convert_to_csv.read_messages(paths["sms_db"])
+    with timer:
+        sms_convert_to_csv.write_to_csv(messages, os.path.join(scratch, "messages.csv"), xml_file=paths["android_xml"])
+    return len(messages)
+
+
+def stage_get_cutoff_from_xml(paths, scratch, timer):
+    import android_xml
+    import sms_convert_to_csv
+    with timer:
+        sms_convert_to_csv.get_cutoff_from_xml(paths["android_xml"])
+    return sum(1 for _ in android_xml.iter_elements(paths["android_xml"], ("sms", "mms")))
+
+
+def stage_csv_to_xml(paths, scratch, timer):
+    import sms_csv_to_xml
+    with timer:
+        sms_csv_to_xml.csv_to_xml(paths["messages_csv"], os.path.join(scratch, "messages.xml"))
+    with open(paths["messages_csv"], "rb") as f:
+        return sum(1 for _ in f) - 1
+
+
+def stage_calls_csv_to_xml(paths, scratch, timer):
+    import calls_csv_to_xml
+    with timer:
+        calls_csv_to_xml.csv_to_xml_calls(paths["calls_csv"], os.path.join(scratch, "calls.xml"))
+    with open(paths["calls_csv"], "rb") as f:
+        return sum(1 for _ in f) - 1
+
+
+def stage_parquet_to_xml(paths, scratch, timer):
+    import csv
+    import columnar
+    import sms_convert_to_csv
+    import sms_csv_to_xml
+    parquet_file = os.path.join(scratch, "messages.parquet")
+    with open(paths["messages_csv"], newline="", encoding="utf-8") as f, \
+            columnar.open_writer(parquet_file, sms_convert_to_csv.CSV_FIELDNAMES, sms_convert_to_csv.INTEGER_FIELDS) as writer:
+        for row in csv.DictReader(f):
+            writer.writerow({name: int(value) if value and name in sms_convert_to_csv.INTEGER_FIELDS else value
+                             for name, value in row.items()})
+    with timer:
+        return sms_csv_to_xml.table_to_xml(parquet_file, os.path.join(scratch, "messages.xml"))
+
+
+def stage_csv_to_xml_chunks(paths, scratch, timer):
+    import sms_csv_to_xml
+    with timer:
+        return sms_csv_to_xml.csv_to_xml_chunks(paths["messages_csv"], os.path.join(scratch, "messages.xml"),
+                                                max_bytes=8 << 20, workers=os.cpu_count())
+
+
+def stage_read_call_logs(paths, scratch, timer):
+    import call_convert_to_csv
+    with timer:
+        return len(call_convert_to_csv.read_call_logs(paths["call_db"], "+15555550100"))
+
+
+def stage_stream_call_logs(paths, scratch, timer):
+    import call_convert_to_csv
+    with timer:
+        return call_convert_to_csv.write_to_csv_stream(paths["call_db"], os.path.join(scratch, "call_logs.csv"), "+15555550100")
+
+
+def stage_convert_sms(paths, scratch, timer):
+    import ios_to_android
+    with timer:
+        stats = ios_to_android.convert_sms(paths["sms_db"], os.path.join(scratch, "sms.xml"), backup_file=paths["android_xml"])
+    return stats.get("rows_read", 0)
+
+
+def stage_convert_calls(paths, scratch, timer):
+    import ios_to_android
+    with timer:
+        stats = ios_to_android.convert_calls(paths["call_db"], os.path.join(scratch, "call_logs.xml"), self_number="+15555550100")
+    return stats.get("rows_read", 0)
+
+
+STAGES = {
+    "read_messages": stage_read_messages,
+    "convert_datetime": stage_convert_datetime,
+    "write_to_csv": stage_write_to_csv,
+    "get_cutoff_from_xml": stage_get_cutoff_from_xml,
+    "csv_to_xml": stage_csv_to_xml,
+    "calls_csv_to_xml": stage_calls_csv_to_xml,
+    "parquet_to_xml": stage_parquet_to_xml,
+    "csv_to_xml_chunks": stage_csv_to_xml_chunks,
+    "read_call_logs": stage_read_call_logs,
+    "stream_call_logs": stage_stream_call_logs,
+    "convert_sms": stage_convert_sms,
+    "convert_calls": stage_convert_calls,
+}
+
+
+def peak_rss_mb():
+    """Peak resident set size of the current process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KB on Linux
+
+
+def run_stage(name, paths, scratch):
+    """Runs one stage in the current process. Returns (rows, seconds, peak RSS in MB)."""
+    timer = Timer()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        rows = STAGES[name](paths, scratch, timer)
+    return rows, timer.seconds, peak_rss_mb()
+
+
+def measure(name, paths, scratch):
+    """Runs one stage in a freshly spawned process and returns its result record."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        rows, seconds, rss = executor.submit(run_stage, name, paths, scratch).result()
+    return {
+        "stage": name,
+        "rows": rows,
+        "seconds": round(seconds, 4),
+        "rows_per_sec": round(rows / seconds) if seconds > 0 else None,
+        "peak_rss_mb": round(rss, 1),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, stages, workdir, seed=0):
+    """Generates fixtures as needed, runs every stage at every size and returns the report."""
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": seed,
+        "results": [],
+    }
+    for size in sizes:
+        print(f"Preparing fixtures for {size} rows in {workdir}", file=sys.stderr)
+        paths = fixtures.ensure_fixtures(workdir, size, seed)
+        with tempfile.TemporaryDirectory(dir=workdir) as scratch:
+            for name in stages:
+                result = dict(measure(name, paths, scratch), size=size)
+                print(f"  {name:<20} {result['rows']:>9} rows  {result['seconds']:8.3f}s  "
+                      f"{result['rows_per_sec'] or 0:>10,} rows/sec  {result['peak_rss_mb']:7.1f} MB", file=sys.stderr)
+                report["results"].append(result)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark each processing stage on synthetic data.")
+    parser.add_argument("--size", type=int, action="append", help=f"Rows per fixture (repeatable; default: {DEFAULT_SIZES})")
+    parser.add_argument("--stage", choices=list(STAGES), action="append", help="Stage to run (repeatable; default: all)")
+    parser.add_argument("--workdir", default=DEFAULT_WORKDIR, help=f"Where fixtures are kept (default: {DEFAULT_WORKDIR})")
+    parser.add_argument("--seed", type=int, default=0, help="Fixture random seed (default: 0)")
+    parser.add_argument("-o", "--output", default=None, help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = run(args.size or DEFAULT_SIZES, args.stage or list(STAGES), args.workdir, args.seed)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Compares the sort/dedup engines of sms_convert_to_csv on synthetic messages.
+
+Run from the repository root:
+
+    python -m benchmarks.sort_dedup              # 100k and 1M messages
+    python -m benchmarks.sort_dedup -n 50000
+"""
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+import sms_convert_to_csv
+from records import Message
+
+SERVICES = ["iMessage", "SMS", None]
+BODIES = ["Ok", "See you soon", "Running late, be there in 10 minutes", "Call me when you are free", "Thanks!"]
+
+
+def make_messages(count, duplicate_rate=0.1, seed=0):
+    """
+    Builds count messages shaped like read_messages() output.
+
+    About duplicate_rate of them are copies of another message sent over a
+    different service, so the dedup step has work to do. Dates are shuffled.
+    """
+    rng = random.Random(seed)
+    messages = []
+    date = 1600000000000
+    while len(messages) < count:
+        date += rng.choice((0, 1000, 1000, 2000, 60000))
+        message = Message(len(messages) + 1, date, "", f"{rng.choice(BODIES)} {rng.randrange(1000)}",
+                          f"+1555{rng.randrange(300):07d}", rng.randrange(2), None, rng.choice(SERVICES))
+        messages.append(message)
+        if rng.random() < duplicate_rate and len(messages) < count:
+            copy = Message(len(messages) + 1, message.date, message.readable_date, message.body, message.phone_number,
+                           message.is_from_me, message.cache_roomname, rng.choice(SERVICES))
+            messages.append(copy)
+    rng.shuffle(messages)
+    return messages
+
+
+def measure(function, messages):
+    """
+    Returns (result, seconds, peak traced memory in MB) of function(messages).
+
+    The function runs twice: once timed, once under tracemalloc (which slows
+    allocation-heavy code too much to time it at the same time).
+    """
+    gc.collect()
+    start = time.perf_counter()
+    result = function(messages)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    tracemalloc.start()
+    function(messages)
+    peak = tracemalloc.get_traced_memory()[1] / (1 << 20)
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def _content(row):
+    service = row["service"] if isinstance(row["service"], str) else None  # pandas turns None into NaN
+    return row["date"], row["body"], row["phone_number"], row["is_from_me"], service
+
+
+def same_result(python_rows, pandas_rows):
+    # Both engines keep the same messages in date order. Ties within a
+    # timestamp may be ordered differently, and of two identical copies
+    # either may be kept, so compare contents rather than rowids.
+    if [row["date"] for row in python_rows] != [row["date"] for row in pandas_rows]:
+        return False
+    return sorted(map(_content, python_rows)) == sorted(map(_content, pandas_rows))
+
+
+def run(count):
+    messages = make_messages(count)
+    python_rows, python_time, python_peak = measure(sms_convert_to_csv.sort_dedup_messages, messages)
+    pandas_rows, pandas_time, pandas_peak = measure(sms_convert_to_csv.sort_dedup_messages_pandas, messages)
+    print(f"{count:>9} messages, {count - len(python_rows)} duplicates removed")
+    print(f"    python: {python_time:6.2f}s  peak {python_peak:7.1f} MB")
+    print(f"    pandas: {pandas_time:6.2f}s  peak {pandas_peak:7.1f} MB")
+    print(f"    speedup {pandas_time / python_time:.1f}x, same result: {same_result(python_rows, pandas_rows)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the python and pandas sort/dedup engines.")
+    parser.add_argument("-n", "--count", type=int, action="append",
+                        help="Number of messages (repeatable; default: 100000 and 1000000)")
+    args = parser.parse_args()
+    for count in args.count or [100000, 1000000]:
+        run(count)
+
+
+if __name__ == "__main__":
+    main()
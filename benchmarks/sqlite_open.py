@@ -0,0 +1,107 @@
+"""
+Compares the ways of opening the iOS databases, on a cold and a warm page cache.
+
+Each mode opens the database and runs the extraction query to the last row:
+
+    plain      sqlite3.connect(path), as the scripts used to
+    immutable  ios_db.connect(path): read-only immutable URI
+    in_memory  ios_db.connect(path, in_memory=True): backup API copy into RAM first
+
+"Cold" evicts the file from the OS page cache first with posix_fadvise, which
+needs no privileges but is only available on Linux and some BSDs; elsewhere
+only warm runs are reported. Fixtures come from benchmarks.fixtures.
+
+Run from the repository root:
+
+    python -m benchmarks.sqlite_open --size 1000000
+"""
+import argparse
+import os
+import sqlite3
+import time
+import ios_db
+import sms_convert_to_csv
+from benchmarks import fixtures
+from benchmarks.run import DEFAULT_WORKDIR
+
+QUERIES = {
+    "sms_db": sms_convert_to_csv.MESSAGE_QUERY + " ORDER BY message.date",
+    "call_db": "SELECT Z_PK, ZADDRESS, ZDURATION, ZDATE, ZORIGINATED, ZANSWERED, ZDISCONNECTED_CAUSE, "
+               "ZSERVICE_PROVIDER FROM ZCALLRECORD",
+}
+MODES = {
+    "plain": sqlite3.connect,
+    "immutable": ios_db.connect,
+    "in_memory": lambda path: ios_db.connect(path, in_memory=True),
+}
+RUNS = 3  # The fastest run of each mode counts
+
+
+def evict(path):
+    """Drops a file from the OS page cache. Returns False where that is not supported."""
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return True
+
+
+def scan(connect, path, query, batch_size=sms_convert_to_csv.BATCH_SIZE):
+    """Opens path with connect and fetches every row of query. Returns (rows, seconds)."""
+    start = time.perf_counter()
+    conn = connect(path)
+    cursor = conn.execute(query)
+    rows = 0
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            break
+        rows += len(batch)
+    conn.close()
+    return rows, time.perf_counter() - start
+
+
+def measure(path, query, runs=RUNS):
+    """Returns {mode: {"cold": seconds or None, "warm": seconds}} and the row count."""
+    results = {}
+    rows = 0
+    for mode, connect in MODES.items():
+        cold = []
+        for _ in range(runs):
+            if not evict(path):
+                break
+            rows, seconds = scan(connect, path, query)
+            cold.append(seconds)
+        scan(connect, path, query)  # Warm the cache
+        warm = []
+        for _ in range(runs):
+            rows, seconds = scan(connect, path, query)
+            warm.append(seconds)
+        results[mode] = {"cold": min(cold) if cold else None, "warm": min(warm)}
+    return results, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare plain, immutable and in-memory opening of the iOS databases.")
+    parser.add_argument("--size", type=int, action="append", help="Rows per fixture (repeatable; default: 100000)")
+    parser.add_argument("--workdir", default=DEFAULT_WORKDIR, help=f"Where fixtures are kept (default: {DEFAULT_WORKDIR})")
+    parser.add_argument("--runs", type=int, default=RUNS, help=f"Runs per mode and cache state; the fastest counts (default: {RUNS})")
+    args = parser.parse_args()
+
+    for size in args.size or [100000]:
+        paths = fixtures.ensure_fixtures(args.workdir, size, names=list(QUERIES))
+        for name, query in QUERIES.items():
+            results, rows = measure(paths[name], query, args.runs)
+            megabytes = os.path.getsize(paths[name]) / (1 << 20)
+            print(f"{name} ({rows} rows, {megabytes:.1f} MB):")
+            for mode, timings in results.items():
+                cold = "n/a" if timings["cold"] is None else f"{timings['cold']:.3f}s"
+                print(f"  {mode:<10} cold {cold:>8}  warm {timings['warm']:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
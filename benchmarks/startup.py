@@ -0,0 +1,102 @@
+"""
+Checks that the command-line scripts start quickly.
+
+Each script module is imported in a fresh interpreter with `python -X importtime`.
+The check fails if the import takes longer than the budget, or if it pulls
+in a heavy dependency that should only be imported on the code path that
+needs it (pandas for --engine pandas, numpy for date conversion, pyarrow for
+Parquet/Arrow files, typedstream for unusual attributedBody blobs).
+tests/test_startup.py runs the same check under the test suite.
+
+Run from the repository root:
+
+    python -m benchmarks.startup              # exits 1 if a script is over budget
+    python -m benchmarks.startup --budget 100
+"""
+import argparse
+import subprocess
+import sys
+
+SCRIPTS = ["sms_convert_to_csv", "call_convert_to_csv", "sms_csv_to_xml", "calls_csv_to_xml", "ios_to_android",
+           "batch_convert", "attributed_body", "xml_chunks"]
+HEAVY_MODULES = ["pandas", "numpy", "pyarrow", "typedstream", "chardet"]
+BUDGET_MS = 150  # Cumulative import time allowed per script
+RUNS = 3  # The fastest of these runs is compared with the budget
+
+
+def import_profile(module):
+    """
+    Imports module in a new interpreter with -X importtime.
+
+    Returns:
+        tuple: (cumulative import time of the module in ms, set of all imported module names)
+
+    Raises:
+        ImportError: If the module cannot be imported.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise ImportError(result.stderr.strip().splitlines()[-1])
+    imported = set()
+    total_us = None
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():  # Header line
+            continue
+        name = name.strip()
+        imported.add(name)
+        if name == module:
+            total_us = int(cumulative)
+    return total_us / 1000, imported
+
+
+def check_module(module, budget_ms=BUDGET_MS, runs=RUNS):
+    """
+    Profiles the import of one script.
+
+    Returns:
+        tuple: (fastest import time in ms, list of problems, empty if it is within budget)
+
+    Raises:
+        ImportError: If the module cannot be imported.
+    """
+    profiles = [import_profile(module) for _ in range(runs)]
+    elapsed = min(total for total, _ in profiles)
+    heavy = sorted(name for name in HEAVY_MODULES if name in profiles[0][1])
+    problems = []
+    if elapsed > budget_ms:
+        problems.append(f"over the {budget_ms} ms budget")
+    if heavy:
+        problems.append("imports " + ", ".join(heavy))
+    return elapsed, problems
+
+
+def check(budget_ms=BUDGET_MS, runs=RUNS):
+    """Prints the import time of each script and returns the number of failures."""
+    failures = 0
+    for module in SCRIPTS:
+        try:
+            elapsed, problems = check_module(module, budget_ms, runs)
+        except ImportError as e:
+            print(f"{module:<22}          FAIL: {e}")
+            failures += 1
+            continue
+        status = "FAIL: " + "; ".join(problems) if problems else "ok"
+        print(f"{module:<22} {elapsed:7.1f} ms  {status}")
+        failures += bool(problems)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the startup import time of the command-line scripts.")
+    parser.add_argument("--budget", type=float, default=BUDGET_MS, help=f"Import time budget per script in ms (default: {BUDGET_MS})")
+    parser.add_argument("--runs", type=int, default=RUNS, help=f"Imports per script; the fastest counts (default: {RUNS})")
+    args = parser.parse_args()
+    sys.exit(1 if check(args.budget, args.runs) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,144 +1,199 @@
 import sqlite3
-import datetime
 import argparse
 import csv
+import itertools
 import os
-import pandas as pd
-import chardet
-import re
-import math
-
-def convert_datetime(date):
-    date_java = 0
-    date_readable = "Invalid Date"
+from operator import attrgetter
+import apple_time
+import addressbook
+import columnar
+import ios_db
+import phone_numbers
+from instrumentation import Progress, metrics, profiled
+from records import CallLog, building_records
+
+CSV_FIELDNAMES = ['rowid', 'phone_number', 'duration', 'date', 'type', 'type_of_call',
+                  'presentation', 'subscription_id', 'post_dial_digits',
+                  'subscription_component_name', 'readable_date', 'contact_name', 'service_provider']
+INTEGER_FIELDS = ('rowid', 'duration', 'date', 'type', 'presentation')  # Stored as integers in Parquet/Arrow files (see columnar)
+
+
+BATCH_SIZE = 5000  # Rows fetched from SQLite per fetchmany() call
+
+TYPE_OF_CALL = ("Incoming", "Outgoing", "Unknown")  # Indexed by the direction column of CALL_QUERY
+TELEPHONY_COMPONENT = "com.android.phone/com.android.services.telephony.TelephonyConnectionService"
+WHATSAPP_COMPONENT = "com.whatsapp/com.whatsapp.calling.telecom.SelfManagedConnectionService"
+
+# Classification is done by SQLite, so per row Python only looks up constants:
+# * duration: ZDURATION rounded half to even, like Python's round(); SQLite's
+#   round() rounds halves away from zero.
+# * type: 1 incoming, 2 outgoing, 3 missed, 5 rejected, 0 unknown.
+# * direction: index into TYPE_OF_CALL.
+# * whatsapp: 1 for calls placed through WhatsApp.
+# Rows come back in date order, Z_PK breaking ties.
+CALL_QUERY = """
+SELECT Z_PK, ZADDRESS,
+       CASE
+           WHEN ZDURATION IS NULL THEN 0
+           WHEN abs(ZDURATION - CAST(ZDURATION AS INTEGER)) < 0.5 THEN CAST(ZDURATION AS INTEGER)
+           WHEN abs(ZDURATION - CAST(ZDURATION AS INTEGER)) > 0.5 OR CAST(ZDURATION AS INTEGER) % 2 != 0
+               THEN CAST(ZDURATION AS INTEGER) + (CASE WHEN ZDURATION < 0 THEN -1 ELSE 1 END)
+           ELSE CAST(ZDURATION AS INTEGER)
+       END AS duration,
+       ZDATE,
+       CASE
+           WHEN ZDISCONNECTED_CAUSE = 6 THEN 5
+           WHEN ZORIGINATED = 0 AND ZANSWERED = 0 THEN 3
+           WHEN ZORIGINATED = 0 THEN 1
+           WHEN ZORIGINATED = 1 THEN 2
+           ELSE 0
+       END AS type,
+       CASE ZORIGINATED WHEN 0 THEN 0 WHEN 1 THEN 1 ELSE 2 END AS direction,
+       coalesce(instr(lower(ZSERVICE_PROVIDER), 'whatsapp') > 0, 0) AS whatsapp,
+       ZSERVICE_PROVIDER
+FROM ZCALLRECORD{where}
+ORDER BY ZDATE, Z_PK
+"""
+
+
+def _pk_conditions(min_pk=None, max_pk=None):
+    """Returns (WHERE clause or "", parameters) limiting Z_PK to (min_pk, max_pk]."""
+    conditions, parameters = [], []
+    if min_pk is not None:
+        conditions.append("Z_PK > ?")
+        parameters.append(min_pk)
+    if max_pk is not None:
+        conditions.append("Z_PK <= ?")
+        parameters.append(max_pk)
+    return (" WHERE " + " AND ".join(conditions) if conditions else ""), parameters
+
+
+def iter_call_rows(db_file, self_phone_number, min_pk=None, max_pk=None, in_memory=False, contacts=None,
+                   batch_size=BATCH_SIZE):
+    """
+    Yields the calls of a CallHistory database as tuples of CSV_FIELDNAMES values, in date order.
+
+    CALL_QUERY classifies and sorts the calls, so rows go from the cursor
+    to the caller a batch at a time. Per row, Python only normalizes the
+    number (cached per handle) and picks constant strings; dates are
+    converted a batch at a time (apple_time.call_dates()).
+
+    Args:
+        db_file (str): Path to the CallHistory database.
+        self_phone_number (str): Own number, used in WhatsApp subscription IDs.
+        min_pk (int): Only read calls with a Z_PK above this one.
+        max_pk (int): Only read calls with a Z_PK up to this one.
+        in_memory (bool): Copy the database into RAM before reading it (see ios_db.connect()).
+        contacts (addressbook.ContactIndex): Fills in contact_name when given.
+        batch_size (int): Number of rows fetched per round trip.
+
+    Raises:
+        sqlite3.Error: If the database cannot be read.
+    """
+    # Index 1 (WhatsApp) shares one subscription_id string between all its calls.
+    subscriptions = (("1", TELEPHONY_COMPONENT), (f"{self_phone_number}@s.whatsapp.net", WHATSAPP_COMPONENT))
+    conn = ios_db.connect(db_file, in_memory)
     try:
-        mod_date = datetime.datetime(2001, 1, 1, tzinfo=datetime.timezone.utc)
-        unix_timestamp = (mod_date.timestamp())
-        new_date = ((date + unix_timestamp))
-        original_date_obj = datetime.datetime.fromtimestamp(new_date)
-        date_java = int(original_date_obj.timestamp())  # Correct Java TS
-        date_readable = original_date_obj.strftime("%d %b %Y %l:%M:%S%p").replace("AM", "am").replace("PM",
-                                                                                                      "pm").replace(
-            "am",
-            " am").replace(
-            "pm", " pm")
-        # print(f"{date}, {date_java}; {date_readable}")
+        where, parameters = _pk_conditions(min_pk, max_pk)
+        progress = Progress("Reading calls", conn.execute("SELECT COUNT(*) FROM ZCALLRECORD" + where, parameters).fetchone()[0])
+        cursor = conn.execute(CALL_QUERY.format(where=where), parameters)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            metrics.count("rows scanned", len(rows))
+            dates_java, dates_readable = apple_time.call_dates([row[3] for row in rows], [row[0] for row in rows])
+            for row, date_java, date_readable in zip(rows, dates_java.tolist(), dates_readable.tolist()):
+                rowid, address, duration, _, call_type, direction, whatsapp, service_provider = row
+                phone_number = phone_numbers.normalize(str(address)) if address else ""  # Same form as the SMS addresses
+                subscription_id, subscription_component_name = subscriptions[whatsapp]
+                yield (
+                    rowid,
+                    phone_number,
+                    duration,
+                    date_java,
+                    call_type,
+                    TYPE_OF_CALL[direction],
+                    1,  # presentation, always 1
+                    subscription_id,
+                    "",  # post_dial_digits, always empty
+                    subscription_component_name,
+                    date_readable,
+                    contacts.name(phone_number) if contacts is not None else addressbook.UNKNOWN,
+                    service_provider,
+                )
+            progress.update(len(rows))
+        progress.close()
+    finally:
+        conn.close()
+
+
+def iter_call_logs(db_file, self_phone_number, min_pk=None, max_pk=None, in_memory=False, contacts=None,
+                   batch_size=BATCH_SIZE):
+    """Like iter_call_rows(), but yields records.CallLog."""
+    return itertools.starmap(CallLog, iter_call_rows(db_file, self_phone_number, min_pk, max_pk, in_memory, contacts,
+                                                     batch_size))
 
-    except Exception as e:
-        print(f"Error converting date for ROWID {rowid}: {e}")
-        # Keep defaults: date_java = 0, date_readable = "Invalid Date"
-    return date_java*1000,date_readable
 
-def read_call_logs(db_file, self_phone_number):
-    """Reads call logs from an SQLite database file and returns them as a list of dictionaries."""
+def read_call_logs(db_file, self_phone_number, min_pk=None, max_pk=None, in_memory=False, contacts=None):
+    """
+    Reads call logs from an SQLite database file and returns them as a list of records.CallLog, in date order.
+
+    Args:
+        db_file (str): Path to the CallHistory database.
+        self_phone_number (str): Own number, used in WhatsApp subscription IDs.
+        min_pk (int): Only read calls with a Z_PK above this one.
+        max_pk (int): Only read calls with a Z_PK up to this one.
+        in_memory (bool): Copy the database into RAM before reading it (see ios_db.connect()).
+        contacts (addressbook.ContactIndex): Fills in contact_name when given.
+
+    Returns:
+        list: The calls, or None if the database could not be read.
+    """
 
     if not os.path.exists(db_file):
         print(f"Error: Database file '{db_file}' not found.")
-        return []
+        return None
 
     try:
-        conn = sqlite3.connect(db_file)
-        conn.text_factory = str  # Ensure text handling
-        cursor = conn.cursor()
-
-        query = """
-        SELECT ZCALLRECORD.Z_PK, ZCALLRECORD.ZADDRESS, ZCALLRECORD.ZDURATION, ZCALLRECORD.ZDATE,
-               ZCALLRECORD.ZORIGINATED, ZCALLRECORD.ZANSWERED, ZCALLRECORD.ZDISCONNECTED_CAUSE,
-               ZCALLRECORD.ZSERVICE_PROVIDER
-        FROM ZCALLRECORD
-        """
-        # No JOIN needed in this case, as all required data is in ZCALLRECORD
-
-        results = cursor.execute(query).fetchall()
-        call_logs = []
-
-        for result in results:
-            rowid, address, duration, date, originated, answered, disconnected_cause, service_provider = result
-
-            # --- Phone Number ---
-            phone_number = str(address) if address else ""  # Handle potential None values
-
-            # --- Duration ---
-            duration = round(duration) if duration is not None else 0
-
-            # --- Date Conversion and Handling ---
-            date_java = 0
-            date_readable = "Invalid Date"
-
-            date_java,date_readable=convert_datetime(date)
-
-
-            # --- Call Type and Type of Call ---
-            if originated == 0:  # Incoming
-                type_of_call = "Incoming"
-                if answered == 0:
-                    call_type = 3  # Missed
-                else:
-                    call_type = 1  # Incoming
-            elif originated == 1: #outgoing
-                type_of_call = "Outgoing"
-                call_type = 2  # Outgoing
-            else:  # Should not happen, but handle for robustness
-                type_of_call = "Unknown"
-                call_type = 0  # Unknown
-
-            if disconnected_cause == 6:
-                call_type = 5  # Rejected
-
-
-            # --- subscription_id and subscription_component_name ---
-            if service_provider and "whatsapp" in service_provider.lower():
-                subscription_id = f"{self_phone_number}@s.whatsapp.net"
-                subscription_component_name = "com.whatsapp/com.whatsapp.calling.telecom.SelfManagedConnectionService"
-            else:
-                subscription_id = "1"  # Default value
-                subscription_component_name = "com.android.phone/com.android.services.telephony.TelephonyConnectionService"
-
-            call_logs.append({
-                "rowid": rowid,
-                "phone_number": phone_number,
-                "duration": duration,
-                "date": date_java,
-                "type": call_type,
-                "type_of_call": type_of_call,
-                "presentation": 1,  # Always 1
-                "subscription_id": subscription_id,
-                "post_dial_digits": "",  # Always empty
-                "subscription_component_name": subscription_component_name,
-                "readable_date": date_readable,
-                "contact_name": "(Unknown)",  # Default value
-                "service_provider" : service_provider
-            })
-
-        conn.close()
-        return call_logs
+        with building_records():
+            return list(iter_call_logs(db_file, self_phone_number, min_pk, max_pk, in_memory, contacts))
 
     except sqlite3.Error as e:
         print(f"SQLite error: {e}")
-        return []
+        return None
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
-        return []
+        return None
 
-def write_to_csv(call_logs, output_file):
+def get_latest_call(db_file):
+    """Returns the highest ZCALLRECORD.Z_PK of a CallHistory database (None if it has no calls)."""
+    conn = ios_db.connect(db_file)
+    try:
+        return conn.execute("SELECT MAX(Z_PK) FROM ZCALLRECORD").fetchone()[0]
+    finally:
+        conn.close()
+
+def sort_call_logs(call_logs, engine="python"):
+    """Returns the call logs sorted by date, with list.sort ('python') or a DataFrame ('pandas')."""
+    if engine == "pandas":
+        import pandas as pd  # Only needed for this engine
+        df = pd.DataFrame(call_logs)
+        return df.sort_values(by='date').to_dict('records')
+    return sorted(call_logs, key=attrgetter("date"))
+
+def write_to_csv(call_logs, output_file, engine="python"):
     if not call_logs:
         print("No call logs to write.")
         return
 
     try:
-        df = pd.DataFrame(call_logs)
-
         # --- Sort by 'date' (ascending) ---
-        df = df.sort_values(by='date')
+        call_logs = sort_call_logs(call_logs, engine)
 
-        # --- Write to CSV ---
-        with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
-            fieldnames = ['rowid', 'phone_number', 'duration', 'date', 'type', 'type_of_call',
-                          'presentation', 'subscription_id', 'post_dial_digits',
-                          'subscription_component_name', 'readable_date', 'contact_name', 'service_provider']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames, quoting=csv.QUOTE_ALL)
-            writer.writeheader()
-            writer.writerows(df.to_dict('records'))
+        # --- Write to CSV (or Parquet/Arrow) ---
+        with columnar.open_writer(output_file, CSV_FIELDNAMES, INTEGER_FIELDS, quoting=csv.QUOTE_ALL) as writer:
+            writer.writerows(call_logs)
 
         print(f"Call logs successfully written to {output_file}, sorted by date.")
 
@@ -147,20 +202,82 @@ def write_to_csv(call_logs, output_file):
     except Exception as e:
         print(f"An unexpected error occurred while writing to CSV: {e}")
 
+def write_to_csv_stream(db_file, output_file, self_phone_number, in_memory=False, contacts=None):
+    """
+    Streams calls from the database to a CSV file in date order, with constant memory.
+
+    The query already returns the calls sorted (see iter_call_rows()), so
+    each batch is written as soon as it is read.
+
+    Returns:
+        int: Number of calls written.
+    """
+    if not os.path.exists(db_file):
+        print(f"Error: Database file '{db_file}' not found.")
+        return 0
+
+    rows_written = 0
+    try:
+        with columnar.open_writer(output_file, CSV_FIELDNAMES, INTEGER_FIELDS, quoting=csv.QUOTE_ALL) as writer:
+            for row in iter_call_rows(db_file, self_phone_number, in_memory=in_memory, contacts=contacts):
+                writer.write_values(row)
+                rows_written += 1
+        print(f"Call logs successfully streamed to {output_file}, sorted by date.")
+    except sqlite3.Error as e:
+        print(f"SQLite error: {e}")
+    except IOError as e:
+        print(f"I/O error writing to CSV: {e}")
+    except Exception as e:
+        print(f"An unexpected error occurred while writing to CSV: {e}")
+    return rows_written
+
 def main():
     parser = argparse.ArgumentParser(description="Extract call log data from an SQLite database and save to CSV.")
     parser.add_argument("db_file", help="Path to the SQLite database file")
-    parser.add_argument("-o", "--output", default="call_logs.csv", help="Output CSV file name (default: call_logs.csv)")
+    parser.add_argument("-o", "--output", default=None,
+                        help="Output file name (default: call_logs.csv, or call_logs.parquet / call_logs.arrow with -f); "
+                             "a name ending in .parquet or .arrow is written in that format")
+    parser.add_argument("-f", "--format", choices=columnar.FORMATS, default="csv",
+                        help="Output format: 'csv', or a typed 'parquet' / 'arrow' (IPC) file that the XML "
+                             "converters read faster (default: csv; needs pyarrow)")
+    parser.add_argument("-s", "--self-number", default=None,
+                        help="Your phone number, used for WhatsApp subscription IDs (asked for if not given)")
+    parser.add_argument("--engine", choices=["python", "pandas"], default="python",
+                        help="'python' streams the calls, sorted by SQLite, straight to the CSV; "
+                             "'pandas' reads them all and sorts them with a DataFrame (default: python)")
+    parser.add_argument("--in-memory", action="store_true", help="Copy the database into RAM before reading it (faster on slow or network storage)")
+    parser.add_argument("--addressbook", default=None, help="iOS AddressBook.sqlitedb used to fill in contact names")
+    phone_numbers.add_country_option(parser)
+    parser.add_argument("--timing", action="store_true", help="Report the duration, throughput and row counts of each stage")
+    parser.add_argument("--profile", metavar="FILE", default=None, help="Profile the run with cProfile and write the stats to FILE")
 
     args = parser.parse_args()
 
-    # Get self_phone_number from user input
-    self_phone_number = input("Enter your phone number (for WhatsApp subscription ID): ").strip()
-
-    call_logs = read_call_logs(args.db_file, self_phone_number)
-
-    if call_logs:
-        write_to_csv(call_logs, args.output)
+    self_phone_number = args.self_number
+    if self_phone_number is None:
+        self_phone_number = input("Enter your phone number (for WhatsApp subscription ID): ").strip()
+
+    if args.output and args.format != "csv" and columnar.table_format(args.output) != args.format:
+        parser.error(f"-f {args.format} needs an output name ending in .{args.format}")
+    output = args.output or columnar.output_path("call_logs", args.format)
+    phone_numbers.set_country(*args.country_code)
+    contacts = addressbook.load_contacts(args.addressbook)
+    with profiled(args.profile):
+        if args.engine == "python":
+            with metrics.stage("stream") as stage:
+                stage.rows = write_to_csv_stream(args.db_file, output, self_phone_number, args.in_memory, contacts)
+        else:
+            with metrics.stage("read_call_logs") as stage:
+                call_logs = read_call_logs(args.db_file, self_phone_number, in_memory=args.in_memory, contacts=contacts)
+                stage.rows = len(call_logs or [])
+
+            if call_logs:
+                with metrics.stage("write_to_csv") as stage:
+                    write_to_csv(call_logs, output, args.engine)
+                    stage.rows = len(call_logs)
+    metrics.report_errors()
+    if args.timing:
+        metrics.report()
 
 if __name__ == "__main__":
     main()
@@ -1,81 +1,173 @@
-import csv
-import xml.etree.ElementTree as ET
 import argparse
+import itertools
 import os
-import datetime
-
-def indent(elem, level=0):
-    """Pretty-prints XML (in-place)."""
-    i = "\n" + level*"  "
-    if len(elem):
-        if not elem.text or not elem.text.strip():
-            elem.text = i + "  "
-        if not elem.tail or not elem.tail.strip():
-            elem.tail = i
-        for elem in elem:
-            indent(elem, level+1)
-        if not elem.tail or not elem.tail.strip():
-            elem.tail = i
-    else:
-        if level and (not elem.tail or not elem.tail.strip()):
-            elem.tail = i
+import android_xml
+import columnar
+import compressed
+import xml_chunks
+from instrumentation import Progress, metrics, profiled
+from sms_csv_to_xml import iter_csv_dicts
+
+# Every <call> attribute comes from the call log row (see call_values).
+CALL_ELEMENT = android_xml.ElementFormat("call", (
+    ("number", None),
+    ("duration", None),
+    ("date", None),
+    ("type", None),
+    ("presentation", None),
+    ("subscription_id", None),
+    ("post_dial_digits", None),
+    ("subscription_component_name", None),
+    ("readable_date", None),
+    ("contact_name", None),
+))
+
+
+def call_values(log):
+    """
+    Returns the <call> attributes of one call log row, in CALL_ELEMENT order.
+
+    Args:
+        log (dict): A call row as written by call_convert_to_csv.
+    """
+    # Set attributes, handling potential missing values and type conversions
+    return (
+        str(log.get("phone_number", "")),
+        str(log.get("duration", "0")),  # duration is already an int
+        str(log.get("date", "0")), # date is already correct
+        str(log.get("type", "0")), #type
+        str(log.get("presentation", "1")),  # Default 1
+        str(log.get("subscription_id", "null")), #can be null
+        str(log.get("post_dial_digits", "")),
+        str(log.get("subscription_component_name", "null")), #can be null
+        str(log.get("readable_date", "")),  # Should already be formatted
+        str(log.get("contact_name", "(Unknown)")),
+    )
+
+
+# Columns of a Parquet/Arrow file that call_value_columns() reads.
+CALL_COLUMNS = ["phone_number", "duration", "date", "type", "presentation", "subscription_id", "post_dial_digits",
+                "subscription_component_name", "readable_date", "contact_name"]
+
+
+def call_value_columns(batch):
+    """
+    Returns the <call> attributes of a batch of typed rows, in CALL_ELEMENT order.
+
+    The column-wise counterpart of call_values() for Parquet/Arrow files (see columnar).
+
+    Args:
+        batch (pyarrow.RecordBatch): CALL_COLUMNS of calls written by call_convert_to_csv.
+    """
+    import pyarrow.compute as pc
+    return tuple(pc.fill_null(pc.cast(batch[name], "string"), "") for name in CALL_COLUMNS)
+
+
+def table_to_xml(table_file, xml_file):
+    """
+    Converts a Parquet or Arrow file of call logs (see columnar) to XML, a batch at a time.
+
+    Returns:
+        int: Number of call logs written, or None if no XML was written.
+    """
+    try:
+        if columnar.row_count(table_file) == 0:
+            print("Input file is empty. No XML generated.")
+            return
+        count = columnar.table_to_xml(table_file, xml_file, "calls", CALL_ELEMENT, CALL_COLUMNS, call_value_columns,
+                                      "Writing call logs")
+    except Exception as e:
+        print(f"Error converting '{table_file}' to '{xml_file}': {e}")
+        return
+    print(f"Successfully converted '{table_file}' to '{xml_file}'")
+    return count
+
 
 def csv_to_xml_calls(csv_file, xml_file):
-    """Converts a CSV file of call logs to XML."""
+    """
+    Converts a CSV file of call logs to XML, streaming rows straight to the output file. Returns the number of calls written.
+
+    A Parquet or Arrow file (see columnar) is read column-wise instead.
+    """
 
     if not os.path.exists(csv_file):
         print(f"Error: CSV file '{csv_file}' not found.")
         return
 
+    if columnar.table_format(csv_file):
+        return table_to_xml(csv_file, xml_file)
+
     try:
-        with open(csv_file, 'r', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            call_logs = list(reader)
-    except FileNotFoundError:
-        print(f"Error: CSV file '{csv_file}' not found.")
-        return
+        csvfile = compressed.open_file(csv_file, 'r', encoding='utf-8')
+        logs = iter_csv_dicts(csvfile)
+        first = next(logs, None)
     except Exception as e:
         print(f"Error reading CSV file: {e}")
         return
 
-    if not call_logs:
-        print("CSV file is empty. No XML generated.")
-        return
+    with csvfile:
+        if first is None:
+            print("CSV file is empty. No XML generated.")
+            return
 
-    root = ET.Element("calls")
-    root.set("count", str(len(call_logs)))
+        try:
+            progress = Progress("Writing call logs")
+            with android_xml.BackupWriter(xml_file, "calls") as writer:
+                for log in itertools.chain((first,), logs):
+                    writer.write(CALL_ELEMENT, call_values(log))
+                    progress.update()
+            progress.close()
+            print(f"Successfully converted '{csv_file}' to '{xml_file}'")
+            return writer.count
+        except Exception as e:
+            print(f"Error writing XML to '{xml_file}': {e}")
 
-    for log in call_logs:
-        call = ET.SubElement(root, "call")
+def csv_to_xml_calls_chunks(csv_file, xml_file, max_rows=None, max_bytes=None, workers=1):
+    """
+    Converts a CSV file of call logs to several XML backups of at most max_rows elements or max_bytes bytes each.
 
-        # Set attributes, handling potential missing values and type conversions
-        call.set("number", str(log.get("phone_number", "")))
-        call.set("duration", str(log.get("duration", "0")))  # duration is already an int
-        call.set("date", str(log.get("date", "0"))) # date is already correct
-        call.set("type", str(log.get("type", "0"))) #type
-        call.set("presentation", str(log.get("presentation", "1")))  # Default 1
-        call.set("subscription_id", str(log.get("subscription_id", "null"))) #can be null
-        call.set("post_dial_digits", str(log.get("post_dial_digits", "")))
-        call.set("subscription_component_name", str(log.get("subscription_component_name", "null"))) #can be null
-        call.set("readable_date", str(log.get("readable_date", "")))  # Should already be formatted
-        call.set("contact_name", str(log.get("contact_name", "(Unknown)")))
+    See xml_chunks.write_chunks(); the files are named after xml_file and
+    the dates they cover, e.g. "call_logs-001-20230105-20230412.xml".
 
+    Returns:
+        int: Number of call logs written, or None if no XML was written.
+    """
+    if not os.path.exists(csv_file):
+        print(f"Error: CSV file '{csv_file}' not found.")
+        return
 
-    tree = ET.ElementTree(root)
     try:
-        indent(root)  # Pretty-print
-        tree.write(xml_file, encoding="utf-8", xml_declaration=True)
-        print(f"Successfully converted '{csv_file}' to '{xml_file}'")
+        chunks = xml_chunks.write_chunks(csv_file, xml_file, "calls", CALL_ELEMENT, call_values, max_rows, max_bytes,
+                                         workers, label="Writing call logs",
+                                         columns=CALL_COLUMNS, value_columns=call_value_columns)
     except Exception as e:
-        print(f"Error writing XML to '{xml_file}': {e}")
+        print(f"Error writing XML chunks for '{xml_file}': {e}")
+        return
+    if not chunks:
+        print("CSV file is empty. No XML generated.")
+        return
+    for path, count in chunks:
+        print(f"  {path}: {count} call logs")
+    print(f"Successfully converted '{csv_file}' to {len(chunks)} XML files")
+    return sum(count for _, count in chunks)
 
 def main():
     parser = argparse.ArgumentParser(description="Convert a CSV file of call logs to XML.")
     parser.add_argument("csv_file", help="Path to the input CSV file")
     parser.add_argument("-o", "--output", default="call_logs.xml", help="Output XML file name (default: call_logs.xml)")
 
+    xml_chunks.add_chunk_options(parser)
+    parser.add_argument("--timing", action="store_true", help="Report the duration and throughput of the conversion")
+    parser.add_argument("--profile", metavar="FILE", default=None, help="Profile the run with cProfile and write the stats to FILE")
+
     args = parser.parse_args()
-    csv_to_xml_calls(args.csv_file, args.output)
+    with profiled(args.profile), metrics.stage("csv_to_xml_calls") as stage:
+        if args.chunk_rows or args.chunk_size:
+            stage.rows = csv_to_xml_calls_chunks(args.csv_file, args.output, args.chunk_rows, args.chunk_size, args.workers)
+        else:
+            stage.rows = csv_to_xml_calls(args.csv_file, args.output)
+    if args.timing:
+        metrics.report()
 
 if __name__ == "__main__":
     main()
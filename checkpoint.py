@@ -0,0 +1,53 @@
+import json
+import os
+
+# A checkpoint is a small JSON file recording how far previous runs got, so
+# later runs only convert what was added to the iOS databases since:
+#
+#   {"sms": {"rowid": 48211, "date": 735264000000000000}, "calls": {"z_pk": 9120}}
+#
+# "rowid"/"z_pk" are the highest message.ROWID / ZCALLRECORD.Z_PK already
+# written; "date" is the raw sms.db date of the latest message, for reference.
+
+
+def load_checkpoint(path):
+    """
+    Reads a checkpoint file.
+
+    Returns:
+        dict: The saved state, or an empty dict if the file does not exist or
+              cannot be read (everything is then converted again).
+    """
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Warning: could not read checkpoint '{path}': {e}. Starting from the beginning.")
+        return {}
+    if not isinstance(state, dict):
+        print(f"Warning: checkpoint '{path}' is not a JSON object. Starting from the beginning.")
+        return {}
+    return state
+
+
+def save_checkpoint(path, state):
+    """
+    Writes a checkpoint file atomically.
+
+    The state goes to a temporary file next to the checkpoint, which then
+    replaces it, so an interrupted run never leaves a truncated checkpoint.
+    """
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+        f.write("\n")
+    os.replace(temporary, path)
+
+
+def update_checkpoint(path, section, values):
+    """Merges values into one section ('sms' or 'calls') of a checkpoint file and saves it."""
+    state = load_checkpoint(path)
+    state.setdefault(section, {}).update(values)
+    save_checkpoint(path, state)
@@ -0,0 +1,213 @@
+import csv
+import android_xml
+import compressed
+from instrumentation import Progress
+
+# Typed intermediate files between the extractors and the XML converters. A
+# path ending in .parquet or .arrow (Arrow IPC, also .feather) holds the same
+# rows and columns as the CSV, with numbers stored as integers: no quoting,
+# parsing or re-stringifying, and the XML converters read only the columns
+# they need. Parquet files are compressed (zstd) and the smallest; Arrow IPC
+# files are written uncompressed so they are read straight from a memory map
+# without copying. Any other path is a CSV. pyarrow is only imported when
+# such a file is written or read.
+FORMATS = ("csv", "parquet", "arrow")
+SUFFIXES = {".parquet": "parquet", ".arrow": "arrow", ".feather": "arrow"}
+BATCH_ROWS = 1 << 16  # Rows per record batch / Parquet row group
+PARQUET_COMPRESSION = "zstd"
+
+
+def table_format(path):
+    """Returns "parquet" or "arrow" for a typed file, None for a CSV (by suffix)."""
+    name = path.lower()
+    for suffix, kind in SUFFIXES.items():
+        if name.endswith(suffix):
+            return kind
+    return None
+
+
+def output_path(stem, file_format):
+    """Returns stem with the suffix of file_format ("csv", "parquet" or "arrow") appended."""
+    return f"{stem}.{file_format}"
+
+
+def _schema(fieldnames, integer_fields):
+    import pyarrow as pa
+    return pa.schema([(name, pa.int64() if name in integer_fields else pa.string()) for name in fieldnames])
+
+
+class TableWriter:
+    """
+    Writes rows to a Parquet or Arrow IPC file, BATCH_ROWS at a time.
+
+    Rows are given as mappings (writerow(), like csv.DictWriter) or as
+    sequences in fieldnames order (write_values(), like csv.writer).
+    Missing values are stored as nulls.
+    """
+
+    def __init__(self, path, fieldnames, integer_fields=()):
+        import pyarrow as pa
+        self.fieldnames = list(fieldnames)
+        self.schema = _schema(self.fieldnames, frozenset(integer_fields))
+        self.count = 0
+        self._rows = []
+        if table_format(path) == "parquet":
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(path, self.schema, compression=PARQUET_COMPRESSION)
+        else:
+            self._writer = pa.ipc.new_file(path, self.schema)
+
+    def writerow(self, row):
+        self.write_values([row.get(name) for name in self.fieldnames])
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def write_values(self, values):
+        self._rows.append(values)
+        if len(self._rows) >= BATCH_ROWS:
+            self._flush()
+
+    def _flush(self):
+        import pyarrow as pa
+        if not self._rows:
+            return
+        columns = zip(*self._rows)
+        arrays = [pa.array(column, type=field.type, from_pandas=True) for column, field in zip(columns, self.schema)]
+        self._writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+        self.count += len(self._rows)
+        self._rows = []
+
+    def close(self):
+        """Writes the last batch and finishes the file. Returns the number of rows written."""
+        if self._writer is not None:
+            try:
+                self._flush()
+            finally:
+                self._writer.close()
+                self._writer = None
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class CsvWriter:
+    """The CSV counterpart of TableWriter: a csv.DictWriter over a (possibly compressed) file, header written."""
+
+    def __init__(self, path, fieldnames, **csv_options):
+        self._file = compressed.open_file(path, 'w', newline='', encoding='utf-8')
+        self._dict_writer = csv.DictWriter(self._file, fieldnames=fieldnames, **csv_options)
+        self._dict_writer.writeheader()
+        csv_options.pop("extrasaction", None)
+        self._writer = csv.writer(self._file, **csv_options)
+        self.writerow = self._dict_writer.writerow
+        self.writerows = self._dict_writer.writerows
+        self.write_values = self._writer.writerow
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def open_writer(path, fieldnames, integer_fields=(), **csv_options):
+    """
+    Opens a row writer for path: a TableWriter for .parquet/.arrow files, a CsvWriter otherwise.
+
+    Args:
+        path (str): Output file.
+        fieldnames (list): Columns, in order.
+        integer_fields (iterable): Columns stored as 64-bit integers in typed files (the rest are strings).
+        **csv_options: Passed to csv.DictWriter / csv.writer for CSV files.
+    """
+    if table_format(path):
+        return TableWriter(path, fieldnames, integer_fields)
+    return CsvWriter(path, fieldnames, **csv_options)
+
+
+def _batch_sources(path, columns):
+    # Yields (rows, read) for each record batch / row group of a typed file,
+    # read() returning it as a table of the given columns.
+    import pyarrow as pa
+    if table_format(path) == "parquet":
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(path, memory_map=True)
+        for i in range(parquet_file.num_row_groups):
+            yield (parquet_file.metadata.row_group(i).num_rows,
+                   lambda i=i: parquet_file.read_row_group(i, columns=columns))
+        return
+    with pa.memory_map(path) as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)  # Zero-copy: the batch points into the memory map
+            yield batch.num_rows, lambda batch=batch: pa.Table.from_batches([batch.select(columns)])
+
+
+def row_count(path):
+    """Returns the number of rows of a Parquet or Arrow IPC file, from its metadata."""
+    return sum(rows for rows, _ in _batch_sources(path, []))
+
+
+def iter_batches(path, columns, start=0, count=None):
+    """
+    Yields the given columns of rows [start, start + count) of a Parquet or Arrow IPC file as record batches.
+
+    Only the row groups / batches holding those rows are read, and only the
+    requested columns of them.
+    """
+    end = None if count is None else start + count
+    offset = 0
+    for rows, read in _batch_sources(path, columns):
+        first, offset = offset, offset + rows
+        if offset <= start:
+            continue
+        if end is not None and first >= end:
+            break
+        table = read()
+        low = max(start - first, 0)
+        high = rows if end is None else min(end - first, rows)
+        yield from table.slice(low, high - low).to_batches()
+
+
+def iter_elements(path, columns, value_columns, element_format, start=0, count=None):
+    """
+    Yields (batch, elements) for the rows of a Parquet or Arrow IPC file, rendered a batch at a time.
+
+    Args:
+        path (str): The file.
+        columns (list): Columns read from it.
+        value_columns (callable): Takes a record batch and returns the
+            variable attributes as string arrays, in element_format order.
+        element_format (android_xml.ElementFormat): Format of each element.
+        start, count: Rows to read (see iter_batches()).
+
+    Yields:
+        tuple: The record batch and its elements (see android_xml.ElementFormat.render_columns()).
+    """
+    for batch in iter_batches(path, columns, start, count):
+        yield batch, element_format.render_columns(value_columns(batch))
+
+
+def table_to_xml(path, xml_file, root_tag, element_format, columns, value_columns, label):
+    """
+    Writes the rows of a Parquet or Arrow IPC file to one XML backup. Returns the number of elements written.
+
+    Each batch is rendered and written in one go (see iter_elements()), so
+    no Python code runs per row.
+    """
+    progress = Progress(label, row_count(path))
+    with android_xml.BackupWriter(xml_file, root_tag) as writer:
+        for _, elements in iter_elements(path, columns, value_columns, element_format):
+            writer.write_elements(elements)
+            progress.update(len(elements))
+    progress.close()
+    return writer.count
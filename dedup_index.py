@@ -0,0 +1,62 @@
+import hashlib
+from array import array
+import android_xml
+import phone_numbers
+from instrumentation import metrics
+
+
+def content_hash(address, date, body):
+    """
+    Returns a signed 64-bit hash of (address match key, date in whole seconds, body).
+
+    The address goes through phone_numbers.match_key(), so the national and
+    international forms of a number hash alike under the --country-code
+    rule, while numbers from different countries never do.
+
+    Args:
+        address (str): Phone number or handle.
+        date (int): Java timestamp in milliseconds.
+        body (str): Message text.
+    """
+    key = f"{phone_numbers.match_key(address)}\x1f{int(date) // 1000}\x1f{body or ''}"
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+
+class ContentIndex:
+    """
+    Set of content hashes of the messages already on the Android phone.
+
+    Hashes are kept in one sorted int64 array (8 bytes per message), so
+    millions of messages fit in a few tens of megabytes; membership is a
+    binary search.
+    """
+
+    def __init__(self, hashes):
+        import numpy as np
+        self.hashes = np.unique(np.asarray(hashes, dtype=np.int64))
+
+    @classmethod
+    def from_xml(cls, xml_file, tag="sms", address_attribute="address", body_attribute="body"):
+        """
+        Builds the index from the elements of an SMS Backup & Restore XML file in one streaming pass.
+
+        The defaults index 'sms' elements; from_xml(path, "call", "number", None)
+        indexes a call log backup by number and date alone.
+        """
+        hashes = array("q")
+        for _, attributes in android_xml.iter_elements(xml_file, (tag,)):
+            body = attributes.get(body_attribute) if body_attribute else None
+            try:
+                hashes.append(content_hash(attributes.get(address_attribute), attributes.get("date", "0"), body))
+            except ValueError:
+                metrics.error("invalid date in the Android backup", attributes.get("date"))
+        return cls(hashes)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __contains__(self, message):
+        """True if a message (phone_number, date, body) or call (phone_number, date) dictionary is already in the backup."""
+        value = content_hash(message["phone_number"], message["date"], message.get("body"))
+        position = self.hashes.searchsorted(value)
+        return position < len(self.hashes) and self.hashes[position] == value
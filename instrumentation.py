@@ -0,0 +1,167 @@
+import contextlib
+import sys
+import time
+from collections import Counter
+
+PROGRESS_INTERVAL = 2.0  # Seconds between progress lines
+ERROR_EXAMPLES = 3  # Messages kept per error kind for the report
+PROFILE_LINES = 20  # Functions listed after a --profile run
+
+
+class StageTimer:
+    """Time and row count of one processing stage, filled in by Metrics.stage()."""
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.rows = None
+
+    def __str__(self):
+        if self.rows is None:
+            return f"{self.name}: {self.seconds:.2f}s"
+        rate = self.rows / self.seconds if self.seconds > 0 else float("inf")
+        return f"{self.name}: {self.rows} rows in {self.seconds:.2f}s ({rate:,.0f} rows/sec)"
+
+
+class Metrics:
+    """
+    Stage timers, row counters and aggregated errors for one run.
+
+    Hot loops call count() and error() instead of printing, so a database
+    with thousands of undecodable rows produces one summary line per kind
+    of problem rather than thousands of lines.
+    """
+
+    def __init__(self):
+        self.stages = []
+        self.counters = Counter()
+        self.errors = Counter()
+        self.error_examples = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Times the block as stage name. The yielded StageTimer's rows can be set to report throughput."""
+        timer = StageTimer(name)
+        start = time.perf_counter()
+        try:
+            yield timer
+        finally:
+            timer.seconds = time.perf_counter() - start
+            self.stages.append(timer)
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def error(self, kind, detail=None):
+        """Records one error of the given kind; the first few details are kept as examples."""
+        self.errors[kind] += 1
+        if detail is not None:
+            examples = self.error_examples.setdefault(kind, [])
+            if len(examples) < ERROR_EXAMPLES:
+                examples.append(detail)
+
+    def report_errors(self, file=None):
+        """Prints one line per kind of error, with a few examples."""
+        file = file or sys.stdout
+        for kind, total in self.errors.items():
+            examples = self.error_examples.get(kind)
+            suffix = f" (e.g. {'; '.join(examples)})" if examples else ""
+            print(f"{kind}: {total} rows{suffix}", file=file)
+
+    def report(self, file=None):
+        """Prints the stage timings and counters."""
+        file = file or sys.stdout
+        for timer in self.stages:
+            print(timer, file=file)
+        for name, total in self.counters.items():
+            print(f"{name}: {total}", file=file)
+
+    def reset(self):
+        self.__init__()
+
+
+metrics = Metrics()  # Shared by all modules of the current process
+
+
+class Progress:
+    """
+    Throttled progress line: rows done, rate and, when the total is known, percentage and ETA.
+
+    update() is cheap enough to call per row; the clock is only read every
+    few hundred rows and a line is printed at most every PROGRESS_INTERVAL
+    seconds. Progress is written to stderr and only when it is a terminal,
+    so redirected output and logs stay clean.
+
+    Args:
+        label (str): What is being processed, e.g. "Reading messages".
+        total (int): Expected number of rows, if known.
+        enabled (bool): Force progress on or off (default: stderr is a terminal).
+    """
+
+    CHECK_EVERY = 500  # Rows between clock reads
+
+    def __init__(self, label, total=None, enabled=None, stream=None):
+        self.label = label
+        self.total = total
+        self.done = 0
+        self.stream = stream or sys.stderr
+        self.enabled = self.stream.isatty() if enabled is None else enabled
+        self._start = self._last = time.perf_counter()
+        self._next_check = self.CHECK_EVERY
+        self._shown = False
+
+    def update(self, n=1):
+        self.done += n
+        if not self.enabled or self.done < self._next_check:
+            return
+        self._next_check = self.done + self.CHECK_EVERY
+        now = time.perf_counter()
+        if now - self._last >= PROGRESS_INTERVAL:
+            self._last = now
+            self._show(now)
+
+    def _show(self, now, end="\r"):
+        elapsed = now - self._start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        line = f"{self.label}: {self.done:,} rows"
+        if self.total:
+            line += f" of {self.total:,} ({100 * self.done / self.total:.0f}%)"
+        line += f", {rate:,.0f} rows/sec"
+        if self.total and rate > 0 and self.done < self.total:
+            line += f", ETA {(self.total - self.done) / rate:.0f}s"
+        self.stream.write(line.ljust(79) + end)
+        self.stream.flush()
+        self._shown = True
+
+    def close(self):
+        """Prints the final line if any progress was shown."""
+        if self.enabled and self._shown:
+            self._show(time.perf_counter(), end="\n")
+
+
+@contextlib.contextmanager
+def profiled(profile_file=None):
+    """
+    Runs the block under cProfile when profile_file is given.
+
+    The raw stats are written to profile_file (open them with
+    `python -m pstats FILE`) and the most expensive functions by cumulative
+    time are printed.
+    """
+    if not profile_file:
+        yield
+        return
+    import cProfile
+    import io
+    import pstats
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(profile_file)
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(PROFILE_LINES)
+        print(summary.getvalue())
+        print(f"Profile written to {profile_file} (view it with: python -m pstats {profile_file})")
@@ -0,0 +1,415 @@
+import argparse
+import contextlib
+import csv
+import os
+import sqlite3
+import tempfile
+import addressbook
+import android_xml
+import backup_merge
+import call_convert_to_csv
+import checkpoint
+import columnar
+import dedup_index
+import mms
+import phone_numbers
+import sms_convert_to_csv
+from calls_csv_to_xml import CALL_ELEMENT, call_values
+from instrumentation import metrics, profiled
+from sms_csv_to_xml import SMS_ELEMENT, sms_values
+
+NOTHING_NEW = {"rows_read": 0, "duplicates": 0, "rows_written": 0, "rows_skipped": 0}
+
+
+def count_items(items, counts, key):
+    """Passes items through unchanged, counting them in counts[key]."""
+    for item in items:
+        counts[key] += 1
+        yield item
+
+
+def filter_messages(messages, message_filter):
+    """Yields the messages that pass message_filter (a sms_convert_to_csv.MessageFilter)."""
+    for message in messages:
+        if message_filter(message):
+            yield message
+
+
+def merge_with_backup(items, backup_file, date, stack):
+    """
+    Interleaves date-ordered items with the elements of an Android backup (see backup_merge).
+
+    Sorted runs of the backup are spilled to a temporary directory that
+    stack removes when it closes.
+
+    Yields:
+        Raw backup elements (bytes) and items, in date order.
+
+    Raises:
+        android_xml.ParseError: If the backup is not well-formed XML.
+    """
+    directory = stack.enter_context(tempfile.TemporaryDirectory(prefix="ios_to_android_merge_"))
+    with metrics.stage("sort_backup"):
+        runs = backup_merge.backup_runs(backup_file, directory)
+    return backup_merge.merge(runs, items, date)
+
+
+def convert_sms(db_file, xml_file, backup_file=None, dedup_mode="cutoff", csv_file=None,
+                batch_size=sms_convert_to_csv.BATCH_SIZE, workers=1, checkpoint_file=None,
+                include_mms=False, attachments_dir=None, attachment_threads=mms.READ_THREADS, in_memory=False,
+                contacts=None, merge=False):
+    """
+    Converts an iOS sms.db straight to an SMS Backup & Restore XML file.
+
+    The work is a chain of generators, so each message flows through every
+    stage before the next one is read and memory use stays flat:
+    extract and decode (sms_convert_to_csv.iter_messages) -> dedup
+    (dedup_messages) -> filter (MessageFilter) -> serialize (BackupWriter).
+    Values keep their database types until they are written; nothing goes
+    through an intermediate CSV. Nothing is asked interactively: without a
+    backup every message is written.
+
+    With a checkpoint file only messages added since the last run (higher
+    ROWIDs) are read, and the checkpoint is moved forward once the XML is
+    written. If there is nothing new, no XML is written at all.
+
+    With include_mms, group chat messages and messages with attachments are
+    written as <mms> elements (see mms.write_mms()); attachment files are
+    read from attachments_dir on a thread pool and streamed into the XML as
+    base64, so memory use does not depend on their size.
+
+    With merge, the output is the whole backup with the new messages slotted
+    in by date, so it replaces the phone's history in one restore. Backup
+    elements are copied byte for byte and need not be in date order; the
+    backup is sorted in runs on disk and k-way merged with the iOS stream,
+    so memory use does not grow with either input.
+
+    Args:
+        db_file (str): Path to the iOS sms.db.
+        xml_file (str): Path to the XML file to write.
+        backup_file (str): Optional Android XML backup used to skip messages already on the phone.
+        dedup_mode (str): How the backup is used, see sms_convert_to_csv.get_message_filter().
+        csv_file (str): Optional path of a CSV copy of the written messages.
+        batch_size (int): Number of rows fetched per round trip.
+        workers (int): Processes used to decode attributedBody blobs (1 = serial).
+        checkpoint_file (str): Optional checkpoint (see checkpoint.py) for incremental runs.
+        include_mms (bool): Write group chats and attachments as <mms> elements.
+        attachments_dir (str): Directory with the backup's Library/SMS files, for include_mms.
+        attachment_threads (int): Attachment files read at the same time.
+        in_memory (bool): Copy sms.db into RAM before reading it (see ios_db.connect()).
+        contacts (addressbook.ContactIndex): Fills in contact names when given.
+        merge (bool): Also copy every element of backup_file into the output, in date order.
+
+    Returns:
+        dict: rows_read, duplicates, rows_written and rows_skipped; empty if the conversion failed.
+        With merge, also backup_rows, the number of elements copied from the backup.
+    """
+    if not os.path.exists(db_file):
+        print(f"Error: Database file '{db_file}' not found.")
+        return {}
+    if merge and not (backup_file and os.path.exists(backup_file)):
+        print(f"Error: Android backup '{backup_file}' not found; nothing to merge with.")
+        return {}
+
+    min_rowid = max_rowid = None
+    if checkpoint_file:
+        min_rowid = checkpoint.load_checkpoint(checkpoint_file).get("sms", {}).get("rowid")
+        try:
+            max_rowid, max_date = sms_convert_to_csv.get_latest_message(db_file)
+        except sqlite3.Error as e:
+            print(f"SQLite error: {e}")
+            return {}
+        if max_rowid is None or (min_rowid is not None and max_rowid <= min_rowid):
+            print(f"No new messages since the last checkpoint (ROWID {min_rowid}).")
+            return dict(NOTHING_NEW)
+        if min_rowid is not None:
+            print(f"Converting messages after ROWID {min_rowid} (up to {max_rowid}).")
+
+    message_filter = sms_convert_to_csv.get_message_filter(backup_file, dedup_mode, prompt=False)
+    counts = {"read": 0, "deduplicated": 0}
+
+    messages = sms_convert_to_csv.iter_messages(db_file, batch_size, workers, min_rowid, max_rowid, include_mms, in_memory)
+    messages = count_items(messages, counts, "read")
+    messages = count_items(sms_convert_to_csv.dedup_messages(messages), counts, "deduplicated")
+    messages = filter_messages(messages, message_filter)
+    if contacts is not None:
+        messages = sms_convert_to_csv.add_contact_names(messages, contacts)
+
+    backup_rows = 0
+    csv_writer = None
+    try:
+        if csv_file:
+            csv_writer = columnar.open_writer(csv_file, sms_convert_to_csv.CSV_FIELDNAMES, sms_convert_to_csv.INTEGER_FIELDS,
+                                              extrasaction="ignore")
+        with contextlib.ExitStack() as stack:
+            writer = stack.enter_context(android_xml.BackupWriter(xml_file, "smses"))
+            if include_mms:
+                reader = stack.enter_context(mms.AttachmentReader(attachments_dir, attachment_threads))
+                items = reader.prefetch(messages)
+            else:
+                items = ((message, None) for message in messages)
+            if merge:
+                items = merge_with_backup(items, backup_file, lambda item: item[0]["date"], stack)
+            for item in items:
+                if isinstance(item, bytes):
+                    writer.write_raw(item)
+                    backup_rows += 1
+                    continue
+                message, files = item
+                if files is None:
+                    writer.write(SMS_ELEMENT, sms_values(message))
+                else:
+                    mms.write_mms(writer, message, files)
+                if csv_writer is not None:
+                    csv_writer.writerow(message)
+        rows_written = writer.count - backup_rows
+    except sqlite3.Error as e:
+        print(f"SQLite error: {e}")
+        return {}
+    except android_xml.ParseError as e:
+        print(f"Error parsing Android backup '{backup_file}': {e}")
+        return {}
+    except IOError as e:
+        print(f"I/O error writing to '{xml_file}': {e}")
+        return {}
+    finally:
+        if csv_writer is not None:
+            csv_writer.close()
+
+    rows_read, total_rows = counts["read"], counts["deduplicated"]
+    print(f"Messages successfully written to {xml_file}, deduplicated, sorted, and filtered.")
+    if csv_file:
+        print(f"CSV copy written to {csv_file}")
+    print(f"iMessage/SMS duplicates removed: {rows_read - total_rows}")
+    print(f"Total rows: {total_rows}")
+    print(f"Rows written: {rows_written}")
+    print(f"Rows not written: {total_rows - rows_written}")
+    message_filter.report()
+    if merge:
+        print(f"Merged with {backup_rows} elements of {backup_file}: {writer.count} in total.")
+    if checkpoint_file:
+        checkpoint.update_checkpoint(checkpoint_file, "sms", {"rowid": max_rowid, "date": max_date})
+    stats = {
+        "rows_read": rows_read,
+        "duplicates": rows_read - total_rows,
+        "rows_written": rows_written,
+        "rows_skipped": total_rows - rows_written,
+    }
+    if merge:
+        stats["backup_rows"] = backup_rows
+    return stats
+
+
+def convert_calls(db_file, xml_file, self_number="", csv_file=None, checkpoint_file=None, in_memory=False, contacts=None,
+                  backup_file=None, merge=False):
+    """
+    Converts an iOS CallHistory database straight to an SMS Backup & Restore XML file.
+
+    Calls are classified and sorted by SQLite and streamed from the cursor
+    to the XML (see call_convert_to_csv.iter_call_logs()), so memory use
+    does not grow with the call history. With a checkpoint file only calls
+    added since the last run (higher Z_PKs) are read, as in convert_sms().
+
+    With a call log backup, calls already in it (same number and date, to
+    the second) are skipped; with merge, the output also contains every call
+    of the backup, merged by date as in convert_sms().
+
+    Args:
+        db_file (str): Path to the CallHistory database.
+        xml_file (str): Path to the XML file to write.
+        self_number (str): Own phone number, used in WhatsApp subscription IDs.
+        csv_file (str): Optional path of a CSV copy of the written calls.
+        checkpoint_file (str): Optional checkpoint (see checkpoint.py) for incremental runs.
+        in_memory (bool): Copy the database into RAM before reading it (see ios_db.connect()).
+        contacts (addressbook.ContactIndex): Fills in contact names when given.
+        backup_file (str): Optional Android call log XML backup used to skip calls already on the phone.
+        merge (bool): Also copy every element of backup_file into the output, in date order.
+
+    Returns:
+        dict: rows_read, duplicates, rows_written and rows_skipped; empty if the conversion failed.
+        With merge, also backup_rows, the number of elements copied from the backup.
+    """
+    if not os.path.exists(db_file):
+        print(f"Error: Database file '{db_file}' not found.")
+        return {}
+    if (backup_file or merge) and not (backup_file and os.path.exists(backup_file)):
+        print(f"Error: Android backup '{backup_file}' not found.")
+        return {}
+
+    min_pk = max_pk = None
+    if checkpoint_file:
+        min_pk = checkpoint.load_checkpoint(checkpoint_file).get("calls", {}).get("z_pk")
+        try:
+            max_pk = call_convert_to_csv.get_latest_call(db_file)
+        except sqlite3.Error as e:
+            print(f"SQLite error: {e}")
+            return {}
+        if max_pk is None or (min_pk is not None and max_pk <= min_pk):
+            print(f"No new calls since the last checkpoint (Z_PK {min_pk}).")
+            return dict(NOTHING_NEW)
+        if min_pk is not None:
+            print(f"Converting calls after Z_PK {min_pk} (up to {max_pk}).")
+
+    counts = {"read": 0, "new": 0}
+    call_logs = call_convert_to_csv.iter_call_logs(db_file, self_number, min_pk, max_pk, in_memory, contacts)
+    call_logs = count_items(call_logs, counts, "read")
+    if backup_file:
+        try:
+            index = dedup_index.ContentIndex.from_xml(backup_file, "call", "number", None)
+        except android_xml.ParseError as e:
+            print(f"Error parsing Android backup '{backup_file}': {e}")
+            return {}
+        call_logs = (log for log in call_logs if log not in index)
+    call_logs = count_items(call_logs, counts, "new")
+
+    backup_rows = 0
+    csv_writer = None
+    try:
+        if csv_file:
+            csv_writer = columnar.open_writer(csv_file, call_convert_to_csv.CSV_FIELDNAMES,
+                                              call_convert_to_csv.INTEGER_FIELDS, quoting=csv.QUOTE_ALL)
+        with contextlib.ExitStack() as stack:
+            writer = stack.enter_context(android_xml.BackupWriter(xml_file, "calls"))
+            items = call_logs
+            if merge:
+                items = merge_with_backup(items, backup_file, lambda log: log["date"], stack)
+            for item in items:
+                if isinstance(item, bytes):
+                    writer.write_raw(item)
+                    backup_rows += 1
+                    continue
+                writer.write(CALL_ELEMENT, call_values(item))
+                if csv_writer is not None:
+                    csv_writer.writerow(item)
+        rows_written = writer.count - backup_rows
+    except sqlite3.Error as e:
+        print(f"SQLite error: {e}")
+        return {}
+    except android_xml.ParseError as e:
+        print(f"Error parsing Android backup '{backup_file}': {e}")
+        return {}
+    except IOError as e:
+        print(f"I/O error writing to '{xml_file}': {e}")
+        return {}
+    finally:
+        if csv_writer is not None:
+            csv_writer.close()
+
+    rows_read = counts["read"]
+    if backup_file:
+        print(f"Calls already in the backup: {rows_read - counts['new']}")
+    print(f"Call logs successfully written to {xml_file}, sorted by date.")
+    if csv_file:
+        print(f"CSV copy written to {csv_file}")
+    print(f"Rows written: {rows_written}")
+    if merge:
+        print(f"Merged with {backup_rows} elements of {backup_file}: {writer.count} in total.")
+    if checkpoint_file:
+        checkpoint.update_checkpoint(checkpoint_file, "calls", {"z_pk": max_pk})
+    stats = {"rows_read": rows_read, "duplicates": rows_read - counts["new"], "rows_written": rows_written, "rows_skipped": 0}
+    if merge:
+        stats["backup_rows"] = backup_rows
+    return stats
+
+
+def common_options():
+    """Options shared by every subcommand."""
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--timing", action="store_true", help="Report the duration, throughput and row counts of each stage")
+    parser.add_argument("--profile", metavar="FILE", default=None, help="Profile the run with cProfile and write the stats to FILE")
+    parser.add_argument("--in-memory", action="store_true", help="Copy the database into RAM before reading it (faster on slow or network storage)")
+    parser.add_argument("--addressbook", default=None, help="iOS AddressBook.sqlitedb used to fill in contact names")
+    phone_numbers.add_country_option(parser)
+    return parser
+
+
+def add_sms_parser(subparsers):
+    parser = subparsers.add_parser("sms", parents=[common_options()],
+                                   help="Convert an iOS sms.db to an SMS Backup & Restore XML file",
+                                   description="Convert an iOS sms.db to an SMS Backup & Restore XML file in one pass.")
+    parser.add_argument("db_file", help="Path to the iOS sms.db file")
+    parser.add_argument("-o", "--output", default="output.xml", help="Output XML file name (default: output.xml)")
+    parser.add_argument("-x", "--xml", default=None, help="Path to the Android XML backup, used to skip messages already on the phone")
+    parser.add_argument("-d", "--dedup", choices=["cutoff", "content"], default="cutoff",
+                        help="How the XML backup is used: 'cutoff' keeps messages newer than its latest SMS, "
+                             "'content' drops messages whose address, date and body are already in it (default: cutoff)")
+    parser.add_argument("--csv", default=None, help="Also write the converted messages to this CSV file (or .parquet / .arrow file)")
+    parser.add_argument("--batch-size", type=int, default=sms_convert_to_csv.BATCH_SIZE,
+                        help=f"Rows fetched per batch (default: {sms_convert_to_csv.BATCH_SIZE})")
+    parser.add_argument("--workers", type=int, default=1, help="Processes used to decode attributedBody blobs (default: 1, serial)")
+    parser.add_argument("--checkpoint", default=None,
+                        help="Checkpoint file: only convert messages added since the last run that used it, then update it")
+    parser.add_argument("--mms", action="store_true", help="Also convert group chats and messages with attachments, as MMS")
+    parser.add_argument("--attachments", default=None,
+                        help="Directory with the backup's Library/SMS files (containing 'Attachments'); "
+                             "attachment files found there are embedded in the MMS. Implies --mms")
+    parser.add_argument("--attachment-threads", type=int, default=mms.READ_THREADS,
+                        help=f"Attachment files read at the same time (default: {mms.READ_THREADS})")
+    parser.add_argument("--merge", action="store_true",
+                        help="Write the whole Android backup (-x) with the new messages merged in by date, "
+                             "instead of the new messages alone")
+    parser.set_defaults(run=run_sms)
+
+
+def add_calls_parser(subparsers):
+    parser = subparsers.add_parser("calls", parents=[common_options()], help="Convert an iOS CallHistory database to an SMS Backup & Restore XML file",
+                                   description="Convert an iOS CallHistory database to an SMS Backup & Restore XML file in one pass.")
+    parser.add_argument("db_file", help="Path to the iOS call history database")
+    parser.add_argument("-o", "--output", default="call_logs.xml", help="Output XML file name (default: call_logs.xml)")
+    parser.add_argument("-s", "--self-number", default="", help="Your phone number, used for WhatsApp subscription IDs")
+    parser.add_argument("--csv", default=None, help="Also write the converted calls to this CSV file (or .parquet / .arrow file)")
+    parser.add_argument("--checkpoint", default=None,
+                        help="Checkpoint file: only convert calls added since the last run that used it, then update it")
+    parser.add_argument("-x", "--xml", default=None,
+                        help="Path to the Android call log XML backup, used to skip calls already on the phone")
+    parser.add_argument("--merge", action="store_true",
+                        help="Write the whole Android backup (-x) with the new calls merged in by date, "
+                             "instead of the new calls alone")
+    parser.set_defaults(run=run_calls)
+
+
+def run_sms(args, parser):
+    if args.dedup == "content" and not args.xml:
+        parser.error("--dedup content needs the Android backup (-x/--xml)")
+    if args.attachments is not None and not os.path.isdir(args.attachments):
+        parser.error(f"--attachments: '{args.attachments}' is not a directory")
+    if args.merge and not args.xml:
+        parser.error("--merge needs the Android backup (-x/--xml)")
+    with metrics.stage("sms") as stage:
+        stats = convert_sms(args.db_file, args.output, backup_file=args.xml, dedup_mode=args.dedup, csv_file=args.csv,
+                            batch_size=args.batch_size, workers=args.workers, checkpoint_file=args.checkpoint,
+                            include_mms=args.mms or args.attachments is not None, attachments_dir=args.attachments,
+                            attachment_threads=args.attachment_threads, in_memory=args.in_memory,
+                            contacts=addressbook.load_contacts(args.addressbook), merge=args.merge)
+        stage.rows = stats.get("rows_read")
+    sms_convert_to_csv.report_decoder_stats()
+
+
+def run_calls(args, parser):
+    if args.merge and not args.xml:
+        parser.error("--merge needs the Android call log backup (-x/--xml)")
+    with metrics.stage("calls") as stage:
+        stats = convert_calls(args.db_file, args.output, self_number=args.self_number, csv_file=args.csv,
+                              checkpoint_file=args.checkpoint, in_memory=args.in_memory,
+                              contacts=addressbook.load_contacts(args.addressbook), backup_file=args.xml,
+                              merge=args.merge)
+        stage.rows = stats.get("rows_read")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert iOS messages and call history to SMS Backup & Restore XML files.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    add_sms_parser(subparsers)
+    add_calls_parser(subparsers)
+
+    args = parser.parse_args()
+    phone_numbers.set_country(*args.country_code)
+    with profiled(args.profile):
+        args.run(args, parser)
+    metrics.report_errors()
+    if args.timing:
+        metrics.report()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+import base64
+import os
+import queue
+import threading
+from collections import deque
+import android_xml
+from instrumentation import metrics
+
+# Raw bytes read and encoded at a time. A multiple of 3, so every chunk but
+# the last encodes without padding and the encoded chunks simply concatenate
+# into one base64 value. (base64.encode() is not used: it breaks lines every
+# 76 characters, which an XML parser turns into spaces inside an attribute.)
+CHUNK_SIZE = 3 * 256 * 1024
+QUEUED_CHUNKS = 4  # Encoded chunks buffered per attachment ahead of the writer
+READ_THREADS = 4  # Attachment files read at the same time
+LOOKAHEAD = 32  # Messages whose attachments are queued for reading ahead of the writer
+
+# Attachment paths in sms.db point into the phone's file system; the part
+# after the SMS directory is looked up in the --attachments directory.
+SMS_DIRECTORY_PREFIXES = ("~/Library/SMS/", "/var/mobile/Library/SMS/", "/private/var/mobile/Library/SMS/")
+
+SELF_ADDRESS = "insert-address-token"  # What Android records as the own address of a sent MMS
+ADDRESS_FROM, ADDRESS_TO = "137", "151"  # PduHeaders.FROM / PduHeaders.TO
+
+# Attributes of each <mms> element, in the order SMS Backup & Restore writes them.
+MMS_ELEMENT = android_xml.ElementFormat("mms", (
+    ("date", None),
+    ("ct_t", "application/vnd.wap.multipart.related"),
+    ("msg_box", None),  # 1 = received, 2 = sent
+    ("rr", "null"),
+    ("sub", "null"),
+    ("read_status", "null"),
+    ("address", None),  # All recipients, separated by "~"
+    ("m_id", "null"),
+    ("read", "1"),
+    ("m_size", "null"),
+    ("m_type", None),  # 132 = retrieve-conf (received), 128 = send-req (sent)
+    ("sim_slot", "0"),
+    ("readable_date", None),
+    ("contact_name", None),
+    ("text_only", None),
+    ("seen", "1"),
+    ("locked", "0"),
+    ("date_sent", "0"),
+    ("sub_id", "-1"),
+), end=">")
+PARTS_ELEMENT = android_xml.ElementFormat("parts", (), level=2, end=">")
+ADDRS_ELEMENT = android_xml.ElementFormat("addrs", (), level=2, end=">")
+TEXT_PART = android_xml.ElementFormat("part", (
+    ("seq", "0"),
+    ("ct", "text/plain"),
+    ("name", "null"),
+    ("chset", "106"),  # UTF-8
+    ("cd", "null"),
+    ("fn", "null"),
+    ("cid", "<text000>"),
+    ("cl", "text000.txt"),
+    ("ctt_s", "null"),
+    ("ctt_t", "null"),
+    ("text", None),
+), level=3)
+# The data attribute comes last and is left open: its value is streamed.
+FILE_PART = android_xml.ElementFormat("part", (
+    ("seq", "0"),
+    ("ct", None),
+    ("name", None),
+    ("chset", "null"),
+    ("cd", "null"),
+    ("fn", "null"),
+    ("cid", None),
+    ("cl", None),
+    ("ctt_s", "null"),
+    ("ctt_t", "null"),
+    ("text", "null"),
+), level=3, end=' data="')
+ADDR_ELEMENT = android_xml.ElementFormat("addr", (
+    ("address", None),
+    ("type", None),
+    ("charset", "106"),
+), level=3)
+
+OBJECT_REPLACEMENT = "\ufffc"  # Placeholder Messages puts in the text where an attachment goes
+
+
+def is_mms(message):
+    """True for messages that become <mms>: group chat messages and messages with attachments."""
+    return bool(message["attachments"]) or len(message["recipients"]) > 1 or bool(message["cache_roomname"])
+
+
+class EncodedFile:
+    """
+    One attachment file, read and base64-encoded on a background thread.
+
+    Iterating yields the encoded chunks in order. At most QUEUED_CHUNKS
+    chunks wait in memory, so a multi-GB video costs a few MB.
+
+    Raises:
+        OSError: At the end of the iteration, if the file could not be read.
+    """
+
+    def __init__(self, path, executor, closed):
+        self.path = path
+        self._chunks = queue.Queue(QUEUED_CHUNKS)
+        self._closed = closed
+        self._future = executor.submit(self._read)
+
+    def _put(self, item):
+        # Gives up when the reader is closed, so an abandoned file cannot block shutdown.
+        while not self._closed.is_set():
+            try:
+                self._chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _read(self):
+        try:
+            with open(self.path, "rb") as f:
+                while True:
+                    chunk = f.read(CHUNK_SIZE)  # Full CHUNK_SIZE reads until the end of the file
+                    if not chunk or not self._put(base64.b64encode(chunk)):
+                        break
+        finally:
+            self._put(None)
+
+    def __iter__(self):
+        while True:
+            chunk = self._chunks.get()
+            if chunk is None:
+                break
+            yield chunk
+        self._future.result()
+
+
+class AttachmentReader:
+    """
+    Finds the attachment files of messages and reads them ahead of the XML writer.
+
+    Files are read by a pool of threads, in the order the messages are
+    written; reading the next attachments overlaps with writing the current
+    one. Use as a context manager, or call close() when done.
+
+    Args:
+        root (str): Directory holding the backup's Library/SMS files (the
+            directory containing "Attachments"). Without it, messages are
+            written without their attachment files.
+        threads (int): Files read at the same time.
+    """
+
+    def __init__(self, root=None, threads=READ_THREADS):
+        from concurrent.futures import ThreadPoolExecutor  # Only needed for MMS export
+
+        self.root = root
+        self._closed = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="attachments")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self._closed.set()
+        self._executor.shutdown(wait=True)
+
+    def resolve(self, filename):
+        """Returns the path of an attachment file in root, or None if it is not there."""
+        relative = filename
+        for prefix in SMS_DIRECTORY_PREFIXES:
+            if relative.startswith(prefix):
+                relative = relative[len(prefix):]
+                break
+        relative = relative.lstrip("/")
+        candidates = [os.path.join(self.root, relative)]
+        if relative.startswith("Attachments/"):  # root may be the Attachments directory itself
+            candidates.append(os.path.join(self.root, relative[len("Attachments/"):]))
+        for path in candidates:
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def open(self, message):
+        """
+        Starts reading the attachments of one message.
+
+        Returns:
+            list: (attachment, EncodedFile) pairs for the files that were
+                  found, attachment being a (filename, mime_type, transfer_name) tuple.
+        """
+        files = []
+        for attachment in message["attachments"]:
+            if self.root is None:
+                metrics.count("attachments not included (no attachments directory)")
+                continue
+            path = self.resolve(attachment[0])
+            if path is None:
+                metrics.error("attachment file not found", attachment[0])
+                continue
+            files.append((attachment, EncodedFile(path, self._executor, self._closed)))
+        return files
+
+    def prefetch(self, messages):
+        """
+        Yields (message, files) for each message, files being the open()
+        result for an MMS and None for a plain SMS.
+
+        Reading starts LOOKAHEAD messages before a message is yielded.
+        """
+        pending = deque()
+        for message in messages:
+            pending.append((message, self.open(message) if is_mms(message) else None))
+            if len(pending) > LOOKAHEAD:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+
+
+def mms_values(message, files):
+    """Returns the variable <mms> attributes of one message, in MMS_ELEMENT order."""
+    sent = message["is_from_me"] == 1
+    address = "~".join(message["recipients"]) or message["phone_number"]
+    return (
+        str(message["date"]),
+        "2" if sent else "1",
+        address,
+        "128" if sent else "132",
+        message["readable_date"] or "null",
+        message.get("contact_name") or "(Unknown)",
+        "0" if files else "1",
+    )
+
+
+def addresses(message):
+    """Returns the (address, type) pairs of the <addrs> of one message: the sender first, then the other recipients."""
+    if message["is_from_me"] == 1:
+        sender = SELF_ADDRESS
+        recipients = message["recipients"] or [message["phone_number"]]
+    else:
+        sender = message["phone_number"]
+        recipients = [address for address in message["recipients"] if address != sender]
+    return [(sender, ADDRESS_FROM)] + [(address, ADDRESS_TO) for address in recipients]
+
+
+def write_mms(writer, message, files):
+    """
+    Writes one message as an <mms> element with its text, attachment and address parts.
+
+    Args:
+        writer (android_xml.BackupWriter): The open output.
+        message (dict): A message from sms_convert_to_csv.iter_messages(mms=True).
+        files (list): The message's AttachmentReader.open() result.
+    """
+    writer.write(MMS_ELEMENT, mms_values(message, files))
+    writer.write(PARTS_ELEMENT, ())
+    text = (message["body"] or "").replace(OBJECT_REPLACEMENT, "").strip()
+    if text:
+        writer.write(TEXT_PART, (text,))
+    for (filename, mime_type, transfer_name), encoded in files:
+        name = transfer_name or os.path.basename(filename)
+        writer.write(FILE_PART, (mime_type or "application/octet-stream", name, f"<{name}>", name))
+        try:
+            for chunk in encoded:
+                writer.write_bytes(chunk)
+        except OSError as e:
+            metrics.error("attachment could not be read", f"{filename}: {e}")
+        writer.write_bytes(b'" />')
+    writer.write_end("parts", level=2)
+    writer.write(ADDRS_ELEMENT, ())
+    for address, address_type in addresses(message):
+        writer.write(ADDR_ELEMENT, (address, address_type))
+    writer.write_end("addrs", level=2)
+    writer.write_end("mms")
@@ -0,0 +1,169 @@
+import argparse
+import re
+
+# Annotations iOS appends to some handles, e.g. "+15551234567(smsft)". A
+# parenthesized group of digits is an area code and is kept.
+_ANNOTATION = re.compile(r"\((?![\d\s]+\))[^)]*\)")
+_PHONE_NUMBER = re.compile(r"\+?[\d\s().\-/]+")
+_FORMATTING = re.compile(r"[\s().\-/]")
+_NON_DIGITS = re.compile(r"\D")
+
+# Calling code -> digits in a full national number. A number in the home
+# country's international form that is shorter than that (a service number
+# or short code) is written without the country code, e.g. "+91121" -> "121".
+NATIONAL_LENGTHS = {
+    "1": 10,  # US, Canada
+    "33": 9,  # France
+    "34": 9,  # Spain
+    "39": 10,  # Italy
+    "44": 10,  # UK
+    "49": 11,  # Germany
+    "61": 9,  # Australia
+    "65": 8,  # Singapore
+    "81": 10,  # Japan
+    "86": 11,  # China
+    "91": 10,  # India
+    "971": 9,  # UAE
+}
+DEFAULT_NATIONAL_LENGTH = 10
+DEFAULT_COUNTRY_CODE = "91"  # What the scripts have always assumed
+# Most countries dial a trunk 0 before national numbers ("06 12 34 56 78")
+# that is dropped after the calling code ("+33 6 12 34 56 78"). In these
+# the 0 is part of the number: "06 1234 5678" is "+39 06 1234 5678".
+LEADING_ZERO_KEPT = frozenset({"39"})  # Italy
+MATCH_SUFFIX_DIGITS = 10  # Digits compared when the home country is unknown
+CACHE_SIZE = 1 << 16  # Distinct handles remembered; a phone has a few hundred
+
+
+class PhoneNormalizer:
+    """
+    Cleans raw iOS handles and call addresses into the form written to the backup.
+
+    * Annotations in parentheses ("(smsft)") are dropped.
+    * Phone numbers lose their formatting: "+1 (555) 123-4567" -> "+15551234567".
+    * A number in the home country's international form that is shorter than
+      a full national number loses the country code (see NATIONAL_LENGTHS).
+    * Anything else (email handles, chat identifiers) is only stripped.
+
+    Results are cached per raw handle, so a database with 400k messages but
+    a few hundred correspondents runs the regular expressions a few hundred
+    times.
+
+    Args:
+        country_code (str): Home calling code without "+", or None for no country rule.
+        national_length (int): Digits in a full national number (default: from NATIONAL_LENGTHS).
+    """
+
+    def __init__(self, country_code=DEFAULT_COUNTRY_CODE, national_length=None):
+        self.country_code = country_code
+        self.national_length = national_length or NATIONAL_LENGTHS.get(country_code, DEFAULT_NATIONAL_LENGTH)
+        if country_code:
+            self._prefix = "+" + country_code
+            self._max_length = len(self._prefix) + self.national_length
+        else:
+            self._prefix = None
+        self._cache = {}
+        self._keys = {}
+
+    def __call__(self, handle):
+        number = self._cache.get(handle)
+        if number is None:
+            if len(self._cache) >= CACHE_SIZE:
+                self._cache.clear()
+            number = self._cache[handle] = self.normalize_uncached(handle)
+        return number
+
+    def normalize_uncached(self, handle):
+        number = _ANNOTATION.sub("", handle).strip()
+        if _PHONE_NUMBER.fullmatch(number):
+            number = _FORMATTING.sub("", number)
+            if self._prefix is not None and number.startswith(self._prefix) and len(number) < self._max_length:
+                number = number[len(self._prefix):]
+        return number
+
+    def match_key(self, address):
+        """
+        Reduces a phone number or iMessage handle to a form both phones agree on.
+
+        Phone numbers become their full international form, with the trunk
+        0 dropped (see LEADING_ZERO_KEPT): with the home country 33,
+        "+33 6 12 34 56 78", "0033612345678" and "06 12 34 56 78" all give
+        "+33612345678". Numbers without a country code are in the home
+        country; other countries' numbers keep theirs, so "+1 361 234 5678"
+        stays "+13612345678". Without a home country only the last
+        MATCH_SUFFIX_DIGITS digits are compared. Email handles and sender
+        names are compared case-insensitively. Keys are cached like
+        normalized handles.
+        """
+        key = self._keys.get(address)
+        if key is None:
+            if len(self._keys) >= CACHE_SIZE:
+                self._keys.clear()
+            key = self._keys[address] = self._match_key_uncached(address)
+        return key
+
+    def _match_key_uncached(self, address):
+        number = _ANNOTATION.sub("", address or "").strip()
+        digits = _NON_DIGITS.sub("", number)
+        if not digits or not _PHONE_NUMBER.fullmatch(number):
+            return number.lower()
+        if not self.country_code:
+            return digits[-MATCH_SUFFIX_DIGITS:]
+        if number.startswith("+"):
+            return self._international_key(digits)
+        if digits.startswith("00"):
+            return self._international_key(digits[2:])
+        if digits.startswith(self.country_code) and len(digits) == len(self.country_code) + self.national_length:
+            return self._international_key(digits)  # Dialled without the "+"
+        return self._national_key(self.country_code, digits)
+
+    def _international_key(self, digits):
+        # Calling codes are prefix-free, so the first known one is the number's.
+        for length in (1, 2, 3):
+            code = digits[:length]
+            if code == self.country_code or code in NATIONAL_LENGTHS:
+                return self._national_key(code, digits[length:])
+        return "+" + digits
+
+    @staticmethod
+    def _national_key(country_code, national):
+        if national.startswith("0") and country_code not in LEADING_ZERO_KEPT:
+            national = national[1:]  # Trunk prefix, or "+44 (0)20 ..."
+        return f"+{country_code}{national}"
+
+
+normalize = PhoneNormalizer()  # Used by the extractors; see set_country()
+
+
+def set_country(country_code=DEFAULT_COUNTRY_CODE, national_length=None):
+    """Replaces the normalizer behind normalize() and match_key(), e.g. from a --country-code option."""
+    global normalize
+    normalize = PhoneNormalizer(country_code, national_length)
+
+
+def country_rule(text):
+    """
+    Parses a --country-code value: "44", "44:10" (with the national number length) or "none".
+
+    Returns:
+        tuple: (country_code, national_length) arguments for set_country().
+    """
+    if text.lower() == "none":
+        return None, None
+    code, _, length = text.lstrip("+").partition(":")
+    if not code.isdigit() or (length and not length.isdigit()):
+        raise argparse.ArgumentTypeError(f"expected a calling code such as 44 or 44:10, or 'none', not '{text}'")
+    return code, int(length) if length else None
+
+
+def add_country_option(parser):
+    """Adds the --country-code option to an argument parser."""
+    parser.add_argument("--country-code", type=country_rule, default=(DEFAULT_COUNTRY_CODE, None), metavar="CODE[:LENGTH]",
+                        help="Home calling code: short numbers in its international form are written without it, "
+                             "and numbers without a calling code are matched (dedup, contacts) as in this country "
+                             f"('none' to keep every number as is; default: {DEFAULT_COUNTRY_CODE})")
+
+
+def match_key(address):
+    """Returns the match key of a phone number or handle under the current country rule (see PhoneNormalizer.match_key())."""
+    return normalize.match_key(address)
@@ -0,0 +1,129 @@
+import contextlib
+import gc
+import sys
+from collections.abc import MutableMapping
+
+
+class Record(MutableMapping):
+    """
+    Base of the row records built by the extractors.
+
+    A record keeps its fields in __slots__, less than half the memory of a
+    dict with the same keys, and is still a mapping: record["date"],
+    record.get("contact_name"), dict(record), csv.DictWriter and pandas all
+    work, so the CSV/XML writers and the pandas engines take records and
+    CSV dicts alike. Fields that were never set are absent, as a missing key
+    would be. Code that only handles records can read attributes
+    (record.date), which is faster.
+    """
+    __slots__ = ()
+    FIELDS = frozenset()
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        delattr(self, key)
+
+    def __contains__(self, key):
+        return key in self.FIELDS and hasattr(self, key)
+
+    def get(self, key, default=None):
+        if key in self.FIELDS:
+            return getattr(self, key, default)
+        return default
+
+    def __iter__(self):
+        return (name for name in self.__slots__ if hasattr(self, name))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self)!r})"
+
+
+class Message(Record):
+    """
+    One message from sms.db (see sms_convert_to_csv.message_from_row()).
+
+    contact_name is set by add_contact_names(); attachments and recipients
+    only on messages read for MMS (iter_messages(mms=True)).
+    """
+    __slots__ = ("rowid", "date", "readable_date", "body", "phone_number", "is_from_me", "cache_roomname", "service",
+                 "contact_name", "attachments", "recipients")
+    FIELDS = frozenset(__slots__)
+
+    def __init__(self, rowid, date, readable_date, body, phone_number, is_from_me, cache_roomname, service):
+        self.rowid = rowid
+        self.date = date
+        self.readable_date = readable_date
+        self.body = body
+        self.phone_number = phone_number
+        self.is_from_me = is_from_me
+        self.cache_roomname = shared(cache_roomname)
+        self.service = shared(service)
+
+
+class CallLog(Record):
+    """One call from a CallHistory database (see call_convert_to_csv.read_call_logs())."""
+    __slots__ = ("rowid", "phone_number", "duration", "date", "type", "type_of_call", "presentation", "subscription_id",
+                 "post_dial_digits", "subscription_component_name", "readable_date", "contact_name", "service_provider")
+    FIELDS = frozenset(__slots__)
+
+    def __init__(self, rowid, phone_number, duration, date, type, type_of_call, presentation, subscription_id,
+                 post_dial_digits, subscription_component_name, readable_date, contact_name, service_provider):
+        self.rowid = rowid
+        self.phone_number = phone_number
+        self.duration = duration
+        self.date = date
+        self.type = type
+        self.type_of_call = type_of_call
+        self.presentation = presentation
+        self.subscription_id = subscription_id
+        self.post_dial_digits = post_dial_digits
+        self.subscription_component_name = subscription_component_name
+        self.readable_date = readable_date
+        self.contact_name = contact_name
+        self.service_provider = shared(service_provider)
+
+
+def shared(value):
+    """
+    Returns one shared copy of a string that repeats across rows (service, chat name).
+
+    SQLite hands out a new str for every row; interning keeps a million
+    "iMessage" values down to one object.
+    """
+    return sys.intern(value) if type(value) is str else value
+
+
+@contextlib.contextmanager
+def building_records():
+    """
+    Pauses the cyclic garbage collector while a large list of records is built.
+
+    Unlike a dict of plain values, a __slots__ instance stays tracked by the
+    collector, so every collection triggered by the allocations would walk
+    the records built so far; on a million rows that doubles the time spent
+    reading. Records never form reference cycles, so nothing is lost.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
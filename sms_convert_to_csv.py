@@ -1,147 +1,296 @@
 import sqlite3
-import datetime
 import argparse
-import csv
 import os
-import pandas as pd  # Import pandas
-import chardet
-import re  # Import the regular expression module
-import typedstream
-import xml.etree.ElementTree as ET  # Import ElementTree
-
-def convert_datetime(date):
-    date_java = 0
-    date_readable = "Invalid Date"
-    try:
-        mod_date = datetime.datetime(2001, 1, 1, tzinfo=datetime.timezone.utc)
-        unix_timestamp = int(mod_date.timestamp()) * 1000000000
-        new_date = int((date + unix_timestamp) / 1000000000)
-        original_date_obj = datetime.datetime.fromtimestamp(new_date)
-        date_java = int(original_date_obj.timestamp() * 1000)  # Correct Java TS
-        date_readable = original_date_obj.strftime("%d %b %Y %l:%M:%S%p").replace("AM", "am").replace("PM","pm").replace("am"," am").replace("pm"," pm")
-    except Exception as e:
-        print(f"Error converting date for ROWID {rowid}: {e}")
-        # Keep defaults: date_java = 0, date_readable = "Invalid Date"
-    return date_java,date_readable
+from collections import deque
+import addressbook
+import android_xml
+import apple_time
+import columnar
+import compressed
+import attributed_body as body_decoder
+import dedup_index
+import ios_db
+import phone_numbers
+from instrumentation import Progress, metrics, profiled
+from records import Message, building_records
+
+# The chat_identifier of sent messages without a handle is resolved in the
+# same pass through chat_message_join/chat instead of two lookups per row.
+# Only the first chat_message_join row of each message is kept (SQLite takes
+# the bare chat_id from the MIN(rowid) row), matching the old fetchone().
+MESSAGE_QUERY = """
+SELECT message.ROWID, message.date, message.text, message.attributedBody, handle.id, message.is_from_me, message.cache_roomnames, message.service,
+       cmj.chat_id, chat.ROWID, chat.chat_identifier
+FROM message
+LEFT JOIN handle ON message.handle_id = handle.ROWID
+LEFT JOIN (SELECT message_id, chat_id, MIN(rowid) FROM chat_message_join GROUP BY message_id) AS cmj
+       ON cmj.message_id = message.ROWID
+LEFT JOIN chat ON chat.ROWID = cmj.chat_id
+"""
+
+# Attachments of a batch of messages; {} is filled with one ? per ROWID.
+ATTACHMENT_QUERY = """
+SELECT message_attachment_join.message_id, attachment.filename, attachment.mime_type, attachment.transfer_name
+FROM message_attachment_join
+JOIN attachment ON attachment.ROWID = message_attachment_join.attachment_id
+WHERE message_attachment_join.message_id IN ({})
+ORDER BY message_attachment_join.message_id, attachment.ROWID
+"""
+
+PARTICIPANT_QUERY = """
+SELECT chat_handle_join.chat_id, handle.id
+FROM chat_handle_join
+JOIN handle ON handle.ROWID = chat_handle_join.handle_id
+ORDER BY chat_handle_join.chat_id, handle.ROWID
+"""
+
+MAX_QUERY_PARAMETERS = 900  # Below SQLite's historical limit of 999 host parameters per statement
+
+CSV_FIELDNAMES = ['rowid', 'date',  'readable_date', 'body', 'phone_number', 'is_from_me', 'cache_roomname', 'service', 'contact_name']
+INTEGER_FIELDS = ('rowid', 'date', 'is_from_me')  # Stored as integers in Parquet/Arrow files (see columnar)
+
+BATCH_SIZE = 5000  # Rows fetched from SQLite per fetchmany() call in streaming mode
+
+
+def decode_attributed_bodies(items):
+    """
+    Decodes a batch of attributedBody blobs. Runs in worker processes.
+
+    Args:
+        items (list): (rowid, attributedBody) pairs.
+
+    Returns:
+        tuple: (decoded, counts) where decoded maps rowid -> (body, error message),
+               body being None when decoding failed, and counts is a
+               attributed_body.DecoderStats for the batch.
+    """
+    decoded = {}
+    counts = body_decoder.DecoderStats()
+    for rowid, attributed_body in items:
+        try:
+            decoded[rowid] = (body_decoder.decode(attributed_body, counts), None)
+        except Exception as e:
+            decoded[rowid] = (None, str(e))
+    return decoded, counts
+
+
+def message_from_row(result, self_number='Me', decoded=None, convert_date=True, keep_empty=False):
+    """
+    Builds a message record from one row of MESSAGE_QUERY.
+
+    Args:
+        result (tuple): The row.
+        self_number (str): Identifier used when a sent message has no chat.
+        decoded (dict): Optional rowid -> (body, error) results from
+            decode_attributed_bodies(); rows not in it are decoded here.
+        convert_date (bool): Convert the date here; when False the raw sms.db
+            date is kept so a whole batch can go through convert_dates().
+        keep_empty (bool): Keep a row without text as a message with an empty
+            body, e.g. one that only carries attachments.
+
+    Returns:
+        records.Message: The message, or None if the row has no usable body.
+    """
+    rowid, date, text, attributed_body, handle_id, is_from_me, cache_roomname, service, chat_id, chat_rowid, chat_identifier = result
+
+    # --- Determine phone_number (handling sent messages differently) ---
+    if is_from_me == 1 and handle_id is None:  # Sent message
+        if chat_id is None:
+            phone_number = self_number   # Default if no chat_id found
+        elif chat_rowid is None:
+            phone_number = self_number # Default if no chat_identifier found
+        else:
+            phone_number = str(chat_identifier)
+    else:
+        phone_number = str("Not found" if (handle_id is None) else handle_id)
+    # Ensure phone_number is always a string:
+    #phone_number = str(self_number if (handle_id is None or is_from_me == 1) else handle_id)
+    phone_number = phone_numbers.normalize(phone_number)  # Cached per handle
+
+    body = None  # Initialize body
+    if text is not None:
+        body = text
+    elif attributed_body is not None:
+        if decoded is not None and rowid in decoded:
+            body, error = decoded[rowid]
+        else:
+            try:
+                body, error = body_decoder.decode(attributed_body), None
+            except Exception as e:
+                body, error = None, str(e)
+        if error is not None:
+            metrics.error("attributedBody could not be decoded", f"ROWID {rowid}: {error}")
+            return None  # skip this message
+    elif keep_empty:
+        body = ""
+    else:
+        metrics.count("rows skipped (no text)")
+        return None  # Skip if both text and attributed_body are None
+
+    if convert_date:
+        date_java, date_readable = apple_time.message_date(date, rowid)
+    else:
+        date_java, date_readable = date, None
+
+    return Message(rowid, date_java, date_readable, body, phone_number, is_from_me, cache_roomname, service)
+
+
+def convert_dates(messages):
+    """Replaces the raw sms.db dates of a batch of messages with Java and readable dates in one vectorized pass."""
+    if not messages:
+        return
+    java, readable = apple_time.message_dates([message.date for message in messages],
+                                              [message.rowid for message in messages])
+    for message, date_java, date_readable in zip(messages, java.tolist(), readable.tolist()):
+        message.date = date_java
+        message.readable_date = date_readable
 
 
+def _fetch_batches(cursor, batch_size):
+    """Yields lists of rows from an executed cursor, batch_size rows at a time."""
+    while True:
+        results = cursor.fetchmany(batch_size)
+        if not results:
+            break
+        yield results
 
-# date_string = '2001-01-01'
-# mod_date = datetime.datetime.strptime(date_string, '%Y-%m-%d')
 
+def _merge_counts(result):
+    # Worker processes have their own decoder stats; fold them into ours.
+    decoded, counts = result
+    body_decoder.stats.merge(counts)
+    return decoded
 
 
-def read_messages(db_file):
+def _decode_in_pool(batches, workers):
+    """
+    Yields (rows, decoded) for each batch, with attributedBody decoding fanned
+    out to a process pool. Batches come back in the order they were read, and
+    at most two batches per worker are in flight so memory stays bounded.
+    """
+    from concurrent.futures import ProcessPoolExecutor  # Only needed with --workers
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for rows in batches:
+            items = [(row[0], row[3]) for row in rows if row[2] is None and row[3] is not None]
+            pending.append((rows, executor.submit(decode_attributed_bodies, items)))
+            if len(pending) >= workers * 2:
+                rows, future = pending.popleft()
+                yield rows, _merge_counts(future.result())
+        while pending:
+            rows, future = pending.popleft()
+            yield rows, _merge_counts(future.result())
+
+
+def read_participants(conn):
+    """Returns {chat ROWID: [handle, ...]} for every chat, handles normalized like phone_number."""
+    participants = {}
+    for chat_id, handle_id in conn.execute(PARTICIPANT_QUERY):
+        if handle_id is not None:
+            participants.setdefault(chat_id, []).append(phone_numbers.normalize(str(handle_id)))
+    return participants
+
+
+def read_attachments(conn, rowids):
+    """Returns {message ROWID: [(filename, mime_type, transfer_name), ...]} for the messages that have attachments."""
+    attachments = {}
+    for start in range(0, len(rowids), MAX_QUERY_PARAMETERS):
+        chunk = rowids[start:start + MAX_QUERY_PARAMETERS]
+        query = ATTACHMENT_QUERY.format(", ".join("?" * len(chunk)))
+        for message_id, filename, mime_type, transfer_name in conn.execute(query, chunk):
+            if filename is not None:
+                attachments.setdefault(message_id, []).append((filename, mime_type, transfer_name))
+    return attachments
+
+
+def _mms_messages(rows, decoded, conn, participants):
+    # Like the plain path in _messages_from_cursor, but rows that only carry
+    # attachments are kept, and each message gets its attachments and the
+    # members of its chat for the <mms> writer.
+    attachments = read_attachments(conn, [row[0] for row in rows])
+    messages = []
+    for result in rows:
+        files = attachments.get(result[0], [])
+        message = message_from_row(result, decoded=decoded, convert_date=False, keep_empty=bool(files))
+        if message is not None:
+            message.attachments = files
+            message.recipients = participants.get(result[8], [])
+            messages.append(message)
+    return messages
+
+
+def _messages_from_cursor(cursor, batch_size=BATCH_SIZE, workers=1, progress=None, participants=None):
+    """
+    Yields message records for the rows of an executed MESSAGE_QUERY cursor.
+
+    With participants (from read_participants()), every message also gets
+    "attachments" and "recipients" lists, see _mms_messages().
+    """
+    batches = _fetch_batches(cursor, batch_size)
+    if workers > 1:
+        decoded_batches = _decode_in_pool(batches, workers)
+    else:
+        decoded_batches = ((rows, None) for rows in batches)
+    for rows, decoded in decoded_batches:
+        metrics.count("rows scanned", len(rows))
+        if participants is not None:
+            messages = _mms_messages(rows, decoded, cursor.connection, participants)
+        else:
+            messages = [message for message in (message_from_row(result, decoded=decoded, convert_date=False) for result in rows)
+                        if message is not None]
+        convert_dates(messages)
+        yield from messages
+        if progress is not None:
+            progress.update(len(rows))
+    if progress is not None:
+        progress.close()
+
+
+def _rowid_conditions(min_rowid=None, max_rowid=None):
+    """Returns (WHERE clause or "", parameters) limiting message.ROWID to (min_rowid, max_rowid]."""
+    conditions, parameters = [], []
+    if min_rowid is not None:
+        conditions.append("message.ROWID > ?")
+        parameters.append(min_rowid)
+    if max_rowid is not None:
+        conditions.append("message.ROWID <= ?")
+        parameters.append(max_rowid)
+    return (" WHERE " + " AND ".join(conditions) if conditions else ""), parameters
+
+
+def _reading_progress(conn, where="", parameters=()):
+    # COUNT(*) only walks the message table's b-tree, which is quick next to the main query.
+    total = conn.execute("SELECT COUNT(*) FROM message" + where, parameters).fetchone()[0]
+    return Progress("Reading messages", total)
+
+
+def read_messages(db_file, workers=1, batch_size=BATCH_SIZE, in_memory=False):
     """
     Reads messages from an iMessage SQLite database file and returns them.
 
     Args:
         db_file (str): Path to the SQLite database file.
-        n (int):  Number of most recent messages to retrieve.  If None, retrieve all.
-        self_number (str):  Identifier for self messages (default: 'Me').
-        human_readable_date (bool): Convert dates to human-readable format (default: True).
+        workers (int): Processes used to decode attributedBody blobs (1 = serial).
+        batch_size (int): Number of rows handed to a worker at a time.
+        in_memory (bool): Copy the database into RAM before reading it (see ios_db.connect()).
 
     Returns:
-        list: A list of dictionaries, where each dictionary represents a message.
+        list: A list of records.Message, which read like dictionaries.
               Returns an empty list if the database file does not exist or if any error occurs.
     """
-    elf_number = 'Me'
     if not os.path.exists(db_file):
         print(f"Error: Database file '{db_file}' not found.")
         return []
 
     try:
-        conn = sqlite3.connect(db_file)
+        conn = ios_db.connect(db_file, in_memory)
         cursor = conn.cursor()
+        progress = _reading_progress(conn)
+        cursor.execute(MESSAGE_QUERY)
 
-        query = """
-        SELECT message.ROWID, message.date, message.text, message.attributedBody, handle.id, message.is_from_me, message.cache_roomnames, message.service
-        FROM message
-        LEFT JOIN handle ON message.handle_id = handle.ROWID
-        """
-        # if n is not None:
-        #     query += f" ORDER BY message.date DESC LIMIT {n}"  # Initial sort by date DESC for -n option
-
-        results = cursor.execute(query).fetchall()
-        messages = []
-
-        for result in results:
-            rowid, date, text, attributed_body, handle_id, is_from_me, cache_roomname, service = result
-
-            # --- Determine phone_number (handling sent messages differently) ---
-            if is_from_me == 1 and handle_id is None:  # Sent message
-                try:
-                    # 1. Get chat_id from chat_message_join
-                    chat_id_query = "SELECT chat_id FROM chat_message_join WHERE message_id = ?"
-                    cursor.execute(chat_id_query, (rowid,))
-                    chat_id_result = cursor.fetchone()
-
-                    if chat_id_result:
-                        chat_id = chat_id_result[0]
-
-                        # 2. Get chat_identifier from chat
-                        chat_identifier_query = "SELECT chat_identifier FROM chat WHERE ROWID = ?"
-                        cursor.execute(chat_identifier_query, (chat_id,))
-                        chat_identifier_result = cursor.fetchone()
-
-                        if chat_identifier_result:
-                            phone_number = str(chat_identifier_result[0])
-                        else:
-                            phone_number = self_number # Default if no chat_identifier found
-                    else:
-                        phone_number = self_number   # Default if no chat_id found
-                except sqlite3.Error as e:
-                    print(f"Error getting chat_identifier for ROWID {rowid}: {e}")
-                    phone_number = self_number  # Fallback in case of error
-            else:
-                phone_number = str("Not found" if (handle_id is None) else handle_id)
-            # Ensure phone_number is always a string:
-            #phone_number = str(self_number if (handle_id is None or is_from_me == 1) else handle_id)
-            phone_number = re.sub(r'\(.*?\)', '', phone_number).strip()
-            if phone_number.startswith("+91") and len(phone_number) < 13:
-                phone_number = phone_number[3:]  # Strip "+91"
-            # if (phone_number==self_number and attributed_body is not None):
-            # if (rowid==18661 and attributed_body is not None):
-            #
-            # #     print(f"ROWID: {rowid}, Attributed Body (decoded): {attributed_body.decode(encoding, errors='replace')}")
-            #     input("Press")
-
-            body = None  # Initialize body
-            if text is not None:
-                body = text
-            elif attributed_body is not None:
-                try:
-                    body = typedstream.unarchive_from_data(attributed_body).contents[0].value.value
-                    # print(f"{rowid}, {temp.contents[0].value.value}")
-                    # attributed_body = attributed_body.decode('utf-8', errors='replace')
-                    #
-                    # #  more robust extraction using find and slicing:
-                    # start = attributed_body.find("NSString") + len("NSString")
-                    # end = attributed_body.find("NSDictionary")
-                    # if start > len("NSString") - 1 and end > -1:  # Check if both markers were found
-                    #     body = attributed_body[start:end].strip()[6:-12]  # proper body extraction
-                    # else:
-                    #     body = ""  # set body to empty if markers are not present
-
-                except Exception as e:
-                    print(f"Error decoding attributedBody for ROWID {rowid}: {e}")
-                    continue  # skip this message
-            else:
-                continue  # Skip if both text and attributed_body are None
-
-
-            date_java,date_readable=convert_datetime(date)
-
-            messages.append({
-                "rowid": rowid,
-                "date": date_java,
-                "readable_date": date_readable,
-                "body": body,
-                "phone_number": phone_number,  # Now always a string
-                "is_from_me": is_from_me,
-                "cache_roomname": cache_roomname,
-                "service": service  # Add the service column
-            })
+        with building_records():
+            messages = list(_messages_from_cursor(cursor, batch_size, workers, progress))
 
         conn.close()
         return messages
@@ -154,34 +303,172 @@ def read_messages(db_file):
         return []
 
 
+def iter_messages(db_file, batch_size=BATCH_SIZE, workers=1, min_rowid=None, max_rowid=None, mms=False, in_memory=False):
+    """
+    Yields messages from an iMessage SQLite database in date order.
+
+    The cursor is read with fetchmany() so only one batch of rows is held in
+    memory at a time. Ordering comes from SQL (ORDER BY message.date), which
+    lets dedup_messages() work on one timestamp group at a time.
+
+    Args:
+        db_file (str): Path to the SQLite database file.
+        batch_size (int): Number of rows fetched per round trip.
+        workers (int): Processes used to decode attributedBody blobs (1 = serial).
+        min_rowid (int): Only read messages with a ROWID above this one.
+        max_rowid (int): Only read messages with a ROWID up to this one.
+        mms (bool): Also yield messages that only have attachments, and give
+            every message its "attachments" and chat "recipients" (see _mms_messages()).
+        in_memory (bool): Copy the database into RAM before reading it (see ios_db.connect()).
+    """
+    where, parameters = _rowid_conditions(min_rowid, max_rowid)
+    conn = ios_db.connect(db_file, in_memory)
+    try:
+        participants = read_participants(conn) if mms else None
+        progress = _reading_progress(conn, where, parameters)
+        cursor = conn.execute(MESSAGE_QUERY + where + " ORDER BY message.date", parameters)
+        yield from _messages_from_cursor(cursor, batch_size, workers, progress, participants)
+    finally:
+        conn.close()
+
+
+def get_latest_message(db_file):
+    """
+    Returns (highest message ROWID, latest raw sms.db date) of a database.
+
+    Both are None for an empty message table. This only reads the ends of
+    the table, so it is cheap even on large databases.
+    """
+    conn = ios_db.connect(db_file)
+    try:
+        return conn.execute("SELECT MAX(ROWID), MAX(date) FROM message").fetchone()
+    finally:
+        conn.close()
+
+
+def add_contact_names(messages, contacts):
+    """
+    Yields the messages with contact_name filled in from an addressbook.ContactIndex.
+
+    Group messages (with several chat "recipients", see iter_messages(mms=True))
+    get the names of all participants.
+    """
+    for message in messages:
+        recipients = message.get("recipients")
+        if recipients and len(recipients) > 1:
+            message["contact_name"] = contacts.names_of(recipients)
+        else:
+            message["contact_name"] = contacts.name(message["phone_number"])
+        yield message
+
+
+def _service_rank(message):
+    # Mirrors the pandas path: service sorted descending with missing values
+    # last, keeping the last duplicate, i.e. a missing service wins, then the
+    # smallest one ('SMS' sorts before 'iMessage').
+    service = message.service
+    return (service is not None, service or "")
+
+
+def _duplicate_key(message):
+    # Messages with equal keys are iMessage/SMS copies of each other. Ordering
+    # the keys sorts by date, then body, phone_number and is_from_me (None first).
+    # Messages read for MMS also compare their attachments' files, which are
+    # unique per attachment: several photos sent in the same second have the
+    # same date and an empty body, but are not copies of each other.
+    is_from_me = message.is_from_me
+    attachments = tuple(filename or "" for filename, _, _ in message.get("attachments") or ())
+    return (message.date, message.body, message.phone_number, is_from_me is not None, is_from_me or 0, attachments)
+
+
+def dedup_messages(messages):
+    """
+    Drops iMessage/SMS duplicates from a date-ordered stream of messages.
+
+    Messages sharing date, body, phone_number, is_from_me and attachments are
+    duplicates; the SMS version is kept. Only one timestamp group is buffered at a time,
+    and each group is emitted ordered by body, phone_number and is_from_me.
+    """
+    group = {}
+    group_date = None
+    for message in messages:
+        if message.date != group_date:
+            for key in sorted(group):
+                yield group[key]
+            group = {}
+            group_date = message.date
+        key = _duplicate_key(message)
+        kept = group.get(key)
+        if kept is not None:
+            metrics.count("duplicates removed")
+        if kept is None or _service_rank(message) < _service_rank(kept):
+            group[key] = message
+    for key in sorted(group):
+        yield group[key]
+
+
+def sort_dedup_messages(messages):
+    """
+    Sorts messages by date and drops iMessage/SMS duplicates in one pass.
+
+    Every message gets one compact key, (duplicate key, service rank); a
+    single sort on it puts each group of duplicates together with the copy
+    to keep first, so a linear scan finishes the job. The result matches the
+    pandas engine, except that ties within a timestamp are ordered by body,
+    phone_number and is_from_me instead of arbitrarily.
+
+    Args:
+        messages (list): records.Message objects.
+
+    Returns:
+        list: The deduplicated messages, in date order.
+    """
+    keys = [(_duplicate_key(message), _service_rank(message)) for message in messages]
+    kept = []
+    previous = None
+    for i in sorted(range(len(messages)), key=keys.__getitem__):
+        key = keys[i][0]
+        if key != previous:
+            kept.append(messages[i])
+            previous = key
+    metrics.count("duplicates removed", len(messages) - len(kept))
+    return kept
+
+
+def sort_dedup_messages_pandas(messages):
+    """The DataFrame implementation of sort_dedup_messages(), selected with --engine pandas."""
+    import pandas as pd  # Only needed for this engine
+    # Convert the list of dictionaries to a Pandas DataFrame
+    df = pd.DataFrame(messages)
+    # 1. Sort by 'service' so 'SMS' comes last (we'll keep the last duplicate)
+    df = df.sort_values(by=['date', 'body', 'phone_number', 'is_from_me', 'service'],
+                        ascending=[True, True, True, True, False])
+    # 2. Drop duplicates, keeping the last occurrence (which will be 'SMS' if present)
+    df.drop_duplicates(subset=['date', 'body', 'phone_number', 'is_from_me'], keep='last', inplace=True)
+    # --- Sort by 'date' (the raw numeric timestamp) ---
+    df = df.sort_values(by='date')
+    metrics.count("duplicates removed", len(messages) - len(df))
+    return df.to_dict('records')
+
+
 def get_cutoff_from_xml(xml_file):
-    """Extracts the latest 'date' attribute from 'sms' elements in an XML file."""
+    """Extracts the latest 'date' attribute from 'sms' elements in an XML file.
+
+    The file is streamed (see android_xml.scan_sms_dates), so multi-gigabyte
+    backups with MMS attachments are scanned in constant memory.
+    """
     if not os.path.exists(xml_file):
         print(f"Error: XML file '{xml_file}' not found.")
         return -1
 
     try:
-        tree = ET.parse(xml_file)
-        root = tree.getroot()
-        latest_timestamp = -1
-
-        # Iterate through all 'sms' elements (using XPath for conciseness)
-        for sms in root.findall(".//sms"):  # Find all 'sms' elements anywhere in the tree
-            date_str = sms.get("date")
-            if date_str:
-                try:
-                    date_timestamp = int(date_str)
-                    latest_timestamp = max(latest_timestamp, date_timestamp)
-                except ValueError:
-                    print(f"Warning: Invalid date attribute found in XML: {date_str}")
-                    # Continue processing other elements even if one is invalid
+        latest_timestamp = android_xml.scan_sms_dates(xml_file).latest_timestamp
         if latest_timestamp ==-1:
           return -1 #return default if no sms tag is present
-        dt_object = datetime.datetime.fromtimestamp(latest_timestamp / 1000)
-        formatted_date = dt_object.strftime("%d %b %Y %l:%M:%S%p").replace("AM", "am").replace("PM", "pm").replace("am"," am").replace("pm", " pm")
+        formatted_date = apple_time.format_readable(latest_timestamp / 1000)
         print(f"Taking the cutoff as: {latest_timestamp}, i.e: {formatted_date}")
         return latest_timestamp
-    except ET.ParseError:
+    except android_xml.ParseError:
         print(f"Error: Could not parse XML file '{xml_file}'.")
         return -1  # Return -1 to indicate an error (and write all rows)
     except Exception as e:
@@ -189,70 +476,127 @@ def get_cutoff_from_xml(xml_file):
         return -1
 
 
-def write_to_csv(messages, output_file,xml_file=None):
+def get_cutoff_timestamp(xml_file=None, prompt=True):
+    """
+    Returns the Java timestamp (ms, rounded to seconds) after which messages are written.
+
+    The cutoff is the latest SMS in the Android XML backup when one is given,
+    otherwise the user is asked for it (unless prompt is False). -1 means
+    write all rows.
+    """
+    if xml_file:
+        latest_timestamp = get_cutoff_from_xml(xml_file)
+        if latest_timestamp == -1:
+            print("Using default behavior (writing all rows) due to XML error.")
+            return -1
+        return round(latest_timestamp / 1000) * 1000
+    if not prompt:
+        return -1
+
+    while True:
+        try:
+            user_input = input(
+                "Input the last Java timestamp in the existing database on the phone (or press Enter to write all rows): ").strip()
+            if user_input == "":
+                return -1  # Write all rows
+            return round(int(user_input) / 1000) * 1000  # Round to whole seconds, in milliseconds
+        except ValueError:
+            print("Invalid input. Please enter a numeric timestamp or press Enter.")
+
+
+class MessageFilter:
+    """Decides which deduplicated messages get written and counts what each rule removed.
+
+    Args:
+        cutoff_timestamp (int): Only messages after this Java timestamp pass (-1 = no cutoff).
+        index (dedup_index.ContentIndex): Messages found in this index are dropped.
+    """
+
+    def __init__(self, cutoff_timestamp=-1, index=None):
+        self.cutoff_timestamp = cutoff_timestamp
+        self.index = index
+        self.before_cutoff = 0
+        self.in_backup = 0
+
+    def __call__(self, message):
+        if self.cutoff_timestamp != -1 and message["date"] <= self.cutoff_timestamp:
+            self.before_cutoff += 1
+            metrics.count("filtered by cutoff")
+            return False
+        if self.index is not None and message in self.index:
+            self.in_backup += 1
+            metrics.count("filtered as already in backup")
+            return False
+        return True
+
+    def report(self):
+        if self.cutoff_timestamp != -1:
+            print(f"Rows not newer than the cutoff: {self.before_cutoff}")
+        if self.index is not None:
+            print(f"Rows already in the Android backup: {self.in_backup}")
+
+
+def get_message_filter(xml_file=None, dedup_mode="cutoff", prompt=True):
+    """
+    Builds the MessageFilter for a run.
+
+    Args:
+        xml_file (str): Optional Android XML backup.
+        dedup_mode (str): 'cutoff' keeps messages newer than the latest SMS in
+            the backup (or a timestamp asked from the user); 'content' drops
+            messages whose (address, date, body) is already in the backup.
+        prompt (bool): Ask for the cutoff when there is no backup; when False
+            all messages are written.
+    """
+    if dedup_mode == "content":
+        if not os.path.exists(xml_file):
+            print(f"Error: XML file '{xml_file}' not found. Writing all rows.")
+            return MessageFilter()
+        try:
+            index = dedup_index.ContentIndex.from_xml(xml_file)
+        except android_xml.ParseError:
+            print(f"Error: Could not parse XML file '{xml_file}'. Writing all rows.")
+            return MessageFilter()
+        print(f"Indexed {len(index)} messages from the Android backup.")
+        return MessageFilter(index=index)
+    return MessageFilter(cutoff_timestamp=get_cutoff_timestamp(xml_file, prompt))
+
+
+def write_to_csv(messages, output_file,xml_file=None, dedup_mode="cutoff", engine="python"):
     """Writes the extracted messages to a CSV file, sorted by date.
 
     Args:
         messages (list): List of message dictionaries.
         output_file (str): Path to the output CSV file.
+        xml_file (str): Optional Android XML backup used to skip messages already on the phone.
+        dedup_mode (str): How the backup is used, see get_message_filter().
+        engine (str): 'python' (sort_dedup_messages) or 'pandas' (sort_dedup_messages_pandas).
     """
     if not messages:
         print("No messages to write.")
         return
 
     try:
-        # Convert the list of dictionaries to a Pandas DataFrame
-        df = pd.DataFrame(messages)
-        # 1. Sort by 'service' so 'SMS' comes last (we'll keep the last duplicate)
-        df = df.sort_values(by=['date', 'body', 'phone_number', 'is_from_me', 'service'],
-                            ascending=[True, True, True, True, False])
-        # 2. Drop duplicates, keeping the last occurrence (which will be 'SMS' if present)
-        df.drop_duplicates(subset=['date', 'body', 'phone_number', 'is_from_me'], keep='last', inplace=True)
-        # --- Sort by 'date' (the raw numeric timestamp) ---
-        df = df.sort_values(by='date')
-
-
-
-
-        # sort by date again
-        df = df.sort_values(by='date')
-        if xml_file:
-            cutoff_timestamp = round(int(get_cutoff_from_xml(xml_file))/1000)*1000
-            if cutoff_timestamp == -1:
-                print("Using default behavior (writing all rows) due to XML error.")
+        if engine == "pandas":
+            records = sort_dedup_messages_pandas(messages)
         else:
-            while True:
-                try:
-                    user_input = input(
-                        "Input the last Java timestamp in the existing database on the phone (or press Enter to write all rows): ").strip()
-                    if user_input == "":
-                        cutoff_timestamp = -1  # Write all rows
-                        break
-                    else:
-                        cutoff_timestamp = round(int(user_input) / 1000)*1000
-                        break# Convert to milliseconds                    break  # Exit loop if input is valid
-                except ValueError:
-                    print("Invalid input. Please enter a numeric timestamp or press Enter.")
-
-        total_rows = len(df)
-        if cutoff_timestamp != -1:
-            df_filtered = df[df['date'] > cutoff_timestamp]
-        else:
-            df_filtered = df
-        rows_written = len(df_filtered)
+            records = sort_dedup_messages(messages)
+        message_filter = get_message_filter(xml_file, dedup_mode)
+
+        total_rows = len(records)
+        records = [record for record in records if message_filter(record)]
+        rows_written = len(records)
         rows_not_written = total_rows - rows_written
 
-        # Write the DataFrame to CSV
-        with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
-            fieldnames = ['rowid', 'date',  'readable_date', 'body', 'phone_number', 'is_from_me', 'cache_roomname', 'service']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            # Convert DataFrame back to a list of dictionaries for writing
-            writer.writerows(df_filtered.to_dict('records'))
+        # Write the messages to CSV (or Parquet/Arrow)
+        with columnar.open_writer(output_file, CSV_FIELDNAMES, INTEGER_FIELDS) as writer:
+            writer.writerows(records)
         print(f"Messages successfully written to {output_file}, deduplicated, sorted, and filtered.")
+        print(f"iMessage/SMS duplicates removed: {len(messages) - total_rows}")
         print(f"Total rows: {total_rows}")
         print(f"Rows written: {rows_written}")
         print(f"Rows not written: {rows_not_written}")
+        message_filter.report()
 
     except IOError as e:
         print(f"I/O error writing to CSV: {e}")
@@ -260,22 +604,146 @@ def write_to_csv(messages, output_file,xml_file=None):
         print(f"An unexpected error occurred while writing to CSV: {e}")
 
 
+def write_to_csv_stream(db_file, output_file, xml_file=None, batch_size=BATCH_SIZE, workers=1, dedup_mode="cutoff",
+                        in_memory=False, contacts=None):
+    """Streams messages from the database to a CSV file with constant memory.
+
+    Rows are read in date order in batches, deduplicated one timestamp group
+    at a time, filtered by the cutoff and written as they arrive.
+
+    Args:
+        db_file (str): Path to the SQLite database file.
+        output_file (str): Path to the output CSV file.
+        xml_file (str): Optional Android XML backup used to skip messages already on the phone.
+        batch_size (int): Number of rows fetched per round trip.
+        workers (int): Processes used to decode attributedBody blobs (1 = serial).
+        dedup_mode (str): How the backup is used, see get_message_filter().
+        in_memory (bool): Copy the database into RAM before reading it (see ios_db.connect()).
+        contacts (addressbook.ContactIndex): Fills in contact_name when given.
+
+    Returns:
+        int: Number of messages read from the database.
+    """
+    if not os.path.exists(db_file):
+        print(f"Error: Database file '{db_file}' not found.")
+        return 0
+
+    rows_read = 0
+    total_rows = 0
+    rows_written = 0
+
+    def counted(messages):
+        nonlocal rows_read
+        for message in messages:
+            rows_read += 1
+            yield message
+
+    try:
+        message_filter = get_message_filter(xml_file, dedup_mode)
+        with columnar.open_writer(output_file, CSV_FIELDNAMES, INTEGER_FIELDS) as writer:
+            for message in dedup_messages(counted(iter_messages(db_file, batch_size, workers, in_memory=in_memory))):
+                total_rows += 1
+                if message_filter(message):
+                    if contacts is not None:
+                        message["contact_name"] = contacts.name(message["phone_number"])
+                    writer.writerow(message)
+                    rows_written += 1
+        print(f"Messages successfully streamed to {output_file}, deduplicated, sorted, and filtered.")
+        print(f"iMessage/SMS duplicates removed: {rows_read - total_rows}")
+        print(f"Total rows: {total_rows}")
+        print(f"Rows written: {rows_written}")
+        print(f"Rows not written: {total_rows - rows_written}")
+        message_filter.report()
+
+    except sqlite3.Error as e:
+        print(f"SQLite error: {e}")
+    except IOError as e:
+        print(f"I/O error writing to CSV: {e}")
+    except Exception as e:
+        print(f"An unexpected error occurred while writing to CSV: {e}")
+    return rows_read
+
+
+def report_decoder_stats():
+    """Prints how many attributedBody blobs took the fast path or the typedstream fallback."""
+    counts = body_decoder.stats
+    if counts.fast_path or counts.fallback:
+        print(f"attributedBody decoding: {counts}")
+
+
+def csv_path(output, file_format="csv"):
+    """
+    Returns the file written for -o: output + ".csv" (".parquet", ".arrow" with -f).
+
+    A name that already ends in a compression suffix (messages.csv.gz) or a
+    typed file suffix (messages.parquet) is used as is.
+    """
+    if compressed.compression(output) or columnar.table_format(output):
+        return output
+    return columnar.output_path(output, file_format)
+
+
+def run(args):
+    """Runs the conversion selected by the command line arguments, timing each stage."""
+    phone_numbers.set_country(*args.country_code)
+    contacts = addressbook.load_contacts(args.addressbook)
+    if args.stream:
+        with metrics.stage("stream") as stage:
+            stage.rows = write_to_csv_stream(args.db_file, csv_path(args.output, args.format), xml_file=args.xml, batch_size=args.batch_size,
+                                             workers=args.workers, dedup_mode=args.dedup, in_memory=args.in_memory,
+                                             contacts=contacts)
+        return
+
+    with metrics.stage("read_messages") as stage:
+        messages = read_messages(args.db_file, workers=args.workers, batch_size=args.batch_size, in_memory=args.in_memory)
+        stage.rows = len(messages)
+
+    if contacts is not None:
+        messages = list(add_contact_names(messages, contacts))
+
+    if messages:
+        with metrics.stage("write_to_csv") as stage:
+            write_to_csv(messages, csv_path(args.output, args.format), xml_file=args.xml, dedup_mode=args.dedup, engine=args.engine)
+            stage.rows = len(messages)
+
+
 def main():
     parser = argparse.ArgumentParser(description="Extract iMessage data and save to CSV.")
     parser.add_argument("db_file", help="Path to the SQLite database file")
     # parser.add_argument("-n", type=int, default=None, help="Number of recent messages (default: all)")
-    parser.add_argument("-o", "--output", default="messages", help="Output CSV filename without extenstion (default: messages)")
+    parser.add_argument("-o", "--output", default="messages", help="Output CSV filename without extenstion (default: messages); "
+                             "a name ending in .gz, .xz or .zip is written compressed, e.g. messages.csv.gz")
+    parser.add_argument("-f", "--format", choices=columnar.FORMATS, default="csv",
+                        help="Output format: 'csv', or a typed 'parquet' / 'arrow' (IPC) file that the XML "
+                             "converters read faster (default: csv; needs pyarrow)")
     # parser.add_argument("-s", "--self", default="Me", help="Identifier for self messages (default: Me)")
     # parser.add_argument("-r", "--raw_date", action="store_false", help="Use raw date format")
     parser.add_argument("-x", "--xml", help="Path to the XML file for timestamp filtering",default=None)  # Added XML argument
+    parser.add_argument("-d", "--dedup", choices=["cutoff", "content"], default="cutoff",
+                        help="How the XML backup is used: 'cutoff' keeps messages newer than its latest SMS, "
+                             "'content' drops messages whose address, date and body are already in it (default: cutoff)")
+    parser.add_argument("--timing", action="store_true", help="Report the duration, throughput and row counts of each stage")
+    parser.add_argument("--profile", metavar="FILE", default=None, help="Profile the run with cProfile and write the stats to FILE")
+    parser.add_argument("--stream", action="store_true", help="Stream rows from the database to the CSV in batches (constant memory)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help=f"Rows fetched per batch (default: {BATCH_SIZE})")
+    parser.add_argument("--workers", type=int, default=1, help="Processes used to decode attributedBody blobs (default: 1, serial)")
+    parser.add_argument("--engine", choices=["python", "pandas"], default="python",
+                        help="Sort/dedup implementation used without --stream (default: python)")
+    parser.add_argument("--in-memory", action="store_true", help="Copy the database into RAM before reading it (faster on slow or network storage)")
+    parser.add_argument("--addressbook", default=None, help="iOS AddressBook.sqlitedb used to fill in contact names")
+    phone_numbers.add_country_option(parser)
 
     args = parser.parse_args()
+    if args.dedup == "content" and not args.xml:
+        parser.error("--dedup content needs the Android backup (-x/--xml)")
 
-    messages = read_messages(args.db_file)
-
-    if messages:
-        write_to_csv(messages, f"{args.output}.csv", xml_file=args.xml)
+    with profiled(args.profile):
+        run(args)
+    report_decoder_stats()
+    metrics.report_errors()
+    if args.timing:
+        metrics.report()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,110 +1,213 @@
 import csv
-import xml.etree.ElementTree as ET
 import argparse
+import itertools
 import os
-import datetime
+import android_xml
+import columnar
+import compressed
+import xml_chunks
+from instrumentation import Progress, metrics, profiled
 
-def indent(elem, level=0):
+# Attributes of each <sms> element, in schema order. None marks the values
+# taken from the message (see sms_values); the rest are the same on every row.
+SMS_ELEMENT = android_xml.ElementFormat("sms", (
+    # Required attributes with defaults if missing:
+    ("address", None),
+    ("date", None),
+    ("body", None),
+    ("type", None),
+    ("read", None),
+    ("status", "-1"),
+    # Optional attributes (set to "null" as per the example XML):
+    ("protocol", "0"),
+    ("subject", "null"),
+    ("toa", "null"),
+    ("sc_toa", "null"),
+    ("service_center", "null"),
+    ("locked", "0"),
+    # Use readable date if available, otherwise set to "null":
+    ("readable_date", None),
+    ("contact_name", None),
+    ("date_sent", "0"),
+    ("sub_id", "-1"),  # Add sub_id attribute
+))
+
+
+def iter_csv_dicts(csvfile):
+    """
+    Yields each row of an open CSV file as a dict keyed by the header.
+
+    A leaner csv.DictReader: blank lines are skipped and short rows simply
+    lack the missing keys.
+    """
+    reader = csv.reader(csvfile)
+    fieldnames = next(reader, None)
+    if fieldnames is None:
+        return
+    for row in reader:
+        if row:
+            yield dict(zip(fieldnames, row))
+
+
+def sms_values(msg):
+    """
+    Returns the variable <sms> attributes of one message, in SMS_ELEMENT order.
+
+    Args:
+        msg (dict): A message row as written by sms_convert_to_csv.
+    """
+    received = str(msg.get("is_from_me")) == '0'  # csv stores as str not int
+    return (
+        msg.get("phone_number", ""),
+        str(msg.get("date", "")),
+        msg.get("body", ""),
+        "1" if received else "2",
+        "1" if received else "0",  # Assuming from_me = 0 is read
+        msg.get("readable_date", "null"),
+        msg.get("contact_name") or "(Unknown)",  # Empty without an address book
+    )
+
+
+# Columns of a Parquet/Arrow file that sms_value_columns() reads.
+SMS_COLUMNS = ["phone_number", "date", "body", "is_from_me", "readable_date", "contact_name"]
+
+
+def sms_value_columns(batch):
+    """
+    Returns the variable <sms> attributes of a batch of typed rows, in SMS_ELEMENT order.
+
+    The column-wise counterpart of sms_values() for Parquet/Arrow files
+    (see columnar): missing strings become "", as they are in the CSV.
+
+    Args:
+        batch (pyarrow.RecordBatch): SMS_COLUMNS of messages written by sms_convert_to_csv.
     """
-    In-place pretty-printing for XML.  This function is a workaround
-    for the missing 'pretty_print' argument in some ElementTree versions.
+    import pyarrow.compute as pc
+    received = pc.fill_null(pc.equal(batch["is_from_me"], 0), False)
+    contact_name = batch["contact_name"]
+    return (
+        pc.fill_null(batch["phone_number"], ""),
+        pc.cast(batch["date"], "string"),
+        pc.fill_null(batch["body"], ""),
+        pc.if_else(received, "1", "2"),
+        pc.if_else(received, "1", "0"),
+        pc.fill_null(batch["readable_date"], ""),
+        pc.if_else(pc.fill_null(pc.not_equal(contact_name, ""), False), contact_name, "(Unknown)"),
+    )
+
+
+def table_to_xml(table_file, xml_file):
     """
-    i = "\n" + level*"  "
-    if len(elem):
-        if not elem.text or not elem.text.strip():
-            elem.text = i + "  "
-        if not elem.tail or not elem.tail.strip():
-            elem.tail = i
-        for elem in elem:
-            indent(elem, level+1)
-        if not elem.tail or not elem.tail.strip():
-            elem.tail = i
-    else:
-        if level and (not elem.tail or not elem.tail.strip()):
-            elem.tail = i
+    Converts a Parquet or Arrow file of messages (see columnar) to XML, a batch at a time.
+
+    Returns:
+        int: Number of messages written, or None if no XML was written.
+    """
+    try:
+        if columnar.row_count(table_file) == 0:
+            print("Input file is empty. No XML generated.")
+            return
+        count = columnar.table_to_xml(table_file, xml_file, "smses", SMS_ELEMENT, SMS_COLUMNS, sms_value_columns, "Writing messages")
+    except Exception as e:
+        print(f"Error converting '{table_file}' to '{xml_file}': {e}")
+        return
+    print(f"Successfully converted '{table_file}' to '{xml_file}'")
+    return count
+
 
 def csv_to_xml(csv_file, xml_file):
     """
     Converts a CSV file containing SMS data to an XML file conforming to a specific schema.
 
+    Rows are streamed from the CSV straight into the XML file in one pass, so
+    memory use stays flat; the root 'count' is filled in once all rows are written.
+    A Parquet or Arrow file (see columnar) is read column-wise instead.
+
     Args:
-        csv_file (str): Path to the input CSV file.
+        csv_file (str): Path to the input CSV (or .parquet / .arrow) file.
         xml_file (str): Path to the output XML file.
+
+    Returns:
+        int: Number of messages written, or None if no XML was written.
     """
 
     if not os.path.exists(csv_file):
         print(f"Error: CSV file '{csv_file}' not found.")
         return
 
-    try:
-        with open(csv_file, 'r', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            messages = list(reader)  # Read all rows into a list of dictionaries
+    if columnar.table_format(csv_file):
+        return table_to_xml(csv_file, xml_file)
 
-    except FileNotFoundError:
-        print(f"Error: CSV file '{csv_file}' not found.")
-        return
+    try:
+        csvfile = compressed.open_file(csv_file, 'r', encoding='utf-8')
+        rows = iter_csv_dicts(csvfile)
+        first = next(rows, None)
     except Exception as e:
         print(f"Error reading CSV file: {e}")
         return
 
-    if not messages:
-        print("CSV file is empty. No XML generated.")
+    with csvfile:
+        if first is None:
+            print("CSV file is empty. No XML generated.")
+            return
+
+        try:
+            progress = Progress("Writing messages")
+            with android_xml.BackupWriter(xml_file, "smses") as writer:
+                for msg in itertools.chain((first,), rows):
+                    writer.write(SMS_ELEMENT, sms_values(msg))
+                    progress.update()
+            progress.close()
+            print(f"Successfully converted '{csv_file}' to '{xml_file}'")
+            return writer.count
+        except Exception as e:
+            print(f"Error writing XML to '{xml_file}': {e}")
+
+def csv_to_xml_chunks(csv_file, xml_file, max_rows=None, max_bytes=None, workers=1):
+    """
+    Converts a CSV file of messages to several XML backups of at most max_rows elements or max_bytes bytes each.
+
+    See xml_chunks.write_chunks(); the files are named after xml_file and
+    the dates they cover, e.g. "output-001-20230105-20230412.xml".
+
+    Returns:
+        int: Number of messages written, or None if no XML was written.
+    """
+    if not os.path.exists(csv_file):
+        print(f"Error: CSV file '{csv_file}' not found.")
         return
 
-    root = ET.Element("smses")
-    root.set("count", str(len(messages)))
-
-    for msg in messages:
-        sms = ET.SubElement(root, "sms")
-
-        # Required attributes with defaults if missing:
-        sms.set("address", msg.get("phone_number", ""))
-        # # Convert readable date back to Java timestamp if possible, else use 0
-        # try:
-        #    date_obj = datetime.datetime.strptime(msg.get("date", ""), "%Y-%m-%d %H:%M:%S")
-        #    java_timestamp = int(date_obj.timestamp() * 1000)
-        # except:
-        #     try:
-        #       #try java time stamp format
-        #       java_timestamp = int(msg.get("date","0"))
-        #     except:
-        #       java_timestamp = 0  # Default if conversion fails
-        # sms.set("date", str(java_timestamp))
-        sms.set("date", msg.get("date", ""))
-        sms.set("body", msg.get("body", ""))
-        sms.set("type", "1" if msg.get("is_from_me") == '0' else "2") # csv stores as str not int
-        sms.set("read", "1" if msg.get("is_from_me") == '0' else "0") # Assuming from_me = 0 is read
-        sms.set("status", "-1")
-
-        # Optional attributes (set to "null" as per the example XML):
-        sms.set("protocol", "0")
-        sms.set("subject", "null")
-        sms.set("toa", "null")
-        sms.set("sc_toa", "null")
-        sms.set("service_center", "null")
-        sms.set("locked", "0")
-        # Use readable date if available, otherwise set to "null":
-        sms.set("readable_date", msg.get("readable_date", "null"))
-        sms.set("contact_name", "(Unknown)")  # Default value
-        sms.set("date_sent", "0")
-        sms.set("sub_id", "-1")  # Add sub_id attribute
-        
-    tree = ET.ElementTree(root)
     try:
-        indent(root)  # Apply pretty-printing
-        tree.write(xml_file, encoding="utf-8", xml_declaration=True) # removed pretty_print
-        print(f"Successfully converted '{csv_file}' to '{xml_file}'")
+        chunks = xml_chunks.write_chunks(csv_file, xml_file, "smses", SMS_ELEMENT, sms_values, max_rows, max_bytes, workers,
+                                         label="Writing messages", columns=SMS_COLUMNS, value_columns=sms_value_columns)
     except Exception as e:
-        print(f"Error writing XML to '{xml_file}': {e}")
+        print(f"Error writing XML chunks for '{xml_file}': {e}")
+        return
+    if not chunks:
+        print("CSV file is empty. No XML generated.")
+        return
+    for path, count in chunks:
+        print(f"  {path}: {count} messages")
+    print(f"Successfully converted '{csv_file}' to {len(chunks)} XML files")
+    return sum(count for _, count in chunks)
 
 def main():
     parser = argparse.ArgumentParser(description="Convert a CSV file of SMS messages to XML.")
     parser.add_argument("csv_file", help="Path to the input CSV file")
     parser.add_argument("-o", "--output", default="output.xml", help="Output XML file name (default: output.xml)")
 
+    xml_chunks.add_chunk_options(parser)
+    parser.add_argument("--timing", action="store_true", help="Report the duration and throughput of the conversion")
+    parser.add_argument("--profile", metavar="FILE", default=None, help="Profile the run with cProfile and write the stats to FILE")
+
     args = parser.parse_args()
-    csv_to_xml(args.csv_file, args.output)
+    with profiled(args.profile), metrics.stage("csv_to_xml") as stage:
+        if args.chunk_rows or args.chunk_size:
+            stage.rows = csv_to_xml_chunks(args.csv_file, args.output, args.chunk_rows, args.chunk_size, args.workers)
+        else:
+            stage.rows = csv_to_xml(args.csv_file, args.output)
+    if args.timing:
+        metrics.report()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
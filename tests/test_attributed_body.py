@@ -0,0 +1,41 @@
+import importlib.util
+import unittest
+import attributed_body
+from benchmarks.fixtures import attributed_body_blob
+
+TEXTS = {
+    "empty": "",
+    "non-BMP and emoji": "On my way 😀👍🏽 ❤️ 𝄞 中文",
+    "2-byte length": "x" * 200,  # 200 bytes: above 0x7f, prefixed with INT16_TAG
+    "4-byte length": "lunch tomorrow? " * 4096,  # 64 KiB: above 0x7fff, prefixed with INT32_TAG
+}
+
+
+class FastPathTest(unittest.TestCase):
+
+    def test_fixture_blobs_take_the_fast_path(self):
+        for name, text in TEXTS.items():
+            with self.subTest(name):
+                counts = attributed_body.DecoderStats()
+                self.assertEqual(attributed_body.decode(attributed_body_blob(text), counts), text)
+                self.assertEqual((counts.fast_path, counts.fallback), (1, 0))
+
+    def test_other_layouts_are_left_to_typedstream(self):
+        blob = attributed_body_blob("hello")
+        self.assertIsNone(attributed_body.decode_fast(blob[1:]))
+        self.assertIsNone(attributed_body.decode_fast(blob.replace(b"hello\x86", b"hello\x85")))
+        self.assertIsNone(attributed_body.decode_fast(blob[:len(attributed_body.STRING_PREFIX) + 3]))
+
+
+@unittest.skipUnless(importlib.util.find_spec("typedstream"), "typedstream is not installed")
+class DifferentialTest(unittest.TestCase):
+
+    def test_fast_path_matches_typedstream(self):
+        for name, text in TEXTS.items():
+            with self.subTest(name):
+                blob = attributed_body_blob(text)
+                self.assertEqual(attributed_body.decode_fast(blob), attributed_body.decode_typedstream(blob))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import os
+import tempfile
+import unittest
+import phone_numbers
+from dedup_index import ContentIndex, content_hash
+
+DATE = 1700000000123
+BODY = "See you at 8"
+
+
+class ContentIndexTest(unittest.TestCase):
+
+    def tearDown(self):
+        phone_numbers.set_country()
+
+    def test_international_form_matches_national_form(self):
+        phone_numbers.set_country("33")
+        index = ContentIndex([content_hash("+33 6 12 34 56 78", DATE, BODY)])
+        self.assertIn({"phone_number": "06 12 34 56 78", "date": DATE, "body": BODY}, index)
+        self.assertIn({"phone_number": "0033612345678", "date": DATE + 500, "body": BODY}, index)
+
+    def test_unrelated_numbers_with_the_same_digits_stay_distinct(self):
+        phone_numbers.set_country("33")
+        index = ContentIndex([content_hash("+1 361 234 5678", DATE, BODY)])
+        self.assertNotIn({"phone_number": "+33 6 12 34 56 78", "date": DATE, "body": BODY}, index)
+        self.assertNotIn({"phone_number": "06 12 34 56 78", "date": DATE, "body": BODY}, index)
+
+    def test_from_xml_matches_the_national_form(self):
+        phone_numbers.set_country("61")
+        with tempfile.TemporaryDirectory() as directory:
+            xml_file = os.path.join(directory, "backup.xml")
+            with open(xml_file, "w", encoding="utf-8") as f:
+                f.write(f'<smses count="1"><sms address="+61 412 345 678" date="{DATE}" body="{BODY}" /></smses>')
+            index = ContentIndex.from_xml(xml_file)
+        self.assertIn({"phone_number": "0412 345 678", "date": DATE, "body": BODY}, index)
+        self.assertNotIn({"phone_number": "0412 345 678", "date": DATE, "body": "Something else"}, index)
+
+
+if __name__ == "__main__":
+    unittest.main()
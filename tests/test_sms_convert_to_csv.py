@@ -0,0 +1,35 @@
+import unittest
+from records import Message
+from sms_convert_to_csv import dedup_messages, sort_dedup_messages
+
+DATE = 700000000000000000  # Raw sms.db date (nanoseconds since 2001)
+
+
+def message(rowid, body="", service="iMessage", attachments=None):
+    record = Message(rowid, DATE, None, body, "+15551234567", 1, None, service)
+    if attachments is not None:
+        record.attachments = [(filename, "image/jpeg", filename.rsplit("/", 1)[-1]) for filename in attachments]
+        record.recipients = ["+15551234567"]
+    return record
+
+
+class DuplicateTest(unittest.TestCase):
+
+    def test_photos_sent_in_the_same_second_are_kept(self):
+        photos = [message(rowid, attachments=[f"~/Library/SMS/Attachments/0{rowid}/IMG_000{rowid}.jpeg"])
+                  for rowid in (1, 2, 3)]
+        self.assertEqual([m.rowid for m in dedup_messages(photos)], [1, 2, 3])
+        self.assertEqual([m.rowid for m in sort_dedup_messages(photos)], [1, 2, 3])
+
+    def test_imessage_and_sms_copies_collapse_to_the_sms(self):
+        copies = [message(1, "On my way", "iMessage"), message(2, "On my way", "SMS")]
+        self.assertEqual([m.rowid for m in dedup_messages(copies)], [2])
+        self.assertEqual([m.rowid for m in sort_dedup_messages(copies)], [2])
+
+    def test_text_copies_read_for_mms_still_collapse(self):
+        copies = [message(1, "On my way", "iMessage", attachments=[]), message(2, "On my way", "SMS", attachments=[])]
+        self.assertEqual([m.rowid for m in dedup_messages(copies)], [2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,16 @@
+import unittest
+from benchmarks import startup
+
+
+class StartupTest(unittest.TestCase):
+    """Every command-line module imports within budget and without heavy dependencies (see benchmarks.startup)."""
+
+    def test_scripts_start_quickly(self):
+        for module in startup.SCRIPTS:
+            with self.subTest(module):
+                elapsed, problems = startup.check_module(module)
+                self.assertEqual(problems, [], f"{module} takes {elapsed:.1f} ms to import")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,405 @@
+import argparse
+import collections
+import concurrent.futures
+import io
+import itertools
+import os
+import time
+import android_xml
+import columnar
+import compressed
+from instrumentation import Progress, metrics
+
+# Rows of the CSV rendered up front to estimate how many XML bytes each CSV
+# byte becomes, so pieces handed to the workers fill a chunk of --chunk-size.
+CALIBRATION_ROWS = 1000
+PIECE_FILL = 0.95  # Fraction of --chunk-size a piece aims for; the rest absorbs the estimate's error
+# Each piece of a Parquet/Arrow file decodes the row groups it overlaps, so
+# pieces of small chunks are grouped to at least this many rows.
+MIN_TABLE_PIECE_ROWS = 4096
+UNKNOWN_DATE = "unknown"
+
+
+def byte_size(text):
+    """Parses a size such as 500000, 512K, 20M or 1G (powers of 1024) for argparse."""
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    text = text.strip().upper().removesuffix("B")
+    try:
+        if text and text[-1] in units:
+            size = int(float(text[:-1]) * units[text[-1]])
+        else:
+            size = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size: '{text}'")
+    if size <= 0:
+        raise argparse.ArgumentTypeError("size must be positive")
+    return size
+
+
+def positive_int(text):
+    """Parses a count that must be at least 1 (--chunk-rows, --workers) for argparse."""
+    try:
+        value = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid count: '{text}'")
+    if value <= 0:
+        raise argparse.ArgumentTypeError("count must be positive")
+    return value
+
+
+def add_chunk_options(parser):
+    """Adds --chunk-rows, --chunk-size and --workers to a csv_to_xml command line."""
+    parser.add_argument("--chunk-rows", type=positive_int, default=None, metavar="N",
+                        help="Split the XML into files of at most N elements (see xml_chunks)")
+    parser.add_argument("--chunk-size", type=byte_size, default=None, metavar="SIZE",
+                        help="Split the XML into files of at most SIZE bytes, e.g. 20M")
+    parser.add_argument("--workers", type=positive_int, default=os.cpu_count(),
+                        help="Processes writing chunks (default: number of CPUs; 1 writes them in this process)")
+
+
+def _iter_rows(f, offset):
+    # Yields the complete CSV rows of a binary file from its position (offset)
+    # on, as (offset after the row, row bytes). A newline only ends a row when
+    # the quotes before it are balanced; quoted fields may span lines.
+    row = []
+    for line in f:
+        offset += len(line)
+        if row:
+            row.append(line)
+            if sum(part.count(b'"') for part in row) % 2 == 0:
+                yield offset, b"".join(row)
+                row = []
+        elif line.count(b'"') % 2 == 0:
+            yield offset, line
+        else:
+            row.append(line)
+    if row:
+        yield offset, b"".join(row)
+
+
+def _csv_rows(f, header, rows):
+    # The first rows rows of a text file, as dicts keyed by the CSV header.
+    from sms_csv_to_xml import iter_csv_dicts
+    return itertools.islice(iter_csv_dicts(itertools.chain((header,), f)), rows)
+
+
+def _output_ratio(csv_file, element_format, values):
+    """Returns the XML bytes written per CSV byte, measured on the first CALIBRATION_ROWS rows."""
+    with compressed.open_file(csv_file, "rb") as f:
+        start = len(f.readline())
+        csv_bytes = 0
+        for csv_bytes, _ in itertools.islice(_iter_rows(f, start), CALIBRATION_ROWS):
+            csv_bytes -= start
+    if not csv_bytes:
+        return 1.0
+    with compressed.open_file(csv_file, encoding="utf-8") as f:
+        xml_bytes = sum(len(element_format.render(values(row)).encode("utf-8"))
+                        for row in _csv_rows(f, next(f), CALIBRATION_ROWS))
+    return max(xml_bytes / csv_bytes, 0.01)
+
+
+def iter_pieces(csv_file, piece_rows=None, piece_bytes=None, keep_data=False):
+    """
+    Splits a CSV file into pieces of whole rows, each handed to one worker.
+
+    Args:
+        keep_data (bool): Also return the bytes of each piece, for files the
+            workers cannot seek in (compressed ones).
+
+    Yields:
+        tuple: (start offset, rows, data) of each piece, data being None
+        unless keep_data is set; a piece ends once it has piece_rows rows or
+        piece_bytes bytes (uncompressed). The header is not included.
+    """
+    with compressed.open_file(csv_file, "rb") as f:
+        start = len(f.readline())
+        rows = 0
+        data = []
+        for offset, row in _iter_rows(f, start):
+            if keep_data:
+                data.append(row)
+            if row in (b"\n", b"\r\n"):
+                continue  # Blank lines are not rows (see sms_csv_to_xml.iter_csv_dicts())
+            rows += 1
+            if (piece_rows and rows >= piece_rows) or (piece_bytes and offset - start >= piece_bytes):
+                yield start, rows, b"".join(data) if keep_data else None
+                start = offset
+                rows = 0
+                data = []
+        if rows:
+            yield start, rows, b"".join(data) if keep_data else None
+
+
+def _date(value):
+    try:
+        return int(value or 0)
+    except ValueError:
+        return 0
+
+
+def _write_files(value_rows, prefix, root_tag, element_format, max_rows, max_bytes):
+    # Writes the elements of value_rows to as many files as the caps need;
+    # see write_piece().
+    date_index = element_format.names.index("date")
+    files = []
+    writer = None
+    path = None
+    try:
+        for values in value_rows:
+            element = element_format.render(values).encode("utf-8")
+            if writer is not None and ((max_rows and writer.count >= max_rows)
+                                       or (max_bytes and size + len(element) > max_bytes)):
+                files.append((path, writer.close(), oldest, newest))
+                writer = None
+            date = _date(values[date_index])
+            if writer is None:
+                path = f"{prefix}.{len(files)}.part"
+                writer = android_xml.BackupWriter(path, root_tag)
+                size = writer.size
+                oldest = newest = date
+            writer.write_rendered(element)
+            size += len(element)
+            oldest = min(oldest, date)
+            newest = max(newest, date)
+        if writer is not None:
+            files.append((path, writer.close(), oldest, newest))
+            writer = None
+    except BaseException:
+        # Leave no partial output behind; the caller sees the exception.
+        if writer is not None:
+            writer.close()
+            os.remove(path)
+        _remove(files)
+        raise
+    return files
+
+
+def write_piece(csv_file, header, start, rows, data, prefix, root_tag, element_format, values, max_rows, max_bytes):
+    """
+    Writes the rows of one piece of a CSV file to one or more XML files.
+
+    Runs in a worker process. A new file is started whenever the next
+    element would take the current one past max_rows elements or max_bytes
+    bytes (a single element larger than max_bytes still gets its own file).
+
+    Args:
+        csv_file (str): The CSV file.
+        header (str): Its header line.
+        start (int): Byte offset of the piece (from iter_pieces()).
+        rows (int): Rows in the piece.
+        data (bytes): The piece itself when csv_file cannot be read from start (see iter_pieces()).
+        prefix (str): Path prefix of the files written; each gets ".<n>.part" appended.
+        root_tag (str): "smses" or "calls".
+        element_format (android_xml.ElementFormat): Format of each element.
+        values (callable): Returns the variable attribute values of a CSV row dict.
+        max_rows (int): Element cap per file, or None.
+        max_bytes (int): Size cap per file, or None.
+
+    Returns:
+        list: (path, elements, oldest date, newest date) of each file, in order.
+    """
+    with (open(csv_file, "rb") if data is None else io.BytesIO(data)) as f:
+        if data is None:
+            f.seek(start)
+        # Read like csv_to_xml() does (universal newlines), so the chunks
+        # hold exactly the elements of the single file.
+        text = io.TextIOWrapper(f, encoding="utf-8")
+        value_rows = map(values, _csv_rows(text, header, rows))
+        return _write_files(value_rows, prefix, root_tag, element_format, max_rows, max_bytes)
+
+
+def write_table_piece(table_file, start, rows, columns, value_columns, prefix, root_tag, element_format, max_rows,
+                      max_bytes):
+    """
+    Like write_piece(), for rows [start, start + rows) of a Parquet or Arrow file.
+
+    Each batch is rendered at once (see columnar.iter_elements()); the caps
+    are applied to the element sizes with numpy, and the elements that go
+    to one file are written in one go.
+    """
+    import numpy as np
+    import pyarrow.compute as pc
+    files = []
+    writer = None
+    path = None
+    try:
+        for batch, elements in columnar.iter_elements(table_file, columns, value_columns, element_format, start, rows):
+            ends = np.cumsum(pc.binary_length(elements).to_numpy())  # Bytes up to the end of each element
+            dates = pc.fill_null(batch["date"], 0).to_numpy()
+            position = 0
+            while position < len(elements):
+                if writer is None:
+                    path = f"{prefix}.{len(files)}.part"
+                    writer = android_xml.BackupWriter(path, root_tag)
+                    size = writer.size
+                    oldest = newest = int(dates[position])
+                before = ends[position - 1] if position else 0
+                n = len(elements) - position
+                if max_rows:
+                    n = min(n, max_rows - writer.count)
+                if max_bytes:
+                    n = min(n, int(np.searchsorted(ends[position:], before + max_bytes - size, side="right")))
+                if n <= 0 and writer.count:
+                    files.append((path, writer.close(), oldest, newest))
+                    writer = None
+                    continue
+                n = max(n, 1)  # An element larger than max_bytes gets a file of its own
+                writer.write_elements(elements.slice(position, n))
+                size += int(ends[position + n - 1] - before)
+                oldest = min(oldest, int(dates[position:position + n].min()))
+                newest = max(newest, int(dates[position:position + n].max()))
+                position += n
+        if writer is not None:
+            files.append((path, writer.close(), oldest, newest))
+            writer = None
+    except BaseException:
+        if writer is not None:
+            writer.close()
+            os.remove(path)
+        _remove(files)
+        raise
+    return files
+
+
+def _remove(files):
+    for path, _, _, _ in files:
+        os.remove(path)
+
+
+def _day(date):
+    if date <= 0:
+        return UNKNOWN_DATE
+    try:
+        return time.strftime("%Y%m%d", time.localtime(date / 1000))
+    except (OverflowError, OSError, ValueError):
+        return UNKNOWN_DATE
+
+
+def chunk_name(xml_file, number, width, oldest, newest):
+    """
+    Returns the path of chunk number (from 1) of xml_file.
+
+    "sms.xml" becomes "sms-001-20230105-20230412.xml": the number keeps the
+    chunks in order, the local days of the oldest and newest element tell
+    which one to restore first.
+    """
+    stem, ext = os.path.splitext(xml_file)
+    return f"{stem}-{number:0{width}d}-{_day(oldest)}-{_day(newest)}{ext or '.xml'}"
+
+
+def _run_pieces(jobs, workers):
+    # Yields the result of each (function, arguments) job, in order. Jobs are
+    # submitted lazily, at most two per worker ahead of the one being waited on.
+    if workers <= 1:
+        for function, arguments in jobs:
+            yield function(*arguments)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = collections.deque()
+        try:
+            for function, arguments in jobs:
+                pending.append(pool.submit(function, *arguments))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        except BaseException:
+            # Pieces already written by the workers are not wanted any more.
+            for future in pending:
+                if not future.cancel() and future.exception() is None:
+                    _remove(future.result())
+            raise
+
+
+def _csv_jobs(csv_file, prefix, root_tag, element_format, values, max_rows, max_bytes):
+    piece_bytes = None
+    if max_bytes:
+        piece_bytes = max(int(max_bytes * PIECE_FILL / _output_ratio(csv_file, element_format, values)), 1)
+    with compressed.open_file(csv_file, encoding="utf-8") as f:
+        header = f.readline()
+    pieces = iter_pieces(csv_file, max_rows, piece_bytes, keep_data=compressed.compression(csv_file) is not None)
+    for i, (start, rows, data) in enumerate(pieces):
+        yield write_piece, (csv_file, header, start, rows, data, f"{prefix}.{i}", root_tag, element_format, values,
+                            max_rows, max_bytes)
+
+
+def _table_jobs(table_file, prefix, root_tag, element_format, columns, value_columns, max_rows, max_bytes):
+    # Pieces of a typed file are row ranges: its metadata gives the row count
+    # and the workers read only the row groups / batches of their range.
+    total = columnar.row_count(table_file)
+    piece_rows = max_rows
+    if max_bytes:
+        import pyarrow.compute as pc
+        rows = size = 0
+        for _, elements in columnar.iter_elements(table_file, columns, value_columns, element_format, 0, CALIBRATION_ROWS):
+            rows += len(elements)
+            size += pc.sum(pc.binary_length(elements)).as_py() or 0
+        fit = max(int(max_bytes * PIECE_FILL * rows / max(size, 1)), 1)
+        piece_rows = min(piece_rows or fit, fit)
+    piece_rows *= -(-MIN_TABLE_PIECE_ROWS // piece_rows)  # Whole chunks per piece
+    for i, start in enumerate(range(0, total, piece_rows)):
+        yield write_table_piece, (table_file, start, min(piece_rows, total - start), columns, value_columns,
+                                  f"{prefix}.{i}", root_tag, element_format, max_rows, max_bytes)
+
+
+def write_chunks(csv_file, xml_file, root_tag, element_format, values, max_rows=None, max_bytes=None,
+                 workers=1, label="Writing chunks", columns=None, value_columns=None):
+    """
+    Converts a CSV file to a series of XML backups of at most max_rows elements / max_bytes bytes each.
+
+    The CSV is cut into pieces of whole rows that are serialized by worker
+    processes in parallel; each piece becomes one or more complete backups
+    with their own root count. Files are numbered in CSV order, which is
+    date order for the converters' output, and named after their date
+    range (see chunk_name()). A compressed CSV is decompressed once, here,
+    and each piece is sent to its worker. A Parquet or Arrow file (see
+    columnar) is cut into row ranges that the workers read themselves.
+
+    Args:
+        csv_file (str): CSV (or .parquet / .arrow file) written by sms_convert_to_csv or call_convert_to_csv.
+        xml_file (str): Output name the chunk names are derived from.
+        root_tag (str): "smses" or "calls".
+        element_format (android_xml.ElementFormat): Format of each element.
+        values (callable): Returns the variable attribute values of a CSV row
+            dict. Must be a module-level function so workers can receive it.
+        max_rows (int): Element cap per file.
+        max_bytes (int): Size cap per file.
+        workers (int): Worker processes; 1 writes every chunk in this process.
+        label (str): Progress label.
+        columns (list): Columns read from a Parquet/Arrow file.
+        value_columns (callable): Column-wise values for a Parquet/Arrow file
+            (e.g. sms_csv_to_xml.sms_value_columns()), module-level as well.
+
+    Returns:
+        list: (path, elements) of each chunk written, oldest first.
+    """
+    if not max_rows and not max_bytes:
+        raise ValueError("write_chunks() needs max_rows or max_bytes")
+    directory = os.path.dirname(os.path.abspath(xml_file))
+    prefix = os.path.join(directory, f".{os.path.basename(xml_file)}.{os.getpid()}")
+    if columnar.table_format(csv_file):
+        if value_columns is None:
+            raise ValueError("write_chunks() needs columns and value_columns for a Parquet/Arrow file")
+        jobs = _table_jobs(csv_file, prefix, root_tag, element_format, columns, value_columns, max_rows, max_bytes)
+    else:
+        jobs = _csv_jobs(csv_file, prefix, root_tag, element_format, values, max_rows, max_bytes)
+
+    parts = []
+    progress = Progress(label)
+    try:
+        for files in _run_pieces(jobs, workers):
+            parts.extend(files)
+            progress.update(sum(count for _, count, _, _ in files))
+    except BaseException:
+        _remove(parts)
+        raise
+    progress.close()
+
+    width = max(3, len(str(len(parts))))
+    chunks = []
+    for number, (path, count, oldest, newest) in enumerate(parts, 1):
+        name = chunk_name(xml_file, number, width, oldest, newest)
+        os.replace(path, name)
+        chunks.append((name, count))
+    metrics.count("chunks written", len(chunks))
+    return chunks